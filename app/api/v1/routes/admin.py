@@ -0,0 +1,85 @@
+import secrets
+from typing import Optional
+from fastapi import APIRouter, Depends, Header, HTTPException
+from fastapi.responses import JSONResponse
+from config import ADMIN_TOKEN
+from dependencies import get_dataset_manager, get_recommendation_service, get_worker_pool
+from services.recommendation.service import RecommendationService
+from utils.dataset_manager import DatasetManager
+from utils.logger import setup_colored_logger
+from utils.worker_pool import WorkerPool
+
+logger = setup_colored_logger(__name__)
+
+
+def verify_admin_token(x_admin_token: Optional[str] = Header(default=None)):
+    if not ADMIN_TOKEN:
+        raise HTTPException(
+            status_code=503,
+            detail={
+                "error": "Admin endpoints disabled",
+                "message": "Set ADMIN_TOKEN to enable the admin endpoints"
+            }
+        )
+    if x_admin_token is None or not secrets.compare_digest(x_admin_token.encode("utf-8"), ADMIN_TOKEN.encode("utf-8")):
+        raise HTTPException(
+            status_code=403,
+            detail={
+                "error": "Forbidden",
+                "message": "Invalid admin token"
+            }
+        )
+
+
+router = APIRouter(
+    prefix="/admin",
+    tags=["admin"],
+    dependencies=[Depends(verify_admin_token)]
+)
+
+@router.post(
+    "/reload",
+    responses={
+        202: {"description": "Reload started, or queued after the reload in progress"}
+    }
+)
+async def reload_dataset(
+    dataset_manager: DatasetManager = Depends(get_dataset_manager)
+) -> JSONResponse:
+    """
+    Rebuild the dataset and its indexes in the background and swap them in when ready.
+    
+    Requests keep being served from the current dataset snapshot in the meantime.
+    A reload requested while another one runs is queued to run after it.
+    """
+    started = dataset_manager.reload()
+    logger.info(f"Dataset reload requested, started: {started}")
+    return JSONResponse(
+        content={"started": started, **dataset_manager.reload_status()},
+        status_code=202
+    )
+
+@router.get("/dataset")
+async def dataset_status(
+    dataset_manager: DatasetManager = Depends(get_dataset_manager)
+) -> dict:
+    """Get the version of the current dataset snapshot and the state of reloads."""
+    return dataset_manager.reload_status()
+
+@router.get("/cache")
+async def cache_stats(
+    dataset_manager: DatasetManager = Depends(get_dataset_manager),
+    recommendation_service: RecommendationService = Depends(get_recommendation_service)
+) -> dict:
+    """Get statistics of the dataset cache and of the recommendation result cache."""
+    return {
+        "dataset_cache": dataset_manager.get_cache_stats(),
+        "result_cache": recommendation_service.result_cache.get_stats(),
+    }
+
+@router.get("/workers")
+async def worker_stats(
+    worker_pool: WorkerPool = Depends(get_worker_pool)
+) -> dict:
+    """Get statistics of the pool running the recommendation engine."""
+    return worker_pool.get_stats()
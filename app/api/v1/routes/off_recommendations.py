@@ -2,12 +2,16 @@ from fastapi import APIRouter, HTTPException, Body
 from models.schemas.product_recommendation import (
     ProductRecommendationResponse, 
     ProductRecommendationRequest, 
+    BatchRecommendationRequest,
+    BatchRecommendationResponse,
 )
 from time import time
 from fastapi import Depends
 from dependencies import get_recommendation_service
 from services.recommendation.service import RecommendationService
 from utils.logger import setup_colored_logger
+from utils.dataset_manager import DatasetNotReadyError
+from utils.worker_pool import WorkerPoolBusyError
 
 logger = setup_colored_logger(__name__)
 
@@ -22,7 +26,8 @@ router = APIRouter(
     responses={
         200: {"description": "Successful response"},
         400: {"description": "Invalid request parameters"},
-        500: {"description": "Internal server error"}
+        500: {"description": "Internal server error"},
+        503: {"description": "No free worker within the queue timeout, or dataset still loading"}
     }
 )
 async def get_recommendations_for_product(
@@ -44,8 +49,7 @@ async def get_recommendations_for_product(
         recommendations = await recommendation_service.generate_recommendations(request)
         generation_time = time() - start_time
         
-        logger.info(f"product_id: {request.product_code}")
-        logger.info(f"Generated {len(recommendations)} recommendations in {generation_time:.2f} seconds")
+        logger.info("Generated %d recommendations for %s in %.2f seconds", len(recommendations), request.product_code, generation_time)
         
         return ProductRecommendationResponse(
             source_product_code=request.product_code,
@@ -61,8 +65,97 @@ async def get_recommendations_for_product(
                 "message": str(e)
             }
         )
+    except WorkerPoolBusyError as e:
+        raise HTTPException(
+            status_code=503,
+            detail={
+                "error": "Service busy",
+                "message": str(e)
+            }
+        )
+    except DatasetNotReadyError as e:
+        raise HTTPException(
+            status_code=503,
+            detail={
+                "error": "Service not ready",
+                "message": str(e)
+            }
+        )
+    except Exception as e:
+        logger.exception("Error generating recommendations for %s", request.product_code)
+        raise HTTPException(
+            status_code=500, 
+            detail={
+                "error": "Internal server error",
+                "message": str(e)
+            }
+        )
+
+
+@router.post(
+    "/recommendations/batch/",
+    response_model=BatchRecommendationResponse,
+    responses={
+        200: {"description": "Successful response, failed items carry an error"},
+        400: {"description": "Invalid request parameters"},
+        500: {"description": "Internal server error"},
+        503: {"description": "No free worker within the queue timeout, or dataset still loading"}
+    }
+)
+async def get_recommendations_for_products(
+    request: BatchRecommendationRequest = Body(...),
+    recommendation_service: RecommendationService = Depends(get_recommendation_service)
+) -> BatchRecommendationResponse:
+    """
+    Get product recommendations for many products in one call.
+    
+    Args:
+        request: BatchRecommendationRequest containing either items, or product_codes with a shared limit and preferences
+        recommendation_service: Injected recommendation service
+        
+    Returns:
+        BatchRecommendationResponse with the result of every item
+    """
+    try:
+        start_time = time()
+        results = await recommendation_service.generate_recommendations_batch(request)
+        generation_time = time() - start_time
+        
+        total_failed = sum(1 for result in results if result.error is not None)
+        logger.info("Generated recommendations for %d products in %.2f seconds, %d failed", len(results), generation_time, total_failed)
+        
+        return BatchRecommendationResponse(
+            results=results,
+            total_succeeded=len(results) - total_failed,
+            total_failed=total_failed
+        )
+        
+    except ValueError as e:
+        raise HTTPException(
+            status_code=400,
+            detail={
+                "error": "Validation error",
+                "message": str(e)
+            }
+        )
+    except WorkerPoolBusyError as e:
+        raise HTTPException(
+            status_code=503,
+            detail={
+                "error": "Service busy",
+                "message": str(e)
+            }
+        )
+    except DatasetNotReadyError as e:
+        raise HTTPException(
+            status_code=503,
+            detail={
+                "error": "Service not ready",
+                "message": str(e)
+            }
+        )
     except Exception as e:
-        logger.exception(f"Error generating recommendations for {request.product_code}")
+        logger.exception("Error generating batch recommendations")
         raise HTTPException(
             status_code=500, 
             detail={
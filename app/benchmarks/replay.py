@@ -0,0 +1,309 @@
+"""
+Replay a log of recommendation requests against the API and report latency, throughput and memory.
+
+Usage (from the app directory):
+    python -m benchmarks.replay requests.jsonl [--concurrency 8] [--rate 50] [--requests 1000]
+    python -m benchmarks.replay requests.jsonl --serve --data-dir /tmp/off-benchmarks/100000-20-0
+    python -m benchmarks.replay requests.jsonl --url http://localhost:8001
+    python -m benchmarks.replay requests.jsonl --write-log 1000 --data-dir /tmp/off-benchmarks/100000-20-0
+
+Every line of the log is a ProductRecommendationRequest body, lines that are not are
+skipped. Requests run in this process through an ASGI transport by default, against a
+uvicorn server started for the replay with --serve, or against a running server with
+--url. Peak RSS is measured on the process serving the requests, for --url only when
+its --server-pid is given.
+
+With --rate, requests are sent on a fixed schedule and their latency counts from the
+time they were scheduled, so a server falling behind shows up in the latency instead
+of slowing the replay down.
+"""
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import AsyncIterator, List, Optional
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import httpx
+import numpy as np
+import pandas as pd
+import psutil
+import config
+from utils.logger import setup_colored_logger
+
+logger = setup_colored_logger(__name__)
+
+RECOMMENDATIONS_ENDPOINT = "/api/v1/recommendations/"
+
+# preferences of generated requests, taken at random
+GENERATED_PREFERENCES = [
+    None,
+    [{"name": "milk", "status": -1}],
+    [{"name": "organic", "status": 1}],
+    [{"name": "nuts", "status": -1}, {"name": "vegetarian", "status": 1}],
+]
+
+
+def read_request_log(path: str) -> List[dict]:
+    """Request bodies of a JSONL log, skipping lines that are no recommendation request"""
+    bodies, skipped = [], 0
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                body = json.loads(line)
+            except json.JSONDecodeError:
+                skipped += 1
+                continue
+            if isinstance(body, dict) and "product_code" in body:
+                bodies.append(body)
+            else:
+                skipped += 1
+    if skipped:
+        logger.warning(f"Skipped {skipped} lines of {path} that are no recommendation request")
+    return bodies
+
+
+def write_request_log(path: str, dataset_path: Path, n_requests: int, limit: int = 5, seed: int = 0) -> None:
+    """Write a log of requests for products drawn from a dataset, popular products drawn more often"""
+    rng = np.random.default_rng(seed)
+    codes = pd.read_pickle(dataset_path)["code"].astype(str).to_numpy()
+    # a few products get most of the traffic, as on a real shop
+    popularity = 1.0 / np.arange(1, len(codes) + 1) ** 1.1
+    picks = rng.choice(len(codes), size=n_requests, p=popularity / popularity.sum())
+    with open(path, "w") as f:
+        for pick in picks:
+            body = {"product_code": codes[pick], "limit": limit}
+            preferences = GENERATED_PREFERENCES[rng.integers(len(GENERATED_PREFERENCES))]
+            if preferences is not None:
+                body["user_preferences"] = preferences
+            f.write(json.dumps(body) + "\n")
+    logger.info(f"Wrote {n_requests} requests to {path}")
+
+
+class RssSampler:
+    """Peak resident memory of a process, sampled in the background"""
+    def __init__(self, pid: int, interval: float = 0.1) -> None:
+        self.process = psutil.Process(pid)
+        self.interval = interval
+        self.peak = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def sample(self) -> None:
+        try:
+            self.peak = max(self.peak, self.process.memory_info().rss)
+        except psutil.Error:
+            pass
+
+    async def __run(self) -> None:
+        while True:
+            self.sample()
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self.__run())
+
+    async def stop(self) -> None:
+        self.sample()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+
+@asynccontextmanager
+async def in_process_client(timeout: float) -> AsyncIterator[httpx.AsyncClient]:
+    """Client calling the app in this process, with its startup and shutdown run around the replay"""
+    import main
+    async with main.lifespan(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://replay", timeout=timeout) as client:
+            # the dataset loads in the background once the app started
+            while (response := await client.get("/health/ready")).status_code != 200:
+                if response.json()["status"] == "failed":
+                    raise RuntimeError(f"Dataset failed to load: {response.json()['error']}")
+                await asyncio.sleep(0.1)
+            yield client
+
+
+@asynccontextmanager
+async def uvicorn_server(port: int, data_dir: Optional[str], startup_timeout: float = 600.0) -> AsyncIterator[subprocess.Popen]:
+    """Run the app in a uvicorn process until the context exits"""
+    env = dict(os.environ)
+    if data_dir is not None:
+        env["DATA_DIR"] = str(Path(data_dir).resolve())
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=Path(__file__).resolve().parent.parent,
+        env=env,
+    )
+    try:
+        deadline = time.monotonic() + startup_timeout
+        async with httpx.AsyncClient() as client:
+            while True:
+                if server.poll() is not None:
+                    raise RuntimeError(f"Server exited with code {server.returncode} on startup")
+                try:
+                    if (await client.get(f"http://127.0.0.1:{port}/health/ready")).status_code == 200:
+                        break
+                except httpx.TransportError:
+                    pass
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"Server not ready within {startup_timeout} seconds")
+                await asyncio.sleep(0.5)
+        yield server
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+
+
+async def replay(client: httpx.AsyncClient, bodies: List[dict], n_requests: int, concurrency: int, rate: Optional[float], endpoint: str) -> dict:
+    """Send `n_requests` requests, cycling through the bodies, and collect their latencies and statuses"""
+    latencies = np.full(n_requests, np.nan)
+    statuses = np.zeros(n_requests, dtype=np.int32)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def send(i: int, scheduled_at: float) -> None:
+        try:
+            response = await client.post(endpoint, json=bodies[i % len(bodies)])
+            statuses[i] = response.status_code
+        except httpx.HTTPError as e:
+            logger.debug("Request %d failed: %s", i, e)
+            statuses[i] = 0
+        finally:
+            latencies[i] = time.perf_counter() - scheduled_at
+            semaphore.release()
+
+    start = time.perf_counter()
+    tasks = []
+    for i in range(n_requests):
+        scheduled_at = time.perf_counter()
+        if rate:
+            scheduled_at = start + i / rate
+            delay = scheduled_at - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        await semaphore.acquire()
+        tasks.append(asyncio.create_task(send(i, scheduled_at)))
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - start
+
+    failed = (statuses < 200) | (statuses >= 300)
+    status_counts = {str(status) if status else "connection_error": int(count) for status, count in zip(*np.unique(statuses, return_counts=True))}
+    return {
+        "requests": n_requests,
+        "duration_seconds": elapsed,
+        "throughput_rps": n_requests / elapsed if elapsed else 0.0,
+        "error_rate": float(failed.mean()) if n_requests else 0.0,
+        "statuses": status_counts,
+        "latency_ms": {
+            "mean": float(np.mean(latencies) * 1000),
+            "p50": float(np.percentile(latencies, 50) * 1000),
+            "p95": float(np.percentile(latencies, 95) * 1000),
+            "p99": float(np.percentile(latencies, 99) * 1000),
+            "max": float(np.max(latencies) * 1000),
+        },
+    }
+
+
+async def run(args: argparse.Namespace) -> dict:
+    bodies = read_request_log(args.log)
+    if not bodies:
+        raise ValueError(f"No recommendation requests in {args.log}")
+    n_requests = args.requests or len(bodies)
+    logger.info(f"Replaying {n_requests} requests with concurrency {args.concurrency}" + (f" at {args.rate} requests per second" if args.rate else ""))
+
+    if args.url:
+        target = args.url
+        sampler = RssSampler(args.server_pid) if args.server_pid else None
+        async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout) as client:
+            results = await _replay_sampled(client, sampler, bodies, n_requests, args)
+    elif args.serve:
+        port = args.port or _free_port()
+        target = f"uvicorn on port {port}"
+        async with uvicorn_server(port, args.data_dir) as server:
+            async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=args.timeout) as client:
+                results = await _replay_sampled(client, RssSampler(server.pid), bodies, n_requests, args)
+    else:
+        target = "in-process ASGI transport"
+        async with in_process_client(args.timeout) as client:
+            results = await _replay_sampled(client, RssSampler(os.getpid()), bodies, n_requests, args)
+
+    results["target"] = target
+    results["concurrency"] = args.concurrency
+    results["rate"] = args.rate
+    return results
+
+
+async def _replay_sampled(client: httpx.AsyncClient, sampler: Optional[RssSampler], bodies: List[dict], n_requests: int, args: argparse.Namespace) -> dict:
+    if args.warmup:
+        await replay(client, bodies, min(args.warmup, n_requests), args.concurrency, None, args.endpoint)
+    if sampler is not None:
+        sampler.start()
+    results = await replay(client, bodies, n_requests, args.concurrency, args.rate, args.endpoint)
+    if sampler is not None:
+        await sampler.stop()
+        results["peak_rss_mb"] = sampler.peak / 2**20
+    return results
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Replay recommendation requests against the API")
+    parser.add_argument("log", help="JSONL file with one ProductRecommendationRequest body per line")
+    parser.add_argument("--url", default=None, help="Base URL of a running server, the app runs in this process by default")
+    parser.add_argument("--serve", action="store_true", help="Start a uvicorn server for the replay")
+    parser.add_argument("--port", type=int, default=None, help="Port of the started server, a free one by default")
+    parser.add_argument("--server-pid", type=int, default=None, help="Process ID of the server behind --url, to measure its memory")
+    parser.add_argument("--data-dir", default=None, help="Data directory of the app, for in-process and started servers")
+    parser.add_argument("--endpoint", default=RECOMMENDATIONS_ENDPOINT, help="Path the requests are posted to")
+    parser.add_argument("--concurrency", type=int, default=8, help="Maximum number of requests in flight")
+    parser.add_argument("--rate", type=float, default=None, help="Requests sent per second, as fast as possible by default")
+    parser.add_argument("--requests", type=int, default=None, help="Number of requests, cycling through the log, the log length by default")
+    parser.add_argument("--warmup", type=int, default=0, help="Number of requests sent before measuring")
+    parser.add_argument("--timeout", type=float, default=30.0, help="Timeout of a request in seconds")
+    parser.add_argument("--output", default=None, help="JSON file to write the report to")
+    parser.add_argument("--write-log", type=int, default=None, metavar="N",
+                        help="Write a log of N requests for products of the dataset in --data-dir instead of replaying")
+    args = parser.parse_args()
+
+    if args.data_dir is not None:
+        # read by the dataset manager on import, set before the app is imported in this process
+        config.DATA_DIR = Path(args.data_dir).resolve()
+
+    if args.write_log is not None:
+        write_request_log(args.log, config.DATA_DIR / "openfoodfacts_sample.pkl", args.write_log)
+        return
+
+    results = asyncio.run(run(args))
+    logger.info(
+        f"{results['requests']} requests in {results['duration_seconds']:.1f} s: "
+        f"{results['throughput_rps']:.1f} req/s, error rate {results['error_rate']:.2%}, "
+        f"latency p50 {results['latency_ms']['p50']:.1f} ms, p95 {results['latency_ms']['p95']:.1f} ms, "
+        f"p99 {results['latency_ms']['p99']:.1f} ms"
+        + (f", peak RSS {results['peak_rss_mb']:.0f} MB" if "peak_rss_mb" in results else "")
+    )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        logger.info(f"Wrote replay report to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
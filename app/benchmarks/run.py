@@ -0,0 +1,242 @@
+"""
+Benchmark dataset loading and recommendations on synthetic datasets.
+
+Usage (from the app directory):
+    python -m benchmarks.run [--sizes 10000 100000 1000000] [--queries 200] [--output results.json]
+
+For every dataset size, times loading the dataset and building its indexes, then
+RecommendationEngine.find_recommendations and RecommendationService.generate_recommendations
+on the same sampled products. Engine and service stages are timed by the stage
+histograms of utils.metrics. Results are written as JSON, together with the git
+revision and library versions, so runs of different versions can be compared
+with --baseline.
+"""
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Dict, List
+import argparse
+import asyncio
+import json
+import platform
+import subprocess
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+from benchmarks.synthetic import DATASET_FILE_NAME, SIMILARITIES_FILE_NAME, write_synthetic_data
+from models.domain.off_product import OpenFoodFactsProduct
+from models.schemas.product_recommendation import ProductRecommendationRequest, UserPreference
+from services.recommendation.engine import RecommendationEngine
+from services.recommendation.enrichment import DatasetEnricher
+from services.recommendation.factors.recommendation_factor import FactorPreferenceStatus
+from services.recommendation.service import RecommendationService
+from utils.code_index import ProductCodeIndex
+from utils.dataset_manager import DatasetManager
+from utils.logger import setup_colored_logger
+from utils.metrics import STAGE_DURATION
+from utils.neighbor_index import NeighborIndex
+from utils.result_cache import ResultCache
+from utils.worker_pool import WorkerPool
+
+logger = setup_colored_logger(__name__)
+
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000]
+
+# preferences of the benchmark requests, taken in turn
+PREFERENCE_SETS = [
+    None,
+    [UserPreference(name="milk", status=FactorPreferenceStatus.AVOID)],
+    [UserPreference(name="organic", status=FactorPreferenceStatus.RECOMMEND)],
+    [UserPreference(name="nuts", status=FactorPreferenceStatus.AVOID), UserPreference(name="vegetarian", status=FactorPreferenceStatus.RECOMMEND)],
+]
+
+
+def summarize(durations: List[float]) -> Dict[str, float]:
+    """Summary statistics of durations in seconds"""
+    values = np.asarray(durations, dtype=float)
+    if len(values) == 0:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "mean": float(values.mean()),
+        "p50": float(np.percentile(values, 50)),
+        "p95": float(np.percentile(values, 95)),
+        "p99": float(np.percentile(values, 99)),
+        "max": float(values.max()),
+        "total": float(values.sum()),
+    }
+
+
+def stage_totals() -> Dict[str, Dict[str, float]]:
+    """Total time and number of observations of every stage recorded so far"""
+    totals: Dict[str, Dict[str, float]] = {}
+    for metric in STAGE_DURATION.collect():
+        for sample in metric.samples:
+            stage = sample.labels.get("stage")
+            if sample.name.endswith("_sum"):
+                totals.setdefault(stage, {"sum": 0.0, "count": 0.0})["sum"] = sample.value
+            elif sample.name.endswith("_count"):
+                totals.setdefault(stage, {"sum": 0.0, "count": 0.0})["count"] = sample.value
+    return totals
+
+
+def stage_means(before: Dict[str, Dict[str, float]], after: Dict[str, Dict[str, float]]) -> Dict[str, Dict[str, float]]:
+    """Mean duration of every stage observed between two calls of `stage_totals`"""
+    means = {}
+    for stage, total in after.items():
+        previous = before.get(stage, {"sum": 0.0, "count": 0.0})
+        count = total["count"] - previous["count"]
+        if count > 0:
+            duration = total["sum"] - previous["sum"]
+            means[stage] = {"count": int(count), "mean": duration / count, "total": duration}
+    return means
+
+
+def timed(func: Callable, *args, **kwargs):
+    """Run a function, returning its result and duration in seconds"""
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def benchmark_loading(data_dir: Path, engine: RecommendationEngine) -> Dict[str, float]:
+    """Time every step of loading a dataset, then the DatasetManager doing all of them"""
+    dataset, read_time = timed(pd.read_pickle, data_dir / DATASET_FILE_NAME)
+    dataset, enrich_time = timed(DatasetEnricher().enrich, dataset)
+    code_index, code_index_time = timed(ProductCodeIndex.from_dataset, dataset)
+    neighbor_index, neighbor_index_time = timed(NeighborIndex.from_csv, data_dir / SIMILARITIES_FILE_NAME, code_index)
+    _, candidate_index_time = timed(engine.build_candidate_index, dataset, code_index, neighbor_index)
+    return {
+        "read_dataset": read_time,
+        "enrich": enrich_time,
+        "code_index": code_index_time,
+        "neighbor_index": neighbor_index_time,
+        "candidate_index": candidate_index_time,
+    }
+
+
+def benchmark_size(n_products: int, data_dir: Path, queries: int, limit: int, neighbors: int, seed: int) -> dict:
+    write_synthetic_data(data_dir, n_products, neighbors, seed)
+
+    engine = RecommendationEngine()
+    logger.info(f"Benchmarking loading of {n_products} products")
+    loading = benchmark_loading(data_dir, engine)
+    # absolute file names take the place of the data directory
+    enricher = DatasetEnricher()
+    dataset_manager = DatasetManager(
+        dataset_file_name=str(data_dir / DATASET_FILE_NAME),
+        similarities_file_name=str(data_dir / SIMILARITIES_FILE_NAME),
+        enrich=enricher.enrich,
+        build_candidates=engine.build_candidate_index,
+        columns=enricher.serving_columns,
+    )
+    _, loading["initialize_dataset"] = timed(dataset_manager.initialize_dataset)
+    snapshot = dataset_manager.get_snapshot()
+
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(len(snapshot.code_index), size=min(queries, len(snapshot.code_index)), replace=False)
+    codes = [snapshot.code_index.code_at(row) for row in rows]
+
+    logger.info(f"Benchmarking {len(codes)} engine recommendations")
+    durations = []
+    before = stage_totals()
+    for i, (row, code) in enumerate(zip(rows, codes)):
+        product = OpenFoodFactsProduct(code, snapshot.dataset.iloc[row])
+        preferences = engine.recommendation_strategy.preferences_from(PREFERENCE_SETS[i % len(PREFERENCE_SETS)])
+        _, duration = timed(engine.find_recommendations, snapshot.dataset, product, snapshot.code_index, snapshot.neighbor_index, limit, preferences, snapshot.candidate_index)
+        durations.append(duration)
+    engine_results = {"find_recommendations": summarize(durations), "stages": stage_means(before, stage_totals())}
+
+    logger.info(f"Benchmarking {len(codes)} service recommendations")
+    # no result cache, every request is computed
+    worker_pool = WorkerPool(max_workers=1, queue_timeout=None)
+    service = RecommendationService(dataset_manager, result_cache=ResultCache(max_entries=0), worker_pool=worker_pool, engine=engine)
+    before = stage_totals()
+    durations = asyncio.run(_time_service(service, codes, limit))
+    service_results = {"generate_recommendations": summarize(durations), "stages": stage_means(before, stage_totals())}
+    worker_pool.shutdown()
+
+    dataset_manager.clear_cache()
+    return {
+        "products": len(snapshot.code_index),
+        "neighbor_edges": snapshot.neighbor_index.edge_count,
+        "loading": loading,
+        "engine": engine_results,
+        "service": service_results,
+    }
+
+
+async def _time_service(service: RecommendationService, codes: List[str], limit: int) -> List[float]:
+    durations = []
+    for i, code in enumerate(codes):
+        request = ProductRecommendationRequest(product_code=code, limit=limit, user_preferences=PREFERENCE_SETS[i % len(PREFERENCE_SETS)])
+        start = time.perf_counter()
+        await service.generate_recommendations(request)
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def environment() -> dict:
+    try:
+        revision = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        revision = None
+    return {
+        "revision": revision,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+    }
+
+
+def compare(results: dict, baseline: dict) -> None:
+    """Log the change of mean durations against a baseline run"""
+    baseline_sizes = {result["products"]: result for result in baseline["results"]}
+    for result in results["results"]:
+        previous = baseline_sizes.get(result["products"])
+        if previous is None:
+            continue
+        pairs = [(f"loading.{step}", result["loading"][step], previous["loading"].get(step)) for step in result["loading"]]
+        pairs += [
+            ("engine.find_recommendations", result["engine"]["find_recommendations"]["mean"], previous["engine"]["find_recommendations"].get("mean")),
+            ("service.generate_recommendations", result["service"]["generate_recommendations"]["mean"], previous["service"]["generate_recommendations"].get("mean")),
+        ]
+        pairs += [(f"engine.{stage}", stats["mean"], previous["engine"]["stages"].get(stage, {}).get("mean")) for stage, stats in result["engine"]["stages"].items()]
+        for name, current, before in pairs:
+            if before:
+                logger.info(f"{result['products']} products {name}: {before * 1000:.3f} ms -> {current * 1000:.3f} ms ({(current / before - 1) * 100:+.1f}%)")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the recommendation engine on synthetic datasets")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="Numbers of products of the datasets")
+    parser.add_argument("--queries", type=int, default=200, help="Number of recommended products per dataset")
+    parser.add_argument("--limit", type=int, default=5, help="Number of recommendations per product")
+    parser.add_argument("--neighbors", type=int, default=20, help="Number of neighbors drawn for every product")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the datasets and sampled products")
+    parser.add_argument("--data-dir", default=str(Path(tempfile.gettempdir()) / "off-benchmarks"),
+                        help="Directory keeping the generated datasets between runs")
+    parser.add_argument("--output", default=None, help="JSON file to write, benchmark-<revision>-<time>.json by default")
+    parser.add_argument("--baseline", default=None, help="JSON file of a previous run to compare with")
+    args = parser.parse_args()
+
+    results = {"environment": environment(), "settings": vars(args), "results": []}
+    for size in args.sizes:
+        data_dir = Path(args.data_dir) / f"{size}-{args.neighbors}-{args.seed}"
+        results["results"].append(benchmark_size(size, data_dir, args.queries, args.limit, args.neighbors, args.seed))
+
+    output = args.output or f"benchmark-{results['environment']['revision'] or 'unknown'}-{datetime.now():%Y%m%d-%H%M%S}.json"
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    logger.info(f"Wrote benchmark results to {output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
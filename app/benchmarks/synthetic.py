@@ -0,0 +1,234 @@
+"""
+Synthetic OpenFoodFacts datasets for benchmarks.
+
+Usage (from the app directory):
+    python -m benchmarks.synthetic --products 100000 --output /tmp/off-100000
+
+Writes openfoodfacts_sample.pkl and similarities.csv, in the layout the
+DatasetManager reads from its data directory. Products get the columns the
+recommendation engine reads, with values drawn around the ones of real
+products, and similar products are drawn among products of the same categories.
+"""
+from pathlib import Path
+from typing import Tuple, Union
+import argparse
+import numpy as np
+import pandas as pd
+from utils.logger import setup_colored_logger
+
+logger = setup_colored_logger(__name__)
+
+DATASET_FILE_NAME = "openfoodfacts_sample.pkl"
+SIMILARITIES_FILE_NAME = "similarities.csv"
+
+# category paths of products with their share of products and mean energy in kJ per 100 g
+CATEGORY_PATHS = [
+    ("Plant-based foods and beverages, Beverages, Carbonated drinks, Sodas, Colas", 4, 180),
+    ("Plant-based foods and beverages, Beverages, Carbonated drinks, Sodas, Lemonade", 2, 170),
+    ("Plant-based foods and beverages, Beverages, Fruit-based beverages, Juices and nectars, Fruit juices", 4, 190),
+    ("Plant-based foods and beverages, Beverages, Hot beverages, Teas", 2, 10),
+    ("Plant-based foods and beverages, Beverages, Waters, Spring waters", 2, 0),
+    ("Plant-based foods and beverages, Beverages, Plant-based milks, Oat-based drinks", 2, 200),
+    ("Dairies, Fermented foods, Fermented milk products, Cheeses, Hard cheeses", 5, 1600),
+    ("Dairies, Fermented foods, Fermented milk products, Cheeses, Soft cheeses", 3, 1200),
+    ("Dairies, Fermented foods, Fermented milk products, Yogurts, Fruit yogurts", 5, 400),
+    ("Dairies, Fermented foods, Fermented milk products, Yogurts, Plain yogurts", 3, 300),
+    ("Dairies, Milks, Semi-skimmed milks", 2, 200),
+    ("Dairies, Desserts, Dairy desserts, Chocolate desserts", 2, 550),
+    ("Snacks, Sweet snacks, Biscuits and cakes, Biscuits, Chocolate biscuits", 6, 2100),
+    ("Snacks, Sweet snacks, Biscuits and cakes, Cakes, Sponge cakes", 3, 1700),
+    ("Snacks, Sweet snacks, Confectioneries, Candies", 4, 1600),
+    ("Snacks, Sweet snacks, Cocoa and its products, Chocolates, Dark chocolates", 4, 2300),
+    ("Snacks, Sweet snacks, Cocoa and its products, Chocolates, Milk chocolates", 4, 2250),
+    ("Snacks, Salty snacks, Appetizers, Chips and fries, Crisps", 5, 2200),
+    ("Snacks, Salty snacks, Appetizers, Crackers", 3, 1900),
+    ("Snacks, Salty snacks, Nuts and their products, Nuts, Salted nuts", 2, 2500),
+    ("Plant-based foods and beverages, Plant-based foods, Cereals and potatoes, Breakfast cereals, Mueslis", 4, 1600),
+    ("Plant-based foods and beverages, Plant-based foods, Cereals and potatoes, Breads, Sliced breads", 4, 1100),
+    ("Plant-based foods and beverages, Plant-based foods, Cereals and potatoes, Pastas, Dry pastas", 3, 1500),
+    ("Plant-based foods and beverages, Plant-based foods, Cereals and potatoes, Rices", 2, 1500),
+    ("Plant-based foods and beverages, Plant-based foods, Fruits and vegetables based foods, Vegetables based foods, Canned vegetables", 3, 250),
+    ("Plant-based foods and beverages, Plant-based foods, Fruits and vegetables based foods, Fruits based foods, Compotes", 2, 300),
+    ("Plant-based foods and beverages, Plant-based foods, Legumes and their products, Pulses, Lentils", 1, 1400),
+    ("Plant-based foods and beverages, Plant-based foods, Fats, Vegetable fats, Olive oils", 2, 3700),
+    ("Meats and their products, Meats, Prepared meats, Hams, White hams", 3, 500),
+    ("Meats and their products, Meats, Prepared meats, Sausages", 3, 1200),
+    ("Meats and their products, Meats, Poultries, Chickens", 2, 700),
+    ("Seafood, Fishes, Fatty fishes, Salmons, Smoked salmons", 2, 800),
+    ("Seafood, Fishes, Canned fishes, Canned tunas", 2, 500),
+    ("Meals, Prepared meals, Pizzas pies and quiches, Pizzas", 4, 1000),
+    ("Meals, Prepared meals, Soups, Vegetable soups", 2, 180),
+    ("Meals, Prepared meals, Ready-made meals, Lasagnas", 2, 600),
+    ("Condiments, Sauces, Tomato sauces, Ketchup", 2, 450),
+    ("Condiments, Sauces, Mayonnaises", 1, 2800),
+    ("Spreads, Sweet spreads, Hazelnut spreads", 2, 2250),
+    ("Spreads, Sweet spreads, Fruit and vegetable preserves, Jams", 3, 1000),
+    ("Frozen foods, Frozen desserts, Ice creams and sorbets, Ice creams", 3, 900),
+]
+
+LABEL_TAGS = [("en:organic", 0.12), ("en:vegetarian", 0.15), ("en:vegan", 0.06), ("en:no-gluten", 0.05), ("en:fair-trade", 0.03)]
+ALLERGEN_TAGS = [("en:milk", 0.30), ("en:gluten", 0.25), ("en:eggs", 0.12), ("en:nuts", 0.08), ("en:soybeans", 0.10)]
+TRACE_TAGS = [("en:nuts", 0.12), ("en:milk", 0.08), ("en:eggs", 0.05), ("en:sesame-seeds", 0.05), ("en:soybeans", 0.06)]
+
+# Nutri-Score points above which a solid product gets the next grade
+GRADE_LIMITS = [-1, 2, 10, 18]
+GRADES = np.array(list("abcde"), dtype=object)
+
+
+def generate_dataset(n_products: int, seed: int = 0, missing_rate: float = 0.03) -> pd.DataFrame:
+    """
+    Generate products with the columns of the OpenFoodFacts dataset used by the recommendation engine.
+
+    Args:
+        n_products: Number of products
+        seed: Seed of the random generator, the same seed gives the same dataset
+        missing_rate: Share of missing nutrient values
+
+    Returns:
+        pd.DataFrame: One product per row with distinct codes
+    """
+    rng = np.random.default_rng(seed)
+    paths, weights, energies = zip(*CATEGORY_PATHS)
+    weights = np.array(weights, dtype=float) / sum(weights)
+    category_ids = rng.choice(len(paths), size=n_products, p=weights)
+
+    energy = rng.gamma(4.0, np.array(energies, dtype=float)[category_ids] / 4.0)
+    nutrients = {
+        "energy_100g": energy,
+        "sugars_100g": np.minimum(rng.gamma(1.2, 10.0, n_products), 100.0),
+        "saturated-fat_100g": np.minimum(rng.gamma(1.0, 4.0, n_products), 100.0),
+        "salt_100g": np.minimum(rng.gamma(1.0, 0.6, n_products), 100.0),
+        "fiber_100g": np.minimum(rng.gamma(1.0, 2.5, n_products), 100.0),
+        "proteins_100g": np.minimum(rng.gamma(1.5, 5.0, n_products), 100.0),
+    }
+    for values in nutrients.values():
+        values[rng.random(n_products) < missing_rate] = np.nan
+
+    # positive points of energy, sugars, saturated fat and salt, minus fiber and proteins, roughly
+    nutriscore_score = np.round(
+        np.nan_to_num(energy) / 335
+        + np.nan_to_num(nutrients["sugars_100g"]) / 4.5
+        + np.nan_to_num(nutrients["saturated-fat_100g"])
+        + np.nan_to_num(nutrients["salt_100g"]) / 0.225
+        - np.minimum(np.nan_to_num(nutrients["fiber_100g"]) / 0.7, 5)
+        - np.minimum(np.nan_to_num(nutrients["proteins_100g"]) / 1.6, 5)
+    ).clip(-15, 40)
+    nutriscore_grade = GRADES[np.searchsorted(GRADE_LIMITS, nutriscore_score, side="left")]
+
+    codes = _generate_codes(rng, n_products)
+    return pd.DataFrame({
+        "code": codes,
+        "product_name": np.char.add("Product ", np.arange(n_products).astype(str)).astype(object),
+        "image_url": np.char.add(np.char.add("https://images.openfoodfacts.org/images/products/", codes.astype(str)), "/front.jpg").astype(object),
+        "nutriscore_score": nutriscore_score,
+        "nutriscore_grade": nutriscore_grade,
+        **nutrients,
+        "labels_tags": _generate_tags(rng, n_products, LABEL_TAGS),
+        "allergens": _generate_tags(rng, n_products, ALLERGEN_TAGS),
+        "traces_tags": _generate_tags(rng, n_products, TRACE_TAGS),
+        "categories_en": np.array(paths, dtype=object)[category_ids],
+        "countries_tags": "en:france",
+    })
+
+
+def generate_similarities(dataset: pd.DataFrame, neighbors: int = 20, seed: int = 0) -> pd.DataFrame:
+    """
+    Generate a similarities table drawing the neighbors of a product among products of the same categories.
+
+    Args:
+        dataset: Dataset from `generate_dataset`
+        neighbors: Number of neighbors drawn for every product, before dropping duplicate pairs
+        seed: Seed of the random generator
+
+    Returns:
+        pd.DataFrame: `product1`, `product2` and `similarity` columns, each pair once, most similar first per product
+    """
+    rng = np.random.default_rng(seed)
+    _, category_ids = np.unique(dataset["categories_en"].to_numpy(dtype=str), return_inverse=True)
+    order = np.argsort(category_ids, kind="stable")
+    group_sizes = np.bincount(category_ids)
+    group_starts = np.concatenate([[0], np.cumsum(group_sizes)[:-1]])
+
+    sources = np.repeat(np.arange(len(dataset)), neighbors)
+    groups = category_ids[sources]
+    targets = order[group_starts[groups] + rng.integers(0, 1 << 62, len(sources)) % group_sizes[groups]]
+
+    # each pair once, the neighbor index adds the reverse pair
+    product1, product2 = np.minimum(sources, targets), np.maximum(sources, targets)
+    pairs = np.unique(np.stack([product1, product2], axis=1)[product1 != product2], axis=0)
+    similarities = np.round(rng.uniform(0.9, 1.0, len(pairs)), 4).astype(np.float32)
+
+    by_similarity = np.lexsort((-similarities, pairs[:, 0]))
+    codes = dataset["code"].to_numpy(dtype=object)
+    return pd.DataFrame({
+        "product1": codes[pairs[by_similarity, 0]],
+        "product2": codes[pairs[by_similarity, 1]],
+        "similarity": similarities[by_similarity],
+    })
+
+
+def write_synthetic_data(directory: Union[str, Path], n_products: int, neighbors: int = 20, seed: int = 0) -> Tuple[Path, Path]:
+    """
+    Write a synthetic dataset and its similarities to a data directory, unless they already exist.
+
+    Returns:
+        Tuple[Path, Path]: Paths of the dataset and similarities files
+    """
+    directory = Path(directory)
+    dataset_path, similarities_path = directory / DATASET_FILE_NAME, directory / SIMILARITIES_FILE_NAME
+    if dataset_path.exists() and similarities_path.exists():
+        logger.info(f"Reusing synthetic data in {directory}")
+        return dataset_path, similarities_path
+
+    directory.mkdir(parents=True, exist_ok=True)
+    logger.info(f"Generating {n_products} synthetic products in {directory}")
+    dataset = generate_dataset(n_products, seed)
+    similarities = generate_similarities(dataset, neighbors, seed)
+
+    # written last, so an interrupted run is generated again
+    similarities.to_csv(similarities_path.with_suffix(".tmp"), index=False, float_format="%.4f")
+    dataset.to_pickle(dataset_path)
+    similarities_path.with_suffix(".tmp").replace(similarities_path)
+    logger.info(f"Wrote {len(dataset)} products and {len(similarities)} similar pairs")
+    return dataset_path, similarities_path
+
+
+def _generate_codes(rng: np.random.Generator, n_products: int) -> np.ndarray:
+    """Distinct codes, mostly 13 digit EAN codes and some 8 digit ones"""
+    codes = np.zeros(0, dtype=np.int64)
+    while len(codes) < n_products:
+        draws = np.where(
+            rng.random(n_products) < 0.9,
+            rng.integers(10**12, 10**13, n_products),
+            rng.integers(10**6, 10**8, n_products),
+        )
+        codes = np.unique(np.concatenate([codes, draws]))
+    codes = rng.permutation(codes)[:n_products]
+    return np.array([str(code).zfill(8) for code in codes], dtype=object)
+
+
+def _generate_tags(rng: np.random.Generator, n_products: int, tags: list) -> np.ndarray:
+    """Comma separated tags, each present with its probability"""
+    names, probabilities = zip(*tags)
+    present = rng.random((n_products, len(tags))) < np.array(probabilities)
+    masks = present @ (1 << np.arange(len(tags)))
+    combinations = np.array([
+        ",".join(name for bit, name in enumerate(names) if mask >> bit & 1)
+        for mask in range(1 << len(tags))
+    ], dtype=object)
+    return combinations[masks]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Generate a synthetic OpenFoodFacts dataset and its similarities")
+    parser.add_argument("--products", type=int, default=10000, help="Number of products")
+    parser.add_argument("--neighbors", type=int, default=20, help="Number of neighbors drawn for every product")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the random generator")
+    parser.add_argument("--output", required=True, help="Data directory to write")
+    args = parser.parse_args()
+
+    write_synthetic_data(args.output, args.products, args.neighbors, args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,33 @@
+import os
 from pathlib import Path
 
 PROJECT_ROOT = Path(__file__).parent
-DATA_DIR = PROJECT_ROOT / "data"
\ No newline at end of file
+# directory of the dataset and similarities files
+DATA_DIR = Path(os.getenv("DATA_DIR", str(PROJECT_ROOT / "data")))
+
+# level of the application loggers, and their output: color, plain, detailed or json
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "color").lower()
+
+# directory on a tmpfs, e.g. /dev/shm/off-recommender, where the first uvicorn worker writes the dataset
+# and its indexes for all workers to memory-map, unset to let every worker load its own copy;
+# numeric columns and indexes are shared, text columns and the product code dict are per worker
+SHARED_MEMORY_DIR = Path(os.environ["SHARED_MEMORY_DIR"]) if os.getenv("SHARED_MEMORY_DIR") else None
+
+# reload the dataset when its files change in DATA_DIR
+DATASET_WATCH = os.getenv("DATASET_WATCH", "false").lower() in ("1", "true", "yes")
+# token required in the X-Admin-Token header of admin endpoints, admin endpoints are disabled when unset
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+# cached recommendation results, 0 entries disables the cache
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "10000"))
+RESULT_CACHE_TTL_SECONDS = float(os.getenv("RESULT_CACHE_TTL_SECONDS", "3600"))
+
+# threads running the recommendation engine, and how long a request may wait for one
+WORKER_THREADS = int(os.getenv("WORKER_THREADS", str(min(4, os.cpu_count() or 1))))
+WORKER_QUEUE_TIMEOUT_SECONDS = float(os.getenv("WORKER_QUEUE_TIMEOUT_SECONDS", "10"))
+
+# encoder comparing categories of products missing from the similarities file, e.g. "hashing", unset to disable
+CATEGORIES_FALLBACK_ENCODER = os.getenv("CATEGORIES_FALLBACK_ENCODER")
+# directory of the cached category vectors of the fallback encoder
+EMBEDDING_CACHE_DIR = Path(os.getenv("EMBEDDING_CACHE_DIR", str(DATA_DIR / "embedding_cache")))
@@ -1,11 +1,52 @@
 from functools import lru_cache
+from config import (
+    CATEGORIES_FALLBACK_ENCODER,
+    EMBEDDING_CACHE_DIR,
+    RESULT_CACHE_MAX_ENTRIES,
+    RESULT_CACHE_TTL_SECONDS,
+    SHARED_MEMORY_DIR,
+    WORKER_QUEUE_TIMEOUT_SECONDS,
+    WORKER_THREADS,
+)
 from utils.dataset_manager import DatasetManager
+from services.recommendation.engine import RecommendationEngine
 from services.recommendation.service import RecommendationService
+from services.recommendation.enrichment import DatasetEnricher
+from services.text_processing.embedding_comparator import EmbeddingCategoriesComparator
+from services.text_processing.encoders import create_encoder
+from utils.result_cache import ResultCache
+from utils.worker_pool import WorkerPool
 
 @lru_cache(maxsize=1)
 def get_dataset_manager():
-    return DatasetManager(dataset_file_name="openfoodfacts_sample.pkl")
+    enricher = DatasetEnricher()
+    return DatasetManager(
+        dataset_file_name="openfoodfacts_sample.pkl",
+        enrich=enricher.enrich,
+        build_candidates=get_recommendation_engine().build_candidate_index,
+        shared_dir=SHARED_MEMORY_DIR,
+        columns=enricher.serving_columns
+    )
+
+@lru_cache(maxsize=1)
+def get_worker_pool():
+    return WorkerPool(max_workers=WORKER_THREADS, queue_timeout=WORKER_QUEUE_TIMEOUT_SECONDS)
+
+@lru_cache(maxsize=1)
+def get_categories_comparator():
+    if not CATEGORIES_FALLBACK_ENCODER:
+        return None
+    return EmbeddingCategoriesComparator(create_encoder(CATEGORIES_FALLBACK_ENCODER), cache_dir=EMBEDDING_CACHE_DIR)
+
+@lru_cache(maxsize=1)
+def get_recommendation_engine():
+    return RecommendationEngine(categories_comparator=get_categories_comparator())
 
 @lru_cache(maxsize=1)
 def get_recommendation_service():
-    return RecommendationService(get_dataset_manager())
\ No newline at end of file
+    return RecommendationService(
+        get_dataset_manager(),
+        result_cache=ResultCache(max_entries=RESULT_CACHE_MAX_ENTRIES, ttl=RESULT_CACHE_TTL_SECONDS),
+        worker_pool=get_worker_pool(),
+        engine=get_recommendation_engine()
+    )
\ No newline at end of file
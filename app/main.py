@@ -1,18 +1,39 @@
 # app/main.py
 from fastapi import FastAPI, Depends
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 from api.v1.routes.off_recommendations import router
+from api.v1.routes.admin import router as admin_router
+import asyncio
+import gc
 from contextlib import asynccontextmanager
-from dependencies import get_dataset_manager
+from config import DATASET_WATCH
+from dependencies import get_categories_comparator, get_dataset_manager, get_worker_pool
+
+
+def freeze_loaded_objects():
+    # the loaded data lives as long as the process, keep the collector from walking it
+    # again, which also keeps pages shared with a parent that forked this worker
+    gc.collect()
+    gc.freeze()
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
     dataset_manager = get_dataset_manager()
-    dataset_manager.initialize_dataset()
+    # loaded in the background, the server listens meanwhile and reports it on /health/ready
+    dataset_manager.start_initialization(on_ready=freeze_loaded_objects)
+    stop_watching = asyncio.Event()
+    watcher = asyncio.create_task(dataset_manager.watch_sources(stop_watching)) if DATASET_WATCH else None
     yield
     # Shutdown
+    if watcher is not None:
+        stop_watching.set()
+        await watcher
+    get_worker_pool().shutdown()
+    if get_categories_comparator() is not None:
+        get_categories_comparator().flush()
     dataset_manager.clear_cache()
 
 app = FastAPI(lifespan=lifespan)
@@ -23,9 +44,28 @@ app.include_router(
     dependencies=[Depends(get_dataset_manager)]
 )
 
+app.include_router(admin_router)
+
 @app.get("/health")
 async def health_check():
     dataset_manager = get_dataset_manager()
     health_status = dataset_manager.health_check()
     status_code = 200 if health_status["status"] == "healthy" else 503
-    return JSONResponse(content=health_status, status_code=status_code)
\ No newline at end of file
+    return JSONResponse(content=health_status, status_code=status_code)
+
+
+@app.get("/health/live")
+async def liveness_check():
+    # the process serves requests, whatever the state of the dataset
+    return {"status": "alive"}
+
+
+@app.get("/health/ready")
+async def readiness_check():
+    readiness = get_dataset_manager().readiness()
+    return JSONResponse(content=readiness, status_code=200 if readiness["ready"] else 503)
+
+
+@app.get("/metrics")
+async def metrics():
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
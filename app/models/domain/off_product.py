@@ -1,13 +1,49 @@
 from dataclasses import dataclass, field
+import numpy as np
 import pandas as pd
 from enum import Enum
-from typing import Any, List
+from typing import Any, Iterable, List, Optional
+
+PRODUCT_CODE_LENGTH = 8
+CATEGORY_COLUMN = "product_category"
+# number of characters of every product code as loaded, zero padding included, when codes are stored as integers
+CODE_WIDTH_COLUMN = "code_width"
+
+
+def normalize_product_code(code: Any) -> str:
+    """Returns the canonical form of a product code, zero-padded to PRODUCT_CODE_LENGTH digits."""
+    return str(code).zfill(PRODUCT_CODE_LENGTH)
+
 
 class ProductCategory(Enum):
     SOLID = "solid"
     BEVERAGE = "beverage"
     COOKING_FATS = "cooking_fats"
     
+    @property
+    def code(self) -> int:
+        """Integer code of the category, as stored in the CATEGORY_COLUMN of the dataset."""
+        return PRODUCT_CATEGORY_CODES[self]
+    
+    @classmethod
+    def from_code(cls, code: int) -> "ProductCategory":
+        return PRODUCT_CATEGORIES[code]
+
+
+PRODUCT_CATEGORIES = list(ProductCategory)
+PRODUCT_CATEGORY_CODES = {category: code for code, category in enumerate(PRODUCT_CATEGORIES)}
+
+
+def categorize_products(products: pd.DataFrame) -> np.ndarray:
+    """Returns the main category code of many products, same as OpenFoodFactsProduct.category."""
+    if CATEGORY_COLUMN in products.columns:
+        return products[CATEGORY_COLUMN].to_numpy(dtype=np.int8)
+    
+    categories = products["categories_en"] if "categories_en" in products.columns else pd.Series("", index=products.index)
+    is_beverage = categories.str.lower().str.contains("beverages", regex=False, na=False).to_numpy(dtype=bool)
+    return np.where(is_beverage, ProductCategory.BEVERAGE.code, ProductCategory.SOLID.code).astype(np.int8)
+
+    
 @dataclass(frozen=True)
 class OpenFoodFactsProduct:
     """
@@ -24,6 +60,8 @@ class OpenFoodFactsProduct:
     def category(self) -> ProductCategory:
         """Returns the main category of the product."""
         if not self.details.empty:
+            if CATEGORY_COLUMN in self.details.index:
+                return ProductCategory.from_code(self.details[CATEGORY_COLUMN])
             if "beverages" in self.details.get("categories_en", "").lower():
                 return ProductCategory.BEVERAGE
             return ProductCategory.SOLID
@@ -35,4 +73,90 @@ class OpenFoodFactsProductColumn:
         name: str
         is_numeric: bool = False
         correct_values: List[Any] = field(default_factory=list)
-        accept_empty: bool = False
\ No newline at end of file
+        accept_empty: bool = False
+        # dtype the column is served with, "category" for dictionary-encoded strings
+        dtype: Optional[str] = None
+
+
+NUTRIENT_COLUMNS = ["energy_100g", "sugars_100g", "saturated-fat_100g", "salt_100g", "fiber_100g", "proteins_100g"]
+TAG_COLUMNS = ["labels_tags", "allergens", "traces_tags", "categories_en"]
+
+# columns the recommendation service reads, the others are dropped when the dataset is loaded
+SERVING_SCHEMA = [
+    # digits stored as uint64, with their width in CODE_WIDTH_COLUMN, see encode_product_codes
+    OpenFoodFactsProductColumn("code", dtype="uint64"),
+    OpenFoodFactsProductColumn("product_name", accept_empty=True, dtype="object"),
+    OpenFoodFactsProductColumn("image_url", accept_empty=True, dtype="object"),
+    OpenFoodFactsProductColumn("nutriscore_grade", correct_values=["a", "b", "c", "d", "e"], dtype="category"),
+    OpenFoodFactsProductColumn("nutriscore_score", is_numeric=True, accept_empty=True, dtype="float64"),
+    *[OpenFoodFactsProductColumn(name, is_numeric=True, accept_empty=True, dtype="float32") for name in NUTRIENT_COLUMNS],
+    *[OpenFoodFactsProductColumn(name, accept_empty=True, dtype="category") for name in TAG_COLUMNS],
+]
+SERVING_COLUMN_NAMES = [column.name for column in SERVING_SCHEMA] + [CODE_WIDTH_COLUMN]
+
+
+def encode_product_codes(codes: pd.Series) -> Optional[pd.DataFrame]:
+    """
+    Encode product codes as integers and the width of their original string.
+    
+    Returns:
+        Optional[pd.DataFrame]: "code" as uint64 and CODE_WIDTH_COLUMN as uint8, None if some code is not made of
+            at most 19 digits, in which case the codes are kept as strings
+    """
+    strings = codes.astype(str)
+    if not strings.str.fullmatch(r"\d{1,19}").all():
+        return None
+    return pd.DataFrame({
+        "code": strings.to_numpy(dtype=object).astype(np.uint64),
+        CODE_WIDTH_COLUMN: strings.str.len().to_numpy(dtype=np.uint8),
+    }, index=codes.index)
+
+
+def product_codes(products: pd.DataFrame) -> np.ndarray:
+    """Returns the product codes of many products as strings, as they were before encode_product_codes."""
+    if CODE_WIDTH_COLUMN not in products.columns:
+        return products["code"].astype(str).to_numpy(dtype=object)
+    return np.array([str(code).zfill(width) for code, width in zip(products["code"].tolist(), products[CODE_WIDTH_COLUMN].tolist())], dtype=object)
+
+
+def apply_serving_schema(products: pd.DataFrame, extra_columns: Iterable[str] = ()) -> pd.DataFrame:
+    """
+    Keep only the SERVING_SCHEMA columns of a dataset, with their serving dtypes.
+    
+    Columns already having their serving dtype are kept as they are. The columns of a
+    memory-mapped dataset are not copied.
+    
+    Args:
+        products: Loaded dataset
+        extra_columns: Other columns to keep, e.g. derived ones
+        
+    Returns:
+        pd.DataFrame: Projected dataset, sharing the columns it did not convert
+    """
+    columns = {}
+    for column in SERVING_SCHEMA:
+        if column.name not in products.columns:
+            continue
+        values = products[column.name]
+        if column.name == "code":
+            encoded = None if CODE_WIDTH_COLUMN in products.columns else encode_product_codes(values)
+            if encoded is None:
+                columns["code"] = values
+                if CODE_WIDTH_COLUMN in products.columns:
+                    columns[CODE_WIDTH_COLUMN] = products[CODE_WIDTH_COLUMN]
+            else:
+                columns.update(encoded.items())
+        elif column.dtype == "category":
+            columns[column.name] = values if isinstance(values.dtype, pd.CategoricalDtype) else values.astype("category")
+        elif column.is_numeric:
+            numeric = values if pd.api.types.is_numeric_dtype(values) else pd.to_numeric(values, errors="coerce")
+            columns[column.name] = numeric.astype(column.dtype, copy=False)
+        else:
+            columns[column.name] = values
+    for name in extra_columns:
+        if name in products.columns:
+            columns[name] = products[name]
+    # a copy consolidates the columns in a few blocks, which takes rows much faster,
+    # but it would unshare the pages of a memory-mapped dataset
+    memory_mapped = any(isinstance(values.values, np.memmap) for values in columns.values())
+    return pd.DataFrame(columns, index=products.index, copy=not memory_mapped)
\ No newline at end of file
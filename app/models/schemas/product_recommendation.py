@@ -1,4 +1,4 @@
-from pydantic import BaseModel, Field, ConfigDict
+from pydantic import BaseModel, Field, ConfigDict, model_validator
 from typing_extensions import Annotated
 from typing import List, Optional
 from pydantic import BaseModel, Field, ConfigDict
@@ -112,4 +112,76 @@ class ProductRecommendationResponse(BaseModel):
                 "total_found": 42
             }
         }
-    )
\ No newline at end of file
+    )
+
+MAX_BATCH_SIZE = 1000
+
+class BatchRecommendationRequest(BaseModel):
+    items: Annotated[Optional[List[ProductRecommendationRequest]], Field(
+    default=None,
+    max_length=MAX_BATCH_SIZE,
+    description="Recommendation requests, each with its own limit and preferences"
+    )]
+    product_codes: Annotated[Optional[List[Annotated[str, Field(max_length=48)]]], Field(
+    default=None,
+    max_length=MAX_BATCH_SIZE,
+    description="Product codes sharing `limit` and `user_preferences`, instead of `items`",
+    examples=[["3017620425035", "5901234123457"]]
+    )]
+    limit: Annotated[int, Field(
+    default=1,
+    strict=True,
+    ge=1,
+    le=10,
+    description="Number of recommended products to return for each of `product_codes`",
+    examples=[3, 5, 10]
+)]
+    user_preferences: Annotated[Optional[List[UserPreference]], Field(
+    default=None,
+    description="user preferences for personalization, shared by all of `product_codes`"
+    )]
+
+    model_config = {
+        "json_schema_extra": {
+            "example": {
+                "product_codes": ["3017620425035", "5901234123457"],
+                "limit": 3,
+                "user_preferences": [
+                    {"name": "milk", "status": -1}
+                ]
+            }
+        }
+    }
+
+    @model_validator(mode="after")
+    def check_items_or_product_codes(self) -> "BatchRecommendationRequest":
+        if (self.items is None) == (self.product_codes is None):
+            raise ValueError("Exactly one of items and product_codes is required")
+        return self
+
+class BatchRecommendationItem(BaseModel):
+    source_product_code: str = Field(
+        ...,
+        description="Product code for which recommendations were generated"
+    )
+    recommendations: List[RecommendedProduct] = Field(
+        default_factory=list,
+        description="List of recommended products, empty on error"
+    )
+    total_found: int = Field(
+        default=0,
+        ge=0,
+        description="Total number of potential recommendations found in the database"
+    )
+    error: Optional[str] = Field(
+        None,
+        description="Why recommendations could not be generated for this product"
+    )
+
+class BatchRecommendationResponse(BaseModel):
+    results: List[BatchRecommendationItem] = Field(
+        ...,
+        description="Result of every requested product, in request order"
+    )
+    total_succeeded: int = Field(..., ge=0, description="Number of products without error")
+    total_failed: int = Field(..., ge=0, description="Number of products with an error")
@@ -0,0 +1,77 @@
+"""
+Build the similarities file of the neighbor index from the categories of the dataset.
+
+Usage (from the app directory):
+    python -m scripts.build_similarities [--encoder hashing] [--top-k 100] [--min-similarity 0.9] [--workers N]
+    python -m scripts.build_similarities --update
+
+Replaces the notebook's GPU-bound all-pairs matrix: categories are encoded in chunks,
+top-K neighbors are computed block by block in a process pool and the pairs are
+streamed to the output file with padded product codes.
+
+With --update, only new and changed products are encoded and their neighbor lists
+are written to the delta file next to the output, which the server merges on load.
+
+The checksums of the written files are refreshed in the checksum manifest next to
+the output when there is one, the server refuses files not matching it.
+"""
+import argparse
+from pathlib import Path
+from config import DATA_DIR
+from services.text_processing.encoders import create_encoder
+from services.text_processing.similarity_builder import SimilarityBuilder
+from utils.checksums import CHECKSUMS_FILE_NAME, ChecksumManifest
+from utils.logger import setup_colored_logger
+from utils.neighbor_index import similarities_delta_path
+
+logger = setup_colored_logger(__name__)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Build the product similarities file")
+    parser.add_argument("--dataset", default=str(DATA_DIR / "openfoodfacts_sample.pkl"),
+                        help="Pickled dataset or columnar dataset directory")
+    parser.add_argument("--output", default=str(DATA_DIR / "similarities.csv"),
+                        help="Similarities CSV file to write")
+    parser.add_argument("--embeddings-dir", default=None,
+                        help="Directory keeping the embeddings for incremental updates, next to the output by default")
+    parser.add_argument("--encoder", default="hashing",
+                        help="hashing, hashing:<n_features>, sentence-transformer or sentence-transformer:<model>")
+    parser.add_argument("--top-k", type=int, default=100, help="Maximum number of neighbors of a product")
+    parser.add_argument("--min-similarity", type=float, default=0.9, help="Minimum similarity of a neighbor")
+    parser.add_argument("--chunk-size", type=int, default=10000, help="Number of products encoded at once")
+    parser.add_argument("--block-size", type=int, default=1024, help="Number of products per process task")
+    parser.add_argument("--workers", type=int, default=None, help="Number of processes, all cores by default")
+    parser.add_argument("--update", action="store_true",
+                        help="Update new and changed products into the delta of an existing build")
+    args = parser.parse_args()
+
+    builder = SimilarityBuilder(
+        encoder=create_encoder(args.encoder),
+        top_k=args.top_k,
+        min_similarity=args.min_similarity,
+        chunk_size=args.chunk_size,
+        block_size=args.block_size,
+        workers=args.workers,
+    )
+    if args.update:
+        updated = builder.update(args.dataset, args.output, args.embeddings_dir)
+        logger.info(f"Updated {updated} neighbor lists of {args.output}")
+    else:
+        written = builder.build(args.dataset, args.output, args.embeddings_dir)
+        logger.info(f"Built {args.output} with {written} neighbor pairs")
+    update_checksums(Path(args.output))
+
+
+def update_checksums(output: Path) -> None:
+    """Refresh the checksums of the written files if the output directory has a checksum manifest"""
+    manifest_path = output.parent / CHECKSUMS_FILE_NAME
+    if not manifest_path.exists():
+        return
+    written = [path for path in (output, similarities_delta_path(output)) if path.exists()]
+    ChecksumManifest(manifest_path).update(written)
+    logger.info(f"Updated checksums of {', '.join(map(str, written))} in {manifest_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+"""
+Convert the pickled dataset to the memory-mapped columnar format.
+
+Usage (from the app directory):
+    python -m scripts.convert_dataset [dataset_file_name] [--no-enrich]
+
+The columnar dataset is written next to the pickle, with a .columns suffix,
+where DatasetManager picks it up instead of the pickle.
+"""
+import argparse
+from config import DATA_DIR
+from services.recommendation.enrichment import DatasetEnricher
+from utils.columnar_dataset import convert_pickle_to_columnar
+from utils.logger import setup_colored_logger
+
+logger = setup_colored_logger(__name__)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Convert the pickled dataset to the columnar format")
+    parser.add_argument("dataset_file_name", nargs="?", default="openfoodfacts_sample.pkl",
+                        help="Name of the pickled dataset file in the data directory")
+    parser.add_argument("--no-enrich", action="store_true",
+                        help="Do not precompute derived columns before writing")
+    args = parser.parse_args()
+
+    pickle_path = DATA_DIR / args.dataset_file_name
+    output_path = pickle_path.with_suffix(".columns")
+    enrich = None if args.no_enrich else DatasetEnricher().enrich
+
+    columnar_dataset = convert_pickle_to_columnar(pickle_path, output_path, enrich=enrich)
+    logger.info(f"Converted {pickle_path} to {output_path} ({len(columnar_dataset)} rows)")
+
+
+if __name__ == "__main__":
+    main()
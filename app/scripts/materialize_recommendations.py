@@ -0,0 +1,70 @@
+"""
+Materialize the recommendations of every product for requests without preferences.
+
+Usage (from the app directory):
+    python -m scripts.materialize_recommendations [--top-n 10] [--chunk-size 1000]
+
+Loads the dataset and similarities the server loads, ranks the best recommendations
+of every product with the server's engine settings and writes them next to the dataset,
+where DatasetManager picks them up. Run it again after every dataset or similarities
+change: the server ignores a table computed on other product codes, similarities or
+scores, ratings and factor presence columns.
+"""
+import argparse
+import time
+import numpy as np
+from config import DATA_DIR
+from dependencies import get_dataset_manager, get_recommendation_engine
+from models.domain.off_product import OpenFoodFactsProduct
+from utils.logger import setup_colored_logger
+from utils.materialized_recommendations import MaterializedRecommendations, snapshot_fingerprint
+
+logger = setup_colored_logger(__name__)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Materialize the recommendations of requests without preferences")
+    parser.add_argument("--output", default=str(DATA_DIR / "recommendations.npz"),
+                        help="Materialized recommendations file to write, valid for the current dataset and similarities only")
+    parser.add_argument("--top-n", type=int, default=10, help="Number of recommendations kept per product")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="Number of products ranked together")
+    args = parser.parse_args()
+    if args.top_n < 1:
+        parser.error("--top-n must be at least 1")
+
+    snapshot = get_dataset_manager().get_snapshot()
+    if snapshot is None:
+        raise RuntimeError("Dataset not available")
+    dataset, code_index = snapshot.dataset, snapshot.code_index
+    engine = get_recommendation_engine()
+
+    n_products = len(code_index.codes)
+    indptr = np.zeros(n_products + 1, dtype=np.int64)
+    complete = np.zeros(n_products, dtype=bool)
+    rows = []
+    start = time.perf_counter()
+    for chunk_start in range(0, n_products, args.chunk_size):
+        chunk = range(chunk_start, min(chunk_start + args.chunk_size, n_products))
+        products = [OpenFoodFactsProduct(code_index.code_at(row), dataset.iloc[row]) for row in chunk]
+        ranked = engine.rank_candidates_many(dataset, products, code_index, snapshot.neighbor_index, args.top_n, candidate_index=snapshot.candidate_index)
+        for row, (codes, is_complete) in zip(chunk, ranked):
+            rows.append(np.array([code_index.row_of(code) for code in codes], dtype=np.int32))
+            indptr[row + 1] = len(codes)
+            complete[row] = is_complete
+        logger.info(f"Ranked recommendations of {chunk.stop}/{n_products} products")
+
+    materialized = MaterializedRecommendations(
+        indptr=np.cumsum(indptr),
+        rows=np.concatenate(rows) if rows else np.zeros(0, dtype=np.int32),
+        complete=complete,
+        top_n=args.top_n,
+        settings=engine.settings(),
+        fingerprint=snapshot_fingerprint(dataset, code_index, snapshot.neighbor_index),
+    )
+    materialized.save(args.output)
+    logger.info(f"Wrote top {args.top_n} recommendations of {n_products} products to {args.output} "
+                f"({materialized.nbytes / 2**20:.1f} MB) in {time.perf_counter() - start:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
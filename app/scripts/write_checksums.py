@@ -0,0 +1,42 @@
+"""
+Write the checksum manifest of the data directory.
+
+Usage (from the app directory):
+    python -m scripts.write_checksums [FILE ...]
+
+Computes the SHA-256 checksums of the dataset, similarities and similarities delta
+files, or of the given files, and writes them to checksums.sha256 in the data
+directory, keeping the checksums of other files it lists. The server checks the
+files it loads against the manifest and refuses the ones not matching. The manifest
+has the format of `sha256sum`, `sha256sum -c checksums.sha256` checks it as well.
+
+Run it after copying new data files into the data directory.
+"""
+import argparse
+from config import DATA_DIR
+from utils.checksums import CHECKSUMS_FILE_NAME, ChecksumManifest
+from utils.logger import setup_colored_logger
+from utils.neighbor_index import similarities_delta_path
+
+logger = setup_colored_logger(__name__)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Write the checksum manifest of the data directory")
+    parser.add_argument("files", nargs="*",
+                        help="Files to checksum, the dataset and similarities files of the data directory by default")
+    parser.add_argument("--manifest", default=str(DATA_DIR / CHECKSUMS_FILE_NAME), help="Checksum manifest to write")
+    args = parser.parse_args()
+
+    similarities_path = DATA_DIR / "similarities.csv"
+    defaults = [DATA_DIR / "openfoodfacts_sample.pkl", similarities_path, similarities_delta_path(similarities_path)]
+    files = args.files or [path for path in defaults if path.exists()]
+    if not files:
+        parser.error(f"No data files found in {DATA_DIR}")
+
+    ChecksumManifest(args.manifest).update(files)
+    logger.info(f"Wrote checksums of {len(files)} files to {args.manifest}")
+
+
+if __name__ == "__main__":
+    main()
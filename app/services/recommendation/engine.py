@@ -1,32 +1,63 @@
-from typing import List, Optional
+from typing import List, Optional, Tuple, Union
+import logging
+import numpy as np
 import pandas as pd
 from models.domain.off_product import OpenFoodFactsProduct
 from services.recommendation.strategy import RecommendationStrategy
-from services.recommendation.factors.recommendation_factor import FactorPreferenceStatus
+from services.recommendation.factors.recommendation_factor import FactorPreferenceStatus, PreferenceVector
 from services.recommendation.evaluator.off_evaluator import OpenFoodFactsProductEvaluator
 from services.recommendation.factors.nutritional_rating_systems.nutriscore import NutriscoreEvaluator
-from heapq import nlargest, nsmallest, heappush
+from services.recommendation.factors.categories.categories_comparator import CategoriesComparator
 from utils.logger import setup_colored_logger
-from config import DATA_DIR
+from utils.code_index import ProductCodeIndex
+from utils.neighbor_index import NeighborIndex
+from utils.candidate_index import CandidateIndex
+from utils.materialized_recommendations import MaterializedRecommendations
+from utils.metrics import (
+    EVALUATION_FAILURES,
+    MATERIALIZED_LOOKUPS,
+    STAGE_AVOID_FACTORS,
+    STAGE_CANDIDATE_WALK,
+    STAGE_EVALUATION,
+    STAGE_MATERIALIZED_LOOKUP,
+    STAGE_NEIGHBORS,
+    STAGE_RATING_FILTER,
+    set_candidates,
+    time_stage,
+)
 
 logger = setup_colored_logger(__name__)
 
+# candidates checked by the first block of a walk, every next block is twice as large
+MIN_WALK_BLOCK_SIZE = 16
+
 class RecommendationEngine:
     """
     A recommendation engine that suggests alternative food products based on nutritional values and categories.
 
     The engine uses a multi-step filtering and ranking process:
+    1. Narrows the candidates down to the most similar products from the neighbor index,
+       or by comparing categories on the fly when the product has no neighbors
     2. Excludes products with unwanted characteristics (based on recommendation factors)
+       and products not rated better than the product
     3. Evaluates and ranks remaining products using a configurable scoring system
 
+    Given a candidate index, candidates are walked best score without preferences
+    first with both exclusions applied inline, and the walk stops once the remaining
+    candidates cannot beat the recommendations found, so its work follows the number
+    of recommendations rather than the number of neighbors.
+
     Key Features:
         - Customizable evaluation strategy for product scoring
 
     Attributes:
         recommendation_strategy: Defines scoring rules and factors to consider/avoid
         evaluator: Implements the product scoring logic
+        categories_similarity_threshold: Minimum similarity of a neighbor to be considered
+        max_similar_products: Maximum number of most similar neighbors to be considered
+        categories_comparator: Finds similar products of products missing from the neighbor index, if set
     """
-    def __init__(self, recommendation_strategy: Optional[RecommendationStrategy] = None, evaluator: OpenFoodFactsProductEvaluator = NutriscoreEvaluator(), categories_similarity_threshold: float = 0.9) -> None:
+    def __init__(self, recommendation_strategy: Optional[RecommendationStrategy] = None, evaluator: OpenFoodFactsProductEvaluator = NutriscoreEvaluator(), categories_similarity_threshold: float = 0.9, max_similar_products: Optional[int] = None, categories_comparator: Optional[CategoriesComparator] = None) -> None:
         """
         Initializes the RecommendationEngine with the specified strategy, comparator, evaluator,
         and category similarity threshold.
@@ -34,145 +65,420 @@ class RecommendationEngine:
         Args:
             recommendation_strategy (RecommendationStrategy): The strategy for scoring and ranking recommendations.
             evaluator (OpenFoodFactsProductEvaluator): Evaluator for product scoring.
+            categories_similarity_threshold (float): Minimum similarity of a neighbor to be considered.
+            max_similar_products (Optional[int]): Maximum number of most similar neighbors to be considered, all by default.
+            categories_comparator (Optional[CategoriesComparator]): Comparator of categories used when a product has no neighbors, none by default.
         """
         self.recommendation_strategy = recommendation_strategy or RecommendationStrategy.create_default()
         self.evaluator = evaluator
+        self.categories_similarity_threshold = categories_similarity_threshold
+        self.max_similar_products = max_similar_products
+        self.categories_comparator = categories_comparator
         
 
-    def find_recommendations(self, from_df: pd.DataFrame, product: OpenFoodFactsProduct, n=1) -> List[str]:
+    def find_recommendations(self, from_df: pd.DataFrame, product: OpenFoodFactsProduct, code_index: ProductCodeIndex, neighbor_index: NeighborIndex, n=1, preferences: Optional[PreferenceVector] = None, candidate_index: Optional[CandidateIndex] = None) -> List[str]:
         """
         Finds the top `n` recommended products for a given product based on similarity and scoring.
 
         Args:
             from_df (pd.DataFrame): DataFrame containing product data for generating recommendations.
             product (OpenFoodFactsProduct): The target product for which recommendations are sought.
+            code_index (ProductCodeIndex): Index from product codes to row IDs of `from_df`.
+            neighbor_index (NeighborIndex): Similarity graph whose row IDs refer to `from_df`.
             n (int, optional): Number of recommendations to return. Defaults to 1.
+            preferences (Optional[PreferenceVector], optional): Statuses of the recommendation factors for this request. All neutral by default.
+            candidate_index (Optional[CandidateIndex], optional): Candidates sorted by score, built by `build_candidate_index`. Not used by default.
 
         Returns:
             List[int]: List of product codes for the top `n` recommendations.
         """
-        _df = from_df.copy()
-        logger.info(f"start finding recommendations for {product.code}")
+        logger.info("start finding recommendations for %s", product.code)
+        
+        recommendations = None
+        if self.__can_walk(candidate_index):
+            recommendations = self.__walk_candidates(from_df, product, code_index, candidate_index, preferences, n)
         
-        logger.info(f"start getting most similar products")
-        _df = self.__get_most_similar_products(_df, product)
+        if recommendations is None:
+            logger.debug("start getting most similar products")
+            with time_stage(STAGE_NEIGHBORS):
+                _df = self.__get_most_similar_products(from_df, product, code_index, neighbor_index)
+            set_candidates(STAGE_NEIGHBORS, len(_df))
+            
+            logger.debug("got %d most similar products", len(_df))
+            
+            logger.debug("start excluding redundant products from %d products", len(_df))
+            
+            with time_stage(STAGE_AVOID_FACTORS):
+                _df = self.__avoid_factors(_df, preferences)
+            set_candidates(STAGE_AVOID_FACTORS, len(_df))
+            
+            logger.debug("redundant products excluded")
+            
+            logger.debug("%d products left after excluding redundant products", len(_df))
+            
+            logger.debug("Start getting %d best recommendations if possible", n)
+            
+            recommendations = self.__get_n_best_recommendations(_df, product, preferences, n)
         
-        logger.info(f"got {len(_df)} most similar products")
+        if len(recommendations) < n:
+            logger.warning("Could not find enough products to recommend. Found %d products.", len(recommendations))
         
-        logger.info(f"start excluding redundant products from {len(_df)} products")
+        return recommendations
 
-        _df = self.__avoid_factors(_df)
-        
-        logger.info(f"redundant products excluded")
+    def find_recommendations_many(self, from_df: pd.DataFrame, products: List[OpenFoodFactsProduct], code_index: ProductCodeIndex, neighbor_index: NeighborIndex, n: Union[int, List[int]] = 1, preferences: Optional[PreferenceVector] = None, candidate_index: Optional[CandidateIndex] = None) -> List[List[str]]:
+        """
+        Finds recommendations for many products sharing the same preferences.
+
+        Without a candidate index, neighbors of all products are excluded and evaluated
+        together, so a candidate product shared by several neighbor lists is only checked
+        and scored once. Recommendations of every product are the same as from `find_recommendations`.
+
+        Args:
+            from_df (pd.DataFrame): DataFrame containing product data for generating recommendations.
+            products (List[OpenFoodFactsProduct]): The target products for which recommendations are sought.
+            code_index (ProductCodeIndex): Index from product codes to row IDs of `from_df`.
+            neighbor_index (NeighborIndex): Similarity graph whose row IDs refer to `from_df`.
+            n (Union[int, List[int]], optional): Number of recommendations to return, for all products or for each one. Defaults to 1.
+            preferences (Optional[PreferenceVector], optional): Statuses of the recommendation factors shared by all products. All neutral by default.
+            candidate_index (Optional[CandidateIndex], optional): Candidates sorted by score, built by `build_candidate_index`. Not used by default.
+
+        Returns:
+            List[List[str]]: Product codes of the recommendations of every product, in order of `products`.
+        """
+        limits = [n] * len(products) if isinstance(n, int) else list(n)
+        if len(limits) != len(products):
+            raise ValueError(f"Got {len(limits)} limits for {len(products)} products")
         
-        logger.info(f"{len(_df)} products left after excluding redundant products")
+        logger.info("start finding recommendations for %d products", len(products))
         
-        logger.info(f"Start getting {n} best recommendations if possible")
-
-        recommendations = self.__get_n_best_recommendations(_df, product, n)
+        recommendations: List[Optional[List[str]]] = [None] * len(products)
+        if self.__can_walk(candidate_index):
+            for i, (product, limit) in enumerate(zip(products, limits)):
+                recommendations[i] = self.__walk_candidates(from_df, product, code_index, candidate_index, preferences, limit)
         
+        remaining = [i for i, found in enumerate(recommendations) if found is None]
+        if remaining:
+            scored = self.__score_candidates_many(from_df, [products[i] for i in remaining], code_index, neighbor_index, preferences)
+            for i, (candidates, scores, codes) in zip(remaining, scored):
+                recommendations[i] = self.__select_recommendations(products[i], candidates, scores, codes, limits[i])
         return recommendations
 
-    def __get_most_similar_products(self, from_df: pd.DataFrame, product: OpenFoodFactsProduct) -> pd.DataFrame:
+    def rank_candidates_many(self, from_df: pd.DataFrame, products: List[OpenFoodFactsProduct], code_index: ProductCodeIndex, neighbor_index: NeighborIndex, n: int, preferences: Optional[PreferenceVector] = None, candidate_index: Optional[CandidateIndex] = None) -> List[Tuple[np.ndarray, bool]]:
+        """
+        Ranks the recommendations of many products for a limit of `n`, telling whether there are more.
+
+        Recommendations for a limit m <= n are the first m of the ranked ones, and for any
+        limit when there are no more, so the ranking can answer later requests.
+
+        Args:
+            from_df (pd.DataFrame): DataFrame containing product data for generating recommendations.
+            products (List[OpenFoodFactsProduct]): The target products for which candidates are ranked.
+            code_index (ProductCodeIndex): Index from product codes to row IDs of `from_df`.
+            neighbor_index (NeighborIndex): Similarity graph whose row IDs refer to `from_df`.
+            n (int): Number of recommendations to rank.
+            preferences (Optional[PreferenceVector], optional): Statuses of the recommendation factors shared by all products. All neutral by default.
+            candidate_index (Optional[CandidateIndex], optional): Candidates sorted by score, built by `build_candidate_index`. Not used by default.
+
+        Returns:
+            List[Tuple[np.ndarray, bool]]: For every product, codes of its best recommendations best first,
+                and whether these are all the products it can be recommended.
+        """
+        # one more than asked tells whether there are more
+        ranked = self.find_recommendations_many(from_df, products, code_index, neighbor_index, n + 1, preferences, candidate_index)
+        return [(np.asarray(codes[:n], dtype=object), len(codes) <= n) for codes in ranked]
+
+    def find_recommendations_materialized(self, from_df: pd.DataFrame, product: OpenFoodFactsProduct, code_index: ProductCodeIndex, materialized: MaterializedRecommendations, n=1, preferences: Optional[PreferenceVector] = None) -> Optional[List[str]]:
+        """
+        Finds recommendations from the ones ranked offline for neutral requests, without reading neighbors.
+
+        Neutral requests take the stored recommendations. AVOID preferences do not change
+        scores, so the stored ranking holds once avoided products are left out. RECOMMEND
+        preferences change scores, the stored recommendations are re-ranked only when they
+        are all the products the product can be recommended.
+
+        Args:
+            from_df (pd.DataFrame): DataFrame containing product data for generating recommendations.
+            product (OpenFoodFactsProduct): The target product for which recommendations are sought.
+            code_index (ProductCodeIndex): Index from product codes to row IDs of `from_df`.
+            materialized (MaterializedRecommendations): Recommendations ranked with the settings of this engine.
+            n (int, optional): Number of recommendations to return. Defaults to 1.
+            preferences (Optional[PreferenceVector], optional): Statuses of the recommendation factors for this request. All neutral by default.
+
+        Returns:
+            Optional[List[str]]: Product codes of the recommendations, or None if they need to be computed live.
+        """
+        product_row = code_index.row_of(product.code)
+        if product_row is None:
+            return None
         
-        def normalize_product_codes(df: pd.DataFrame, column_name: str) -> pd.DataFrame:
-            """Normalize product codes to 8 digits"""
-            df = df.copy()
-            df[column_name] = df[column_name].astype(str).str.zfill(8)
-            return df
+        preferences = preferences or PreferenceVector()
+        factors = self.recommendation_strategy.recommendation_factors
+        recommended = preferences.factors_with(FactorPreferenceStatus.RECOMMEND, factors)
+        with time_stage(STAGE_MATERIALIZED_LOOKUP):
+            rows, complete = materialized.recommendations(product_row)
+            
+            if not recommended and not preferences.factors_with(FactorPreferenceStatus.AVOID, factors) and (n <= materialized.top_n or complete):
+                MATERIALIZED_LOOKUPS.labels(result="hit").inc()
+                return list(code_index.codes[rows[:n]])
+            
+            if not recommended:
+                kept = rows[~self.__avoided_mask(from_df.iloc[rows], preferences)]
+                if len(kept) >= n or complete:
+                    MATERIALIZED_LOOKUPS.labels(result="hit").inc()
+                    return list(code_index.codes[kept[:n]])
         
-        similarities = pd.read_csv(DATA_DIR / 'similarities.csv')
-        similarities = normalize_product_codes(similarities, 'product1')
-        similarities = normalize_product_codes(similarities, 'product2')
-    
-        product_code = str(product.code).zfill(8)
+        if not complete:
+            MATERIALIZED_LOOKUPS.labels(result="miss").inc()
+            return None
         
-        similar_products = similarities[similarities['product1'] == product_code]
+        MATERIALIZED_LOOKUPS.labels(result="rerank").inc()
+        logger.debug("re-ranking %d materialized recommendations of %s", len(rows), product.code)
+        with time_stage(STAGE_AVOID_FACTORS):
+            candidates = self.__avoid_factors(from_df.iloc[rows].assign(code=code_index.codes[rows]), preferences)
+        # stored recommendations are all rated better than the product
+        return self.__get_n_best_recommendations(candidates, product, preferences, n, have_better_rating=False)
 
-    
-        normalized_df = normalize_product_codes(from_df, 'code')
-        filtered_products = normalized_df[
-        normalized_df['code'].isin(similar_products['product2'])
-    ]
+    def build_candidate_index(self, from_df: pd.DataFrame, code_index: ProductCodeIndex, neighbor_index: NeighborIndex) -> CandidateIndex:
+        """
+        Sorts the candidates of every product by score without preferences, in the order this engine ranks them.
+
+        Args:
+            from_df (pd.DataFrame): DataFrame containing product data for generating recommendations.
+            code_index (ProductCodeIndex): Index from product codes to row IDs of `from_df`.
+            neighbor_index (NeighborIndex): Similarity graph whose row IDs refer to `from_df`.
+
+        Returns:
+            CandidateIndex: Candidates of every product for the neighbor settings of this engine.
+        """
+        base_scores = np.asarray(self.evaluator.evaluate_many(from_df, self.recommendation_strategy.recommendation_factors), dtype=float)
+        # ties rank by code, like in __select_best
+        tie_ranks = np.unique(code_index.codes, return_inverse=True)[1]
+        if self.recommendation_strategy.nutritional_rating_system.maximize_score:
+            tie_ranks = -tie_ranks
+        return CandidateIndex.from_neighbors(neighbor_index, base_scores, tie_ranks, self.categories_similarity_threshold, self.max_similar_products)
+
+    def settings(self) -> dict:
+        """Settings deciding the candidates of a product and their ranking, stored with results computed offline"""
+        return {
+            "categories_similarity_threshold": self.categories_similarity_threshold,
+            "max_similar_products": self.max_similar_products,
+            "categories_comparator": type(self.categories_comparator).__name__ if self.categories_comparator is not None else None,
+            "evaluator": type(self.evaluator).__name__,
+            "nutritional_rating_system": type(self.recommendation_strategy.nutritional_rating_system).__name__,
+        }
+
+    def __can_walk(self, candidate_index: Optional[CandidateIndex]) -> bool:
+        return candidate_index is not None and candidate_index.matches(self.categories_similarity_threshold, self.max_similar_products)
+
+    def __walk_candidates(self, from_df: pd.DataFrame, product: OpenFoodFactsProduct, code_index: ProductCodeIndex, candidate_index: CandidateIndex, preferences: Optional[PreferenceVector], n: int) -> Optional[List[str]]:
+        """
+        Recommendations from the candidates of the product, walked best score without preferences first.
+
+        Candidates are checked in blocks of doubling size. With preferences lowering scores
+        by at most `gain`, a candidate with a score s without preferences scores at least
+        s - gain, so the walk stops once n recommendations are found and the next candidate
+        cannot beat the n-th of them. Without such preferences the walk follows the final
+        ranking and stops as soon as n are found.
+
+        Returns:
+            Optional[List[str]]: Product codes of the recommendations, or None if the product has no candidates in the index
+        """
+        product_row = code_index.row_of(product.code)
+        if product_row is None:
+            return None
+        with time_stage(STAGE_NEIGHBORS):
+            rows, base_scores = candidate_index.candidates(product_row)
+        set_candidates(STAGE_NEIGHBORS, len(rows))
+        if len(rows) == 0:
+            # the live path compares categories instead, when it can
+            return None
+        if n < 1:
+            return []
         
-        return filtered_products
+        preferences = preferences or PreferenceVector()
+        gain = self.evaluator.preference_gain(self.recommendation_strategy.recommendation_factors, preferences)
+        found_rows, found_scores = [], []
+        found = walked = 0
+        block_size = max(2 * n, MIN_WALK_BLOCK_SIZE)
+        try:
+            with time_stage(STAGE_CANDIDATE_WALK):
+                while walked < len(rows):
+                    end = len(rows) if gain is None else min(walked + block_size, len(rows))
+                    block_rows = rows[walked:end]
+                    block = from_df.iloc[block_rows]
+                    kept = ~self.__avoided_mask(block, preferences) & np.asarray(self.__compare_ratings(product, block), dtype=bool)
+                    if gain == 0:
+                        scores = base_scores[walked:end]
+                    else:
+                        scores = self.__evaluate_all(block.assign(code=code_index.codes[block_rows]), preferences)
+                        kept &= ~np.isnan(scores)
+                    found_rows.append(block_rows[kept])
+                    found_scores.append(scores[kept])
+                    found += int(np.count_nonzero(kept))
+                    walked, block_size = end, block_size * 2
+                    
+                    if found >= n:
+                        if gain == 0:
+                            break
+                        nth_score = np.partition(np.concatenate(found_scores), n - 1)[n - 1]
+                        if walked < len(rows) and base_scores[walked] - gain > nth_score:
+                            break
+        except Exception as e:
+            logger.error("Error getting recommendations: %s", e)
+            return []
+        set_candidates(STAGE_CANDIDATE_WALK, walked)
+        logger.debug("walked %d of %d candidates for %d recommendations", walked, len(rows), n)
         
+        rows, scores = np.concatenate(found_rows), np.concatenate(found_scores)
+        codes = code_index.codes[rows]
+        return list(codes[self.__select_best(scores, codes, n)])
+
+    def __score_candidates_many(self, from_df: pd.DataFrame, products: List[OpenFoodFactsProduct], code_index: ProductCodeIndex, neighbor_index: NeighborIndex, preferences: Optional[PreferenceVector]) -> List[Tuple[pd.DataFrame, np.ndarray, np.ndarray]]:
+        """Allowed candidates of every product with their scores and codes, each distinct candidate evaluated once"""
+        with time_stage(STAGE_NEIGHBORS):
+            neighbor_rows = [self.__get_similar_rows(from_df, product, code_index, neighbor_index) for product in products]
+            candidate_rows = np.unique(np.concatenate(neighbor_rows)) if neighbor_rows else np.zeros(0, dtype=np.int64)
+            candidates = from_df.iloc[candidate_rows]
+        set_candidates(STAGE_NEIGHBORS, len(candidates))
         
+        logger.debug("evaluating %d distinct candidate products", len(candidates))
+        with time_stage(STAGE_AVOID_FACTORS):
+            allowed = ~self.__avoided_mask(candidates, preferences)
+        set_candidates(STAGE_AVOID_FACTORS, int(np.count_nonzero(allowed)))
+        scores = self.__evaluate_all(candidates, preferences)
+        
+        scored = []
+        for rows in neighbor_rows:
+            positions = np.searchsorted(candidate_rows, rows)
+            positions = positions[allowed[positions]]
+            scored.append((candidates.iloc[positions], scores[positions], code_index.codes[candidate_rows[positions]]))
+        return scored
+
+    def __get_similar_rows(self, from_df: pd.DataFrame, product: OpenFoodFactsProduct, code_index: ProductCodeIndex, neighbor_index: NeighborIndex) -> np.ndarray:
+        product_row = code_index.row_of(product.code)
+        if product_row is None:
+            logger.warning("Product %s not found in code index", product.code)
+            return np.zeros(0, dtype=np.int64)
+        
+        rows, _ = neighbor_index.neighbors(
+            product_row,
+            min_similarity=self.categories_similarity_threshold,
+            top_k=self.max_similar_products
+        )
+        if len(rows) == 0 and self.categories_comparator is not None:
+            logger.info("Product %s has no neighbors, comparing categories instead", product.code)
+            rows = self.__filter_categories(from_df, product, product_row)
+        return rows
+
+    def __get_most_similar_products(self, from_df: pd.DataFrame, product: OpenFoodFactsProduct, code_index: ProductCodeIndex, neighbor_index: NeighborIndex) -> pd.DataFrame:
+        rows = self.__get_similar_rows(from_df, product, code_index, neighbor_index)
+        return from_df.iloc[rows].assign(code=code_index.codes[rows])
+
 
-    def __get_n_best_recommendations(self, from_df: pd.DataFrame, product: OpenFoodFactsProduct, n: int = 1, have_better_rating: bool = True) -> List[str]:
+
+    def __get_n_best_recommendations(self, from_df: pd.DataFrame, product: OpenFoodFactsProduct, preferences: Optional[PreferenceVector], n: int = 1, have_better_rating: bool = True) -> List[str]:
         try:
-            logger.info(f"Starting to evaluate {len(from_df)} products")
-            evaluation_heap = self.__evaluate_all(from_df)
-            
-            if self.recommendation_strategy.nutritional_rating_system.maximize_score:
-                best_n = [(score * -1, code) for score, code in nlargest(n, evaluation_heap)]
-            else:
-                best_n = nsmallest(n, evaluation_heap)
-            
-            logger.info(f"Found {len(best_n)} products with best scores")
+            logger.debug("Starting to evaluate %d products", len(from_df))
+            scores = self.__evaluate_all(from_df, preferences)
+            codes = from_df['code'].to_numpy(dtype=object)
+        except Exception as e:
+            EVALUATION_FAILURES.inc(len(from_df))
+            logger.error("Error getting recommendations: %s", e)
+            return []
+        return self.__select_recommendations(product, from_df, scores, codes, n, have_better_rating)
+
+    def __select_recommendations(self, product: OpenFoodFactsProduct, candidates: pd.DataFrame, scores: np.ndarray, codes: np.ndarray, n: int = 1, have_better_rating: bool = True) -> List[str]:
+        with time_stage(STAGE_RATING_FILTER):
+            recommendations = self.__select_rated_recommendations(product, candidates, scores, codes, n, have_better_rating)
+        set_candidates(STAGE_RATING_FILTER, len(recommendations))
+        return recommendations
+
+    def __select_rated_recommendations(self, product: OpenFoodFactsProduct, candidates: pd.DataFrame, scores: np.ndarray, codes: np.ndarray, n: int, have_better_rating: bool) -> List[str]:
+        try:
+            kept = ~np.isnan(scores)
+            if not kept.all():
+                logger.warning("Failed to evaluate %d products", np.count_nonzero(~kept))
             
             if have_better_rating:
-                logger.info(f"Filtering products with better rating than source product")
-                for score, code in best_n:
-                    logger.info(f"Product {code} has a score of {score}")
-                    best_n = [(score, code) for score, code in best_n if self.__compare_ratings(product, OpenFoodFactsProduct(code, from_df[from_df['code'].astype(str) == code].squeeze()))]
+                logger.debug("Filtering products with better rating than source product")
+                # before taking the best, a worse rated product must not take the place of a better rated one
+                kept &= np.asarray(self.__compare_ratings(product, candidates), dtype=bool)
+            scores, codes = scores[kept], codes[kept]
             
-            if len(best_n) < n:
-                logger.warning(f"Could not find enough products to recommend. Found {len(best_n)} products.")
-
-            for score, code in best_n:
-                logger.info(f"Product {code} has a score of {score}") 
+            best = self.__select_best(scores, codes, n)
+            logger.debug("Found %d products with best scores", len(best))
             
-            return [code for _, code in best_n]
+            if logger.isEnabledFor(logging.DEBUG):
+                for score, code in zip(scores[best], codes[best]):
+                    logger.debug("Product %s has a score of %s", code, score)
             
+            return list(codes[best])
+        
         except Exception as e:
-            logger.error(f"Error getting recommendations: {str(e)}")
+            logger.error("Error getting recommendations: %s", e)
             return []
+
+    def __select_best(self, scores: np.ndarray, codes: np.ndarray, n: int) -> np.ndarray:
+        """
+        Select positions of the `n` best scores, best first.
+        
+        Keeps the ranking of the former heap of (sign * score, code) entries: taking
+        the largest entries when the rating system maximizes its score cancels out
+        the sign, so scores always rank ascending and only ties on code are reversed.
+        Only the products that can make it to the top `n` get fully sorted.
+        """
+        if len(scores) > n:
+            kth = np.partition(scores, n - 1)[n - 1]
+            candidates = np.flatnonzero(scores <= kth)
+        else:
+            candidates = np.arange(len(scores))
+        
+        code_ranks = np.unique(codes[candidates], return_inverse=True)[1]
+        if self.recommendation_strategy.nutritional_rating_system.maximize_score:
+            code_ranks = -code_ranks
+        
+        return candidates[np.lexsort((code_ranks, scores[candidates]))[:n]]
     
-    
-    def __evaluate(self, product: OpenFoodFactsProduct) -> float:
-        return self.evaluator.evaluate(product, self.recommendation_strategy.recommendation_factors)
-
-    def __evaluate_all(self, df: pd.DataFrame) -> List[tuple[float, str]]:
-        evaluation = []
-        sign = -1 if self.recommendation_strategy.nutritional_rating_system.maximize_score else 1
-        
-        for _, row in df.iterrows():
-            try:
-                product = OpenFoodFactsProduct(row['code'], row)
-                score = self.__evaluate(product)
-                heappush(evaluation, (sign * score, str(row['code'])))
-            except Exception as e:
-                logger.warning(f"Failed to evaluate product {row['code']}: {str(e)}")
-                continue
-        return evaluation
+    def __evaluate_all(self, df: pd.DataFrame, preferences: Optional[PreferenceVector]) -> np.ndarray:
+        with time_stage(STAGE_EVALUATION):
+            scores = self.evaluator.evaluate_many(df, self.recommendation_strategy.recommendation_factors, preferences)
+        evaluated = int(np.count_nonzero(~np.isnan(scores)))
+        EVALUATION_FAILURES.inc(len(scores) - evaluated)
+        set_candidates(STAGE_EVALUATION, evaluated)
+        return scores
     
     
-    def __compare_ratings(self, product1: OpenFoodFactsProduct, product2: OpenFoodFactsProduct) -> bool:
-        return self.recommendation_strategy.nutritional_rating_system.has_better_rating(product1, product2)
-
-    # @lru_cache(maxsize=1000)
-    # def __compare_categories(self, product_categories, target_categories):
-    #     return self.categories_comparator.compare(product_categories, target_categories)
-
-    # def __filter_categories(self, df: pd.DataFrame, product_categories) -> pd.DataFrame:
-    #     logger.info(f"start filtering categories from {len(df)} products")
-    #     df['similarity'] = df['categories_en'].apply(
-    #         lambda x: self.__compare_categories(x, product_categories)
-    #     )
-    #     logger.info(f"ended filtering categories")
-    #     return df[df['similarity'] >= self.categories_similarity_threshold].reset_index(drop=True)
-        
-
-    def __avoid_factors(self, df: pd.DataFrame) -> pd.DataFrame:
-        logger.info(f"start avoiding factors from {len(df)} products")
-        for factor in self.recommendation_strategy.recommendation_factors:
-            if factor.status == FactorPreferenceStatus.AVOID:
-                mask = ~df.apply(lambda x: factor.exists(x), axis=1)
-                df = df[mask].reset_index(drop=True)
-        return df
+    def __compare_ratings(self, product: OpenFoodFactsProduct, others: pd.DataFrame) -> np.ndarray:
+        return self.recommendation_strategy.nutritional_rating_system.has_better_rating_many(product, others)
+
+    def __filter_categories(self, df: pd.DataFrame, product: OpenFoodFactsProduct, product_row: int) -> np.ndarray:
+        """Rows of the products whose categories are similar enough to the ones of `product`, most similar first."""
+        product_categories = product.details.get("categories_en")
+        if not isinstance(product_categories, str) or not product_categories.strip():
+            return np.zeros(0, dtype=np.int64)
+        
+        logger.debug("start filtering categories from %d products", len(df))
+        categories = df["categories_en"]
+        if isinstance(categories.dtype, pd.CategoricalDtype):
+            # the distinct strings of the serving schema are compared, not one string per product
+            codes, uniques = categories.cat.codes.to_numpy(), categories.cat.categories.to_numpy(dtype=object)
+        else:
+            codes, uniques = pd.factorize(categories)
+        similarities = self.categories_comparator.compare_codes(product_categories, uniques, codes)
+        similarities[product_row] = -np.inf
+        rows = np.flatnonzero(similarities >= self.categories_similarity_threshold)
+        rows = rows[np.lexsort((rows, -similarities[rows]))][:self.max_similar_products]
+        logger.debug("ended filtering categories, %d similar products", len(rows))
+        return rows
+        
+
+    def __avoid_factors(self, df: pd.DataFrame, preferences: Optional[PreferenceVector]) -> pd.DataFrame:
+        logger.debug("start avoiding factors from %d products", len(df))
+        return df[~self.__avoided_mask(df, preferences)].reset_index(drop=True)
     
-    # def __exclude_redundant_products(self, df: pd.DataFrame, product_categories) -> pd.DataFrame:
-    #     return (df
-    #                 .pipe(self.__filter_categories, product_categories)
-    #                 .pipe(self.__avoid_factors))
\ No newline at end of file
+    def __avoided_mask(self, df: pd.DataFrame, preferences: Optional[PreferenceVector]) -> np.ndarray:
+        avoided = np.zeros(len(df), dtype=bool)
+        preferences = preferences or PreferenceVector()
+        for factor in preferences.factors_with(FactorPreferenceStatus.AVOID, self.recommendation_strategy.recommendation_factors):
+            avoided |= factor.presence_mask(df)
+        return avoided
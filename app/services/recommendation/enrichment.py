@@ -0,0 +1,91 @@
+from typing import List, Optional
+import numpy as np
+import pandas as pd
+from models.domain.off_product import CATEGORY_COLUMN, SERVING_COLUMN_NAMES, apply_serving_schema, categorize_products
+from services.recommendation.strategy import RecommendationStrategy
+from utils.logger import setup_colored_logger
+
+logger = setup_colored_logger(__name__)
+
+
+class DatasetEnricher:
+    """
+    Precomputes derived columns the recommendation engine reads on every request.
+    
+    Runs once when the dataset is loaded, so that requests only read the derived
+    columns instead of recomputing them for every candidate product.
+    
+    Derived columns:
+        - presence column of each recommendation factor
+        - product category code (CATEGORY_COLUMN)
+        - nutriscore_score computed by the rating system where the dataset has none
+        - rating ordinal of the rating system, so that ratings compare as integers
+    
+    The dataset is then projected on the serving schema (SERVING_SCHEMA), which drops
+    the columns no request reads and stores the others with compact dtypes.
+    
+    Attributes:
+        recommendation_strategy: Strategy whose recommendation factors and rating system are used
+    """
+    def __init__(self, recommendation_strategy: Optional[RecommendationStrategy] = None) -> None:
+        self.recommendation_strategy = recommendation_strategy or RecommendationStrategy.create_default()
+        
+    def enrich(self, dataset: pd.DataFrame) -> pd.DataFrame:
+        """
+        Add derived columns to the dataset, skipping the ones it already has, and apply the serving schema.
+        
+        Args:
+            dataset: Freshly loaded dataset, derived columns are added to it in place
+            
+        Returns:
+            pd.DataFrame: The enriched dataset, projected on the serving schema
+        """
+        for factor in self.recommendation_strategy.recommendation_factors:
+            if factor.presence_column not in dataset.columns:
+                logger.info(f"Precomputing presence of {factor.name} for {len(dataset)} products")
+                dataset[factor.presence_column] = factor.presence_mask(dataset)
+        
+        if CATEGORY_COLUMN not in dataset.columns:
+            logger.info(f"Precomputing categories of {len(dataset)} products")
+            dataset[CATEGORY_COLUMN] = categorize_products(dataset)
+        
+        self.__fill_missing_scores(dataset)
+        
+        rating_system = self.recommendation_strategy.nutritional_rating_system
+        if rating_system.rating_ordinal_column not in dataset.columns:
+            logger.info(f"Precomputing ratings of {len(dataset)} products")
+            ordinals = rating_system.rating_ordinals(dataset)
+            if ordinals is not None:
+                dataset[rating_system.rating_ordinal_column] = ordinals
+            else:
+                logger.warning(f"Ratings not precomputed: {type(rating_system).__name__} has no rating scale")
+        
+        # derived columns are computed first, from the nutrients at full precision
+        return apply_serving_schema(dataset, extra_columns=self.derived_columns)
+    
+    @property
+    def derived_columns(self) -> List[str]:
+        """Columns added by `enrich`"""
+        rating_system = self.recommendation_strategy.nutritional_rating_system
+        return [factor.presence_column for factor in self.recommendation_strategy.recommendation_factors] + [CATEGORY_COLUMN, rating_system.rating_ordinal_column]
+    
+    @property
+    def serving_columns(self) -> List[str]:
+        """Columns of an enriched dataset, the only ones worth loading from a columnar dataset"""
+        return SERVING_COLUMN_NAMES + self.derived_columns
+    
+    def __fill_missing_scores(self, dataset: pd.DataFrame) -> None:
+        if "nutriscore_score" not in dataset.columns:
+            dataset["nutriscore_score"] = np.nan
+        
+        scores = pd.to_numeric(dataset["nutriscore_score"], errors="coerce")
+        missing = scores.isna().to_numpy()
+        if not missing.any() and scores.dtype == dataset["nutriscore_score"].dtype:
+            # keep the loaded column, which may be memory-mapped
+            return
+        if missing.any():
+            logger.info(f"Computing fallback nutriscore_score for {np.count_nonzero(missing)} products")
+            # the loaded column may be a read-only memory map
+            scores = scores.copy()
+            scores[missing] = self.recommendation_strategy.nutritional_rating_system.calculate_scores(dataset[missing])
+        dataset["nutriscore_score"] = scores
@@ -1,6 +1,8 @@
 from abc import ABC, abstractmethod
+import numpy as np
+import pandas as pd
 from models.domain.off_product import OpenFoodFactsProduct
-from services.recommendation.factors.recommendation_factor import RecommendationFactor
+from services.recommendation.factors.recommendation_factor import PreferenceVector, RecommendationFactor
 from typing import Optional, List
 
 class OpenFoodFactsProductEvaluator(ABC):
@@ -9,5 +11,41 @@ class OpenFoodFactsProductEvaluator(ABC):
         self.bonus = bonus
         
     @abstractmethod
-    def evaluate(self, product: OpenFoodFactsProduct, recommendation_factors: List[RecommendationFactor]) -> float:
-        pass
\ No newline at end of file
+    def evaluate(self, product: OpenFoodFactsProduct, recommendation_factors: List[RecommendationFactor], preferences: Optional[PreferenceVector] = None) -> float:
+        pass
+    
+    def evaluate_many(self, products: pd.DataFrame, recommendation_factors: List[RecommendationFactor], preferences: Optional[PreferenceVector] = None) -> np.ndarray:
+        """
+        Evaluate many products at once.
+        
+        Args:
+            products: pd.DataFrame containing product details, one product per row
+            recommendation_factors: recommendation factors to take into account
+            preferences: statuses of the factors for the request, all neutral by default
+            
+        Returns:
+            np.ndarray: Scores in row order, NaN for products that could not be evaluated
+        """
+        scores = np.full(len(products), np.nan)
+        for i, (_, details) in enumerate(products.iterrows()):
+            try:
+                scores[i] = self.evaluate(OpenFoodFactsProduct(details['code'], details), recommendation_factors, preferences)
+            except Exception:
+                continue
+        return scores
+    
+    def preference_gain(self, recommendation_factors: List[RecommendationFactor], preferences: Optional[PreferenceVector] = None) -> Optional[float]:
+        """
+        Most the preferences can lower the score of a product below its score without preferences.
+        
+        Lets the engine stop evaluating candidates sorted by their score without preferences
+        once the next one cannot beat the recommendations found so far.
+        
+        Args:
+            recommendation_factors: recommendation factors to take into account
+            preferences: statuses of the factors for the request, all neutral by default
+            
+        Returns:
+            Optional[float]: Upper bound of the score decrease, None if there is none
+        """
+        return None
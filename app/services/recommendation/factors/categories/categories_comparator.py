@@ -1,8 +1,36 @@
 from abc import ABC, abstractmethod
+from typing import Sequence
+import numpy as np
 
 class CategoriesComparator(ABC):
     @abstractmethod
     def compare(self, product_categories: str, user_categories: str) -> float:
         pass
     
-    
\ No newline at end of file
+    def compare_many(self, source_categories: str, candidate_categories: Sequence[str]) -> np.ndarray:
+        """
+        Compare the categories of one source with the categories of many candidates.
+
+        Returns:
+            np.ndarray: float32 similarity of every candidate to the source
+        """
+        return np.array([self.compare(categories, source_categories) for categories in candidate_categories], dtype=np.float32)
+    
+    def compare_codes(self, source_categories: str, unique_categories: Sequence[str], codes: np.ndarray) -> np.ndarray:
+        """
+        Compare the categories of one source with the categories of many candidates, given as codes
+        of their distinct categories, e.g. the categories and codes of a categorical column.
+
+        Every distinct category string is compared once.
+
+        Args:
+            source_categories: Categories of the source
+            unique_categories: Distinct categories of the candidates
+            codes: Position in `unique_categories` of the categories of every candidate, -1 if missing
+
+        Returns:
+            np.ndarray: float32 similarity of every candidate to the source, -inf for missing categories
+        """
+        similarities = np.append(self.compare_many(source_categories, unique_categories), np.float32(-np.inf)).astype(np.float32, copy=False)
+        # code -1 takes the last, -inf, similarity
+        return similarities[codes]
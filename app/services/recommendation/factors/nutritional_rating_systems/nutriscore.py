@@ -1,14 +1,19 @@
 from services.recommendation.factors.nutritional_rating_systems.nutritional_rating_system import NutritionalScore, NutritionalRatingSystem
-from models.domain.off_product import OpenFoodFactsProduct
+from models.domain.off_product import OpenFoodFactsProduct, PRODUCT_CATEGORIES, categorize_products
 from services.recommendation.evaluator.off_evaluator import OpenFoodFactsProductEvaluator
-from services.recommendation.factors.recommendation_factor import RecommendationFactor, FactorPreferenceStatus
+from services.recommendation.factors.recommendation_factor import PreferenceVector, RecommendationFactor, FactorPreferenceStatus
 from enum import Enum
-from typing import List
+from typing import List, Optional
+import numpy as np
+import pandas as pd
 from pandas import notna
 from utils.logger import setup_colored_logger
 
 logger = setup_colored_logger(__name__)
 
+# Order of grades, the better the grade the higher its ordinal
+GRADE_ORDINALS = {"A": 5, "B": 4, "C": 3, "D": 2, "E": 1}
+
 
 class NutriscoreGrade(Enum):
     A = "A"
@@ -17,13 +22,15 @@ class NutriscoreGrade(Enum):
     D = "D"
     E = "E"
     
+    @property
+    def ordinal(self) -> int:
+        return GRADE_ORDINALS[self.value]
+    
     def __lt__(self, other):
-        grades_order = {"A": 5, "B": 4, "C": 3, "D": 2, "E": 1}
-        return grades_order[self.value] < grades_order[other.value]
+        return self.ordinal < other.ordinal
         
     def __gt__(self, other):
-        grades_order = {"A": 5, "B": 4, "C": 3, "D": 2, "E": 1}
-        return grades_order[self.value] > grades_order[other.value]
+        return self.ordinal > other.ordinal
         
     def __le__(self, other):
         return self < other or self == other
@@ -32,12 +39,18 @@ class NutriscoreGrade(Enum):
         return self > other or self == other
 
 
+GRADES_BY_ORDINAL = np.array([None] + sorted(NutriscoreGrade), dtype=object)
+
+
 class Nutriscore(NutritionalRatingSystem):
     """Implementation of the Nutri-Score rating system."""
+    rating_ordinal_column = "nutriscore_grade_ordinal"
+    rating_scale = tuple(GRADES_BY_ORDINAL[1:])
     
     def __init__(self, maximize_score=False):
         super().__init__(maximize_score)
         self._thresholds = self._initialize_thresholds()
+        self._grade_ranges = self._initialize_grade_ranges()
         
     @staticmethod
     def _initialize_thresholds() -> dict:
@@ -59,7 +72,26 @@ class Nutriscore(NutritionalRatingSystem):
             "fiber": [0.7, 1.4, 2.1, 2.8, 3.5],
             "protein": [1.6, 3.2, 4.8, 6.4, 8.0]
         }
-
+        
+    @staticmethod
+    def _initialize_grade_ranges() -> dict:
+        """Initialize score ranges of each grade for different product categories."""
+        return {
+            "solid": {
+                (-float('inf'), -1): NutriscoreGrade.A,
+                (-1, 2): NutriscoreGrade.B,
+                (2, 10): NutriscoreGrade.C,
+                (10, 18): NutriscoreGrade.D,
+                (18, float('inf')): NutriscoreGrade.E
+            },
+            "beverage": {
+                (-float('inf'), 0): NutriscoreGrade.A,
+                (0, 1): NutriscoreGrade.B,
+                (1, 5): NutriscoreGrade.C,
+                (5, 9): NutriscoreGrade.D,
+                (9, float('inf')): NutriscoreGrade.E
+            }
+        }
 
     def _score_based_on_thresholds(self, value: float, thresholds: list, max_score: int) -> int:
         """Calculate score based on value and thresholds."""
@@ -67,6 +99,24 @@ class Nutriscore(NutritionalRatingSystem):
             if value <= threshold:
                 return i
         return max_score
+    
+    def _scores_based_on_thresholds(self, values: np.ndarray, thresholds: list, max_score: int) -> np.ndarray:
+        """Calculate scores of many values based on thresholds, same as _score_based_on_thresholds."""
+        # number of thresholds strictly below the value is the index of the first threshold >= value,
+        # NaN sorts after every threshold and gets max_score like in the scalar version
+        return np.minimum(np.searchsorted(thresholds, values, side="left"), max_score)
+    
+    def _categories_many(self, products: pd.DataFrame) -> np.ndarray:
+        """Main category of many products as ProductCategory values."""
+        return np.array([category.value for category in PRODUCT_CATEGORIES])[categorize_products(products)]
+    
+    def _category_scores(self, values: np.ndarray, thresholds: dict, categories: np.ndarray, max_score: int) -> np.ndarray:
+        """Calculate scores of many values based on thresholds that depend on the product category."""
+        scores = np.empty(len(values), dtype=np.int64)
+        for category in np.unique(categories):
+            in_category = categories == category
+            scores[in_category] = self._scores_based_on_thresholds(values[in_category], thresholds[category], max_score)
+        return scores
 
     def calculate_score(self, product: OpenFoodFactsProduct) -> NutritionalScore:
         """
@@ -87,7 +137,7 @@ class Nutriscore(NutritionalRatingSystem):
         category = product.category.value
         
         # Calculate negative points
-        logger.info(f"start negative points calculation for {product.code}")
+        logger.debug("start negative points calculation for %s", product.code)
         negative_points = sum([
             self._score_based_on_thresholds(
                 product.details["energy_100g"],
@@ -126,6 +176,35 @@ class Nutriscore(NutritionalRatingSystem):
         ])
         
         return NutritionalScore(negative_points - positive_points)
+    
+    def calculate_scores(self, products: pd.DataFrame) -> np.ndarray:
+        """
+        Calculate Nutri-Score for many products at once.
+        
+        Args:
+            products: pd.DataFrame containing product details, one product per row
+            
+        Returns:
+            np.ndarray: Calculated Nutri-Scores in row order
+        """
+        categories = self._categories_many(products)
+        
+        def values(column: str) -> np.ndarray:
+            return pd.to_numeric(products[column], errors="coerce").to_numpy(dtype=float)
+        
+        negative_points = (
+            self._category_scores(values("energy_100g"), self._thresholds["energy"], categories, 10)
+            + self._category_scores(values("sugars_100g"), self._thresholds["sugar"], categories, 10)
+            + self._scores_based_on_thresholds(values("saturated-fat_100g"), self._thresholds["saturated_fat"]["default"], 10)
+            + self._scores_based_on_thresholds(values("salt_100g"), self._thresholds["sodium"], 10)
+        )
+        
+        positive_points = (
+            self._scores_based_on_thresholds(values("fiber_100g"), self._thresholds["fiber"], 5)
+            + self._scores_based_on_thresholds(values("proteins_100g"), self._thresholds["protein"], 5)
+        )
+        
+        return negative_points - positive_points
 
     def rate(self, product: OpenFoodFactsProduct) -> NutriscoreGrade:
         """
@@ -137,32 +216,42 @@ class Nutriscore(NutritionalRatingSystem):
         Returns:
             NutriscoreGrade: Nutri-Score grade (A-E)
         """
-        score = self.calculate_score(product)
+        score = self.calculate_score(product).value
         category = product.category.value
         
-        ranges = {
-            "solid": {
-                (-float('inf'), -1): NutriscoreGrade.A,
-                (-1, 2): NutriscoreGrade.B,
-                (2, 10): NutriscoreGrade.C,
-                (10, 18): NutriscoreGrade.D,
-                (18, float('inf')): NutriscoreGrade.E
-            },
-            "beverage": {
-                (-float('inf'), 0): NutriscoreGrade.A,
-                (0, 1): NutriscoreGrade.B,
-                (1, 5): NutriscoreGrade.C,
-                (5, 9): NutriscoreGrade.D,
-                (9, float('inf')): NutriscoreGrade.E
-            }
-        }
-        
-        for (min_score, max_score), grade in ranges[category].items():
+        for (min_score, max_score), grade in self._grade_ranges[category].items():
             if min_score < score <= max_score:
                 return grade
             
         return NutriscoreGrade.E  # Default grade if no range matches
     
+    def rate_many(self, products: pd.DataFrame) -> np.ndarray:
+        """
+        Convert numerical scores of many products to Nutri-Score grades (A-E).
+        
+        Args:
+            products: pd.DataFrame containing product details, one product per row
+            
+        Returns:
+            np.ndarray: NutriscoreGrade of each product in row order
+        """
+        return GRADES_BY_ORDINAL[self._rate_ordinals(products)]
+    
+    def _rate_ordinals(self, products: pd.DataFrame) -> np.ndarray:
+        """Computed Nutri-Score grades of many products as GRADE_ORDINALS values."""
+        scores = self.calculate_scores(products)
+        categories = self._categories_many(products)
+        ordinals = np.empty(len(scores), dtype=np.int8)
+        for category in np.unique(categories):
+            ranges = self._grade_ranges[category]
+            upper_bounds = [max_score for _, max_score in ranges]
+            # scores out of every range (NaN) get the default grade E like in rate
+            category_ordinals = np.array([grade.ordinal for grade in ranges.values()] + [NutriscoreGrade.E.ordinal], dtype=np.int8)
+            in_category = categories == category
+            # a score falls in the first range whose upper bound is >= score
+            ordinals[in_category] = category_ordinals[np.searchsorted(upper_bounds, scores[in_category], side="left")]
+        return ordinals
+    
     def __has_nutriscore(self, product: OpenFoodFactsProduct) -> bool:
         return notna(product.details["nutriscore_grade"]) & (product.details["nutriscore_grade"] != "")
     
@@ -185,37 +274,96 @@ class Nutriscore(NutritionalRatingSystem):
             raise ValueError("Cannot compare empty products")
         
         def get_grade(prod: OpenFoodFactsProduct) -> NutriscoreGrade:
+            if self.rating_ordinal_column in prod.details.index:
+                return GRADES_BY_ORDINAL[prod.details[self.rating_ordinal_column]]
             if self.__has_nutriscore(prod):
                 def convert_grade(grade_str):
                     return NutriscoreGrade[grade_str]
-                logger.info(prod.details["nutriscore_grade"])
                 return convert_grade(prod.details["nutriscore_grade"].upper())
             return self.rate(prod)
         
-        logger.info(f"start comparing nutriscores for {product.code} and {other.code}")
-        logger.info(f"start comparing nutriscores for {get_grade(product)} and {get_grade(other)}")
-        logger.info(f"{get_grade(product) < get_grade(other)}")
+        product_grade, other_grade = get_grade(product), get_grade(other)
+        logger.debug("start comparing nutriscores for %s (%s) and %s (%s)", product.code, product_grade, other.code, other_grade)
+        
+        return product_grade < other_grade
+    
+    def has_better_rating_many(self, product: OpenFoodFactsProduct, others: pd.DataFrame) -> np.ndarray:
+        """
+        Compare Nutri-Score rating of a product with many other products at once.
+        
+        Args:
+            product: OpenFoodFactsProduct to compare
+            others: pd.DataFrame containing details of the products to compare with, one product per row
+                
+        Returns:
+            np.ndarray: Boolean mask, True where the other product has a better Nutri-Score rating,
+                same as has_better_rating(product, other)
+            
+        Raises:
+            ValueError: If the product has empty details
+        """
+        if product.details.empty:
+            raise ValueError("Cannot compare empty products")
         
-        return get_grade(product) < get_grade(other)
+        product_grade = self.rating_ordinals(product.details.to_frame().T)[0]
+        return product_grade < self.rating_ordinals(others)
+    
+    def rating_ordinals(self, products: pd.DataFrame) -> np.ndarray:
+        """
+        Nutri-Score grades of many products as GRADE_ORDINALS values.
+        
+        Reads the precomputed rating_ordinal_column when products have it, otherwise takes
+        the nutriscore_grade of each product, computing it where the grade is missing or invalid.
+        
+        Args:
+            products: pd.DataFrame containing product details, one product per row
+            
+        Returns:
+            np.ndarray: int8 grade ordinals in row order, the better the grade the higher
+        """
+        if self.rating_ordinal_column in products.columns:
+            return products[self.rating_ordinal_column].to_numpy(dtype=np.int8)
+        
+        ordinals = (products["nutriscore_grade"]
+                    .str.upper()
+                    .map(GRADE_ORDINALS)
+                    .to_numpy(dtype=float))
+        missing = np.isnan(ordinals)
+        if missing.any():
+            ordinals[missing] = self._rate_ordinals(products[missing])
+        return ordinals.astype(np.int8)
     
 class NutriscoreEvaluator(OpenFoodFactsProductEvaluator):
     """Evaluator for Nutri-Score based product scoring."""
     def __init__(self):
         super().__init__()
     
-    def evaluate(self, product: OpenFoodFactsProduct, recommendation_factors: List[RecommendationFactor]) -> float:
+    def evaluate(self, product: OpenFoodFactsProduct, recommendation_factors: List[RecommendationFactor], preferences: Optional[PreferenceVector] = None) -> float:
         if product.details.empty:
             raise ValueError("Cannot evaluate empty product")
             
-        if "nutriscore_score" not in product.details.index.tolist():
+        if "nutriscore_score" not in product.details.index:
             raise ValueError("Product doesn't have nutriscore_score")
             
         score = float(product.details["nutriscore_score"])
         
-        for factor in recommendation_factors:
+        preferences = preferences or PreferenceVector()
+        for factor in preferences.factors_with(FactorPreferenceStatus.RECOMMEND, recommendation_factors):
             if factor.exists(product.details):
-                    if factor.status == FactorPreferenceStatus.RECOMMEND:
-                        score -= self.bonus
+                score -= self.bonus
         return score
     
-    
\ No newline at end of file
+    def evaluate_many(self, products: pd.DataFrame, recommendation_factors: List[RecommendationFactor], preferences: Optional[PreferenceVector] = None) -> np.ndarray:
+        if "nutriscore_score" not in products.columns:
+            raise ValueError("Products don't have nutriscore_score")
+        
+        scores = pd.to_numeric(products["nutriscore_score"], errors="coerce").to_numpy(dtype=float)
+        
+        preferences = preferences or PreferenceVector()
+        for factor in preferences.factors_with(FactorPreferenceStatus.RECOMMEND, recommendation_factors):
+            scores = scores - self.bonus * factor.presence_mask(products)
+        return scores
+    
+    def preference_gain(self, recommendation_factors: List[RecommendationFactor], preferences: Optional[PreferenceVector] = None) -> Optional[float]:
+        preferences = preferences or PreferenceVector()
+        return float(self.bonus * len(preferences.factors_with(FactorPreferenceStatus.RECOMMEND, recommendation_factors)))
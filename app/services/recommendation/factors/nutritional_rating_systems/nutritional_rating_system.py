@@ -1,5 +1,7 @@
 from abc import ABC, abstractmethod
-from typing import Any
+from typing import Any, Optional, Sequence
+import numpy as np
+import pandas as pd
 from models.domain.off_product import OpenFoodFactsProduct
 
 class NutritionalScore:
@@ -18,6 +20,9 @@ class NutritionalScore:
 class NutritionalRatingSystem(ABC):
     """Abstract base class for nutritional rating systems."""
     maximize_score: bool
+    rating_ordinal_column: str = "rating_ordinal"
+    # ratings from the worst to the best, None for a rating system without an ordinal scale
+    rating_scale: Optional[Sequence[Any]] = None
     def __init__(self, maximize_score: bool = False):
         self.maximize_score = maximize_score
     
@@ -34,4 +39,31 @@ class NutritionalRatingSystem(ABC):
     @abstractmethod
     def has_better_rating(self, target_product: OpenFoodFactsProduct, other_product: OpenFoodFactsProduct) -> bool:
         """Compare two ratings from NutritionalRatingSystem."""
-        pass
\ No newline at end of file
+        pass
+    
+    def calculate_scores(self, products: pd.DataFrame) -> np.ndarray:
+        """Calculate nutritional scores for many products, one product per row."""
+        return np.array([self.calculate_score(product).value for product in self.__products(products)], dtype=float)
+    
+    def rate_many(self, products: pd.DataFrame) -> np.ndarray:
+        """Convert numerical scores of many products to specific grades, one product per row."""
+        return np.array([self.rate(product) for product in self.__products(products)], dtype=object)
+    
+    def rating_ordinals(self, products: pd.DataFrame) -> Optional[np.ndarray]:
+        """
+        Ratings of many products as their position in `rating_scale` from 1, the better the rating
+        the higher, one product per row. 0 for ratings out of the scale, None if there is no scale.
+        """
+        if self.rating_scale is None:
+            return None
+        ordinals = {rating: ordinal for ordinal, rating in enumerate(self.rating_scale, start=1)}
+        return np.array([ordinals.get(rating, 0) for rating in self.rate_many(products)], dtype=np.int8)
+    
+    def has_better_rating_many(self, target_product: OpenFoodFactsProduct, other_products: pd.DataFrame) -> np.ndarray:
+        """Compare a rating with ratings of many products, one product per row."""
+        return np.array([self.has_better_rating(target_product, product) for product in self.__products(other_products)], dtype=bool)
+    
+    @staticmethod
+    def __products(products: pd.DataFrame):
+        for _, details in products.iterrows():
+            yield OpenFoodFactsProduct(details.get("code"), details)
\ No newline at end of file
@@ -1,7 +1,9 @@
 from dataclasses import field, dataclass
-from typing import List
+from functools import cached_property
+from typing import Iterable, List, Mapping, Tuple, Union
 from enum import IntEnum
 import re
+import numpy as np
 import pandas as pd
 from utils.logger import setup_colored_logger
 
@@ -12,34 +14,32 @@ class FactorPreferenceStatus(IntEnum):
     NEUTRAL = 0
     RECOMMEND = 1
 
-@dataclass
+@dataclass(frozen=True)
 class RecommendationFactor:
     """
     Configuration for a single recommendation factor.
     
+    Read-only and shared by all requests, the status a request gives
+    the factor lives in its PreferenceVector.
+    
     Attributes:
         name: Factor name
-        status: Factor acceptance status
         findable_in: column names from OpenFoodFacts product dataset where this factor can be found
     """
     name: str
-    status: FactorPreferenceStatus = FactorPreferenceStatus.NEUTRAL
-    findable_in: List[str] = field(default_factory=list)
+    findable_in: Tuple[str, ...] = field(default_factory=tuple)
     
 
     def __post_init__(self):
         if not self.findable_in:
             raise ValueError("Column list cannot be empty")
+        object.__setattr__(self, "findable_in", tuple(self.findable_in))
         
-        
-    def update_status(self, new_status: FactorPreferenceStatus) -> None:
-        """
-        Update factor status.
-        
-        Args:
-            new_status: new status to be set
-        """
-        self.status = new_status
+    @property
+    def presence_column(self) -> str:
+        """Name of the dataset column holding precomputed presence of this factor."""
+        return f"has_{self.name}"
+    
     def exists(self, product_details: pd.Series) -> bool:
         """
         Check if factor is present in product details.
@@ -53,20 +53,91 @@ class RecommendationFactor:
         if product_details.empty:
             return False
         
+        if self.presence_column in product_details.index:
+            return bool(product_details[self.presence_column])
+        
         for column in self.findable_in:
+            if column not in product_details.index:
+                raise ValueError(f"column {column} not found in product details")
             if pd.notna(product_details[column]):
-                if column not in product_details.index.tolist():
-                    raise ValueError(f"column {column} not found in product details")
                 if self.__occurs_in(product_details[column]):
                     return True 
         return False
     
+    def presence_mask(self, products: pd.DataFrame) -> np.ndarray:
+        """
+        Check if factor is present in each of the products.
+        
+        Args:
+            products: pd.DataFrame containing product details
+            
+        Returns:
+            np.ndarray: Boolean mask, True where factor is present
+        """
+        if self.presence_column in products.columns:
+            return products[self.presence_column].to_numpy(dtype=bool)
+        
+        mask = np.zeros(len(products), dtype=bool)
+        for column in self.findable_in:
+            if column not in products.columns:
+                raise ValueError(f"column {column} not found in products")
+            if pd.api.types.is_numeric_dtype(products[column]):
+                # text column without any value, loaded as float NaN
+                continue
+            mask |= products[column].str.contains(self.__pattern, na=False).to_numpy(dtype=bool)
+        return mask
+    
     def __str__(self) -> str:
-        return f"{self.name} ({self.status.name})"
+        return self.name
     
     def __repr__(self) -> str:
-        return f"RecommendationFactor(name='{self.name}', status={self.status}, findable_in={self.findable_in})"
+        return f"RecommendationFactor(name='{self.name}', findable_in={list(self.findable_in)})"
+    
+    @cached_property
+    def __pattern(self) -> re.Pattern:
+        return re.compile(rf'(?:^|,)en:{re.escape(self.name)}(?:,|$)')
     
     def __occurs_in(self, all_factors: str) -> bool:
-        pattern = rf'(?:^|,)en:{self.name}(?:,|$)'
-        return bool(re.search(pattern, all_factors))
\ No newline at end of file
+        return bool(self.__pattern.search(all_factors))
+
+
+@dataclass(frozen=True)
+class PreferenceVector:
+    """
+    Statuses of recommendation factors for a single request.
+    
+    Immutable and hashable, so it can be passed between threads and used in cache keys.
+    Factors without a status are neutral.
+    
+    Attributes:
+        statuses: (factor name, status) pairs sorted by factor name, neutral factors left out
+    """
+    statuses: Tuple[Tuple[str, FactorPreferenceStatus], ...] = ()
+    
+    @classmethod
+    def from_statuses(cls, statuses: Mapping[str, FactorPreferenceStatus]) -> "PreferenceVector":
+        """
+        Args:
+            statuses: Status of factors by factor name
+        """
+        return cls(tuple(sorted(
+            (name, FactorPreferenceStatus(status))
+            for name, status in statuses.items()
+            if status != FactorPreferenceStatus.NEUTRAL
+        )))
+    
+    def status_of(self, factor: Union[RecommendationFactor, str]) -> FactorPreferenceStatus:
+        name = factor.name if isinstance(factor, RecommendationFactor) else factor
+        return self.__statuses_by_name.get(name, FactorPreferenceStatus.NEUTRAL)
+    
+    @cached_property
+    def __statuses_by_name(self) -> Mapping[str, FactorPreferenceStatus]:
+        # built once per vector, not a field, so equality and hashing only see `statuses`
+        return dict(self.statuses)
+    
+    def factors_with(self, status: FactorPreferenceStatus, recommendation_factors: Iterable[RecommendationFactor]) -> List[RecommendationFactor]:
+        """Factors of `recommendation_factors` having the given status."""
+        return [factor for factor in recommendation_factors if self.status_of(factor) == status]
+    
+    def __str__(self) -> str:
+        return ", ".join(f"{name} ({status.name})" for name, status in self.statuses) or "neutral"
@@ -1,9 +1,23 @@
-from typing import List
-from models.domain.off_product import OpenFoodFactsProduct
-from models.schemas.product_recommendation import ProductRecommendationRequest, RecommendedProduct
-from utils.dataset_manager import DatasetManager
+from collections import defaultdict
+from typing import Dict, Hashable, List, Optional, Tuple, Union
+from pydantic import ValidationError
+from models.domain.off_product import OpenFoodFactsProduct, normalize_product_code
+from models.schemas.product_recommendation import (
+    BatchRecommendationItem,
+    BatchRecommendationRequest,
+    ProductRecommendationRequest,
+    RecommendedProduct,
+    UserPreference,
+)
+from services.recommendation.factors.recommendation_factor import PreferenceVector
+from services.recommendation.factors.nutritional_rating_systems.nutriscore import GRADES_BY_ORDINAL, Nutriscore
+from utils.dataset_manager import DatasetManager, DatasetNotReadyError
 from services.recommendation.engine import RecommendationEngine
 from utils.logger import setup_colored_logger
+from utils.dataset_snapshot import DatasetSnapshot
+from utils.metrics import STAGE_RESPONSE_BUILDING, STAGE_SOURCE_LOOKUP, time_stage
+from utils.result_cache import ResultCache
+from utils.worker_pool import WorkerPool
 import math
 
 logger = setup_colored_logger(__name__)
@@ -11,22 +25,31 @@ logger = setup_colored_logger(__name__)
 
 class RecommendationService:
     
-    def __init__(self, dataset_manager: DatasetManager) -> None:
+    def __init__(self, dataset_manager: DatasetManager, result_cache: Optional[ResultCache] = None, worker_pool: Optional[WorkerPool] = None, engine: Optional[RecommendationEngine] = None) -> None:
+        """
+        Args:
+            dataset_manager: Source of the dataset snapshots
+            result_cache: Cache of generated recommendations, keyed by dataset snapshot version,
+                product code, limit and preferences, results of previous snapshots are evicted
+                as least recently used or expired
+            worker_pool: Pool running the recommendation engine off the event loop
+            engine: Recommendation engine, with default settings if not set
+        """
         self.dataset_manager = dataset_manager
-        self.engine = RecommendationEngine()
+        self.engine = engine if engine is not None else RecommendationEngine()
+        self.result_cache = result_cache if result_cache is not None else ResultCache()
+        self.worker_pool = worker_pool if worker_pool is not None else WorkerPool()
+        self.__engine_settings = self.engine.settings()
         
-    def __dataset(self):
-        return self.dataset_manager.get_dataset()
-
-    def __dataset_without_source_product(self, dataset, product_code):
-        return dataset[dataset['code'].astype(str) != product_code]
-    
-    def __get_product_details(self, dataset, product_code):
-        return dataset[dataset["code"].astype(str) == product_code].squeeze()
+    def __get_product_details(self, dataset, code_index, product_code):
+        row = code_index.row_of(product_code)
+        if row is None:
+            return None
+        return dataset.iloc[row]
     
     def __sanitize_product_name(self, name_value):
         if not isinstance(name_value, str):
-            logger.warning(f"Wrong datatype for name: {type(name_value)}")
+            logger.warning("Wrong datatype for name: %s", type(name_value))
         
         if name_value is None:
             return "Unknown name"
@@ -38,45 +61,199 @@ class RecommendationService:
             sanitized_name = str(name_value).strip()
             return sanitized_name if sanitized_name else "Unknown name"
         except Exception as e:
-            logger.error(f"Error during name sanitization: {e}")
+            logger.error("Error during name sanitization: %s", e)
             return "Unknown"
     
     async def generate_recommendations(self, request: ProductRecommendationRequest) -> List[RecommendedProduct]:
             product_code = request.product_code
             user_preferences = request.user_preferences
             
-            logger.info(f"Generating recommendations for product {product_code}")
+            logger.info("Generating recommendations for product %s", product_code)
             
-            dataset = self.__dataset()
-            if dataset is None:
-                raise Exception("Dataset not available")
+            # read every artifact from one snapshot, a reload may swap in a new one meanwhile
+            snapshot = self.dataset_manager.get_snapshot()
+            if snapshot is None:
+                raise DatasetNotReadyError("Dataset not available")
+            logger.debug("Got dataset snapshot version %d", snapshot.version)
             
-            logger.info(f"Got dataset")
+            preferences = self.__canonical_preferences(user_preferences)
+            cache_key = self.__cache_key(snapshot.version, product_code, request.limit, preferences)
+            cached = self.result_cache.get(cache_key)
+            if cached is not None:
+                logger.info("Got cached recommendations for product %s", product_code)
+                return list(cached)
+            
+            recommendations_processed = await self.worker_pool.run(self.__compute_recommendations, snapshot, request, preferences)
+            self.result_cache.put(cache_key, recommendations_processed)
+                
+            return list(recommendations_processed)
+    
+    def __compute_recommendations(self, snapshot: DatasetSnapshot, request: ProductRecommendationRequest, preferences: PreferenceVector) -> List[RecommendedProduct]:
+            product_code = request.product_code
+            dataset = snapshot.dataset
+            code_index = snapshot.code_index
+            neighbor_index = snapshot.neighbor_index
             
-            product_details = self.__get_product_details(dataset, product_code)
-            logger.info(f"Got source product details")
+            with time_stage(STAGE_SOURCE_LOOKUP):
+                product_details = self.__get_product_details(dataset, code_index, product_code)
+            if product_details is None:
+                logger.warning("Product %s not found in dataset", product_code)
+                return []
+            logger.debug("Got source product details")
             
             product = OpenFoodFactsProduct(product_code, product_details)
-            logger.info(f"Got product")
-            
-            dataset = self.__dataset_without_source_product(dataset, product_code)
-            logger.info(f"Excluded source product from dataset")
-
-            self.engine.recommendation_strategy.update_factors_status(user_preferences=user_preferences)
-            logger.info(f"updated factors status")
+            logger.debug("Got product")
             
-            logger.info(f"Start finding recommendations")
-            recommendations = self.engine.find_recommendations(dataset, product, request.limit)
-            logger.info(f"Got recommendations")
+            logger.debug("Start finding recommendations with preferences: %s", preferences)
+            recommendations = self.__find_materialized(snapshot, product, request.limit, preferences)
+            if recommendations is None:
+                recommendations = self.engine.find_recommendations(dataset, product, code_index, neighbor_index, request.limit, preferences, snapshot.candidate_index)
+            logger.debug("Got recommendations")
             
             recommendations_processed = []
             
-            for recommendation_code in recommendations:
-                product_details = self.__get_product_details(dataset, recommendation_code)
-                product_name = self.__sanitize_product_name(product_details['product_name'])
-                image_url = product_details['image_url']
-                nutriscore = product_details['nutriscore_grade'].upper()
-                recommendations_processed.append(RecommendedProduct(code=recommendation_code, name=product_name, image_url=image_url, nutriscore=nutriscore))
+            with time_stage(STAGE_RESPONSE_BUILDING):
+                for recommendation_code in recommendations:
+                    recommendations_processed.append(self.__build_recommended_product(dataset, code_index, recommendation_code))
                 
             return recommendations_processed
+    
+    async def generate_recommendations_batch(self, request: BatchRecommendationRequest) -> List[BatchRecommendationItem]:
+            """
+            Generate recommendations for many products in one pass over the dataset snapshot.
+            
+            Items sharing the same preferences are processed together by the engine.
+            Every item gets its own result, a failing item does not fail the others.
+            
+            Args:
+                request: Batch of recommendation requests
+                
+            Returns:
+                List[BatchRecommendationItem]: Result of every item, in request order
+            """
+            return await self.worker_pool.run(self.__generate_recommendations_batch, request)
+    
+    def __generate_recommendations_batch(self, request: BatchRecommendationRequest) -> List[BatchRecommendationItem]:
+            snapshot = self.dataset_manager.get_snapshot()
+            if snapshot is None:
+                raise DatasetNotReadyError("Dataset not available")
+            
+            dataset = snapshot.dataset
+            code_index = snapshot.code_index
+            neighbor_index = snapshot.neighbor_index
+            
+            items = self.__batch_items(request)
+            logger.info("Generating recommendations for a batch of %d products", len(items))
+            
+            results: List[Optional[BatchRecommendationItem]] = [None] * len(items)
+            groups: Dict[PreferenceVector, List[Tuple[int, ProductRecommendationRequest, OpenFoodFactsProduct]]] = defaultdict(list)
+            
+            for i, (product_code, item) in enumerate(items):
+                if isinstance(item, str):
+                    results[i] = BatchRecommendationItem(source_product_code=product_code, error=item)
+                    continue
+                
+                preferences = self.__canonical_preferences(item.user_preferences)
+                cached = self.result_cache.get(self.__cache_key(snapshot.version, item.product_code, item.limit, preferences))
+                if cached is not None:
+                    results[i] = BatchRecommendationItem(source_product_code=product_code, recommendations=list(cached), total_found=len(cached))
+                    continue
+                
+                with time_stage(STAGE_SOURCE_LOOKUP):
+                    product_details = self.__get_product_details(dataset, code_index, item.product_code)
+                if product_details is None:
+                    results[i] = BatchRecommendationItem(source_product_code=product_code, error=f"Product {product_code} not found in dataset")
+                    continue
+                
+                product = OpenFoodFactsProduct(item.product_code, product_details)
+                recommendation_codes = self.__find_materialized(snapshot, product, item.limit, preferences)
+                if recommendation_codes is not None:
+                    results[i] = self.__batch_result(snapshot, item, preferences, recommendation_codes)
+                    continue
+                
+                groups[preferences].append((i, item, product))
+            
+            logger.debug("Batch split into %d preference groups", len(groups))
+            
+            for preferences, group in groups.items():
+                try:
+                    recommendations = self.engine.find_recommendations_many(
+                        dataset,
+                        [product for _, _, product in group],
+                        code_index,
+                        neighbor_index,
+                        [item.limit for _, item, _ in group],
+                        preferences,
+                        snapshot.candidate_index
+                    )
+                    for (i, item, _), recommendation_codes in zip(group, recommendations):
+                        results[i] = self.__batch_result(snapshot, item, preferences, recommendation_codes)
+                except Exception as e:
+                    logger.exception("Error generating recommendations for a group of %d products", len(group))
+                    for i, item, _ in group:
+                        results[i] = BatchRecommendationItem(source_product_code=item.product_code, error=str(e))
+            
+            return results
+    
+    def __batch_result(self, snapshot: DatasetSnapshot, item: ProductRecommendationRequest, preferences: PreferenceVector, recommendation_codes: List[str]) -> BatchRecommendationItem:
+        with time_stage(STAGE_RESPONSE_BUILDING):
+            recommended_products = [
+                self.__build_recommended_product(snapshot.dataset, snapshot.code_index, recommendation_code)
+                for recommendation_code in recommendation_codes
+            ]
+        self.result_cache.put(self.__cache_key(snapshot.version, item.product_code, item.limit, preferences), recommended_products)
+        return BatchRecommendationItem(
+            source_product_code=item.product_code,
+            recommendations=recommended_products,
+            total_found=len(recommended_products)
+        )
+    
+    def __find_materialized(self, snapshot: DatasetSnapshot, product: OpenFoodFactsProduct, limit: int, preferences: PreferenceVector) -> Optional[List[str]]:
+        """Recommendations answered from the materialized table of the snapshot, None if they need to be computed live"""
+        materialized = snapshot.recommendations
+        if materialized is None:
+            return None
+        if materialized.settings != self.__engine_settings:
+            logger.debug("Materialized recommendations were computed with other engine settings: %s", materialized.settings)
+            return None
+        return self.engine.find_recommendations_materialized(snapshot.dataset, product, snapshot.code_index, materialized, limit, preferences)
+    
+    def __batch_items(self, request: BatchRecommendationRequest) -> List[Tuple[str, Union[ProductRecommendationRequest, str]]]:
+        """Requests of a batch with their product codes, or the validation error of an invalid product code"""
+        if request.items is not None:
+            return [(item.product_code, item) for item in request.items]
+        
+        items = []
+        for product_code in request.product_codes:
+            try:
+                items.append((product_code, ProductRecommendationRequest(
+                    product_code=product_code,
+                    limit=request.limit,
+                    user_preferences=request.user_preferences
+                )))
+            except ValidationError as e:
+                items.append((product_code, f"Invalid product code: {e.errors()[0]['msg']}"))
+        return items
+    
+    def __canonical_preferences(self, user_preferences: Optional[List[UserPreference]]) -> PreferenceVector:
+        return self.engine.recommendation_strategy.preferences_from(user_preferences)
+    
+    def __cache_key(self, version: int, product_code: str, limit: int, preferences: PreferenceVector) -> Hashable:
+        # results of a previous snapshot are never hit again, they age out of the cache
+        return (version, normalize_product_code(product_code), limit, preferences)
+    
+    def __build_recommended_product(self, dataset, code_index, recommendation_code) -> RecommendedProduct:
+        # reads the served columns only, a whole row decodes every categorical column of the dataset
+        row = code_index.row_of(recommendation_code)
+        product_name = self.__sanitize_product_name(dataset['product_name'].iat[row])
+        image_url = dataset['image_url'].iat[row]
+        return RecommendedProduct(code=recommendation_code, name=product_name, image_url=image_url, nutriscore=self.__nutriscore_of(dataset, row))
+    
+    def __nutriscore_of(self, dataset, row) -> Optional[str]:
+        # the precomputed grade covers products whose grade was computed from their nutrients
+        if Nutriscore.rating_ordinal_column in dataset.columns:
+            grade = GRADES_BY_ORDINAL[dataset[Nutriscore.rating_ordinal_column].iat[row]]
+            return grade.value if grade is not None else None
+        grade = dataset['nutriscore_grade'].iat[row]
+        return grade.upper() if isinstance(grade, str) and grade else None
 
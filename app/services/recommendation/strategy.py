@@ -1,4 +1,4 @@
-from services.recommendation.factors.recommendation_factor import RecommendationFactor
+from services.recommendation.factors.recommendation_factor import PreferenceVector, RecommendationFactor
 from dataclasses import dataclass
 from models.schemas.product_recommendation import UserPreference
 from typing import List, Optional
@@ -51,17 +51,24 @@ class RecommendationStrategy:
             nutritional_rating_system=Nutriscore()
         )
     
-    def update_factors_status(self, user_preferences: Optional[List[UserPreference]] = None) -> None:
-        logger.info("Updating factors status")
-        if not user_preferences:
-            logger.warning("No user preferences provided")
-            return
+    def preferences_from(self, user_preferences: Optional[List[UserPreference]] = None) -> PreferenceVector:
+        """
+        Turn user preferences into the preference vector of a request.
         
-        for user_preference in user_preferences:
-            preference_name = user_preference.name
-            status = user_preference.status
-            if factor := self.__factors_dict.get(preference_name):
-                factor.update_status(status)
+        Preferences naming no recommendation factor are dropped, the last
+        preference of a factor wins.
+        
+        Args:
+            user_preferences: Preferences of the request
+            
+        Returns:
+            PreferenceVector: Status of every factor of the strategy
+        """
+        statuses = {}
+        for user_preference in user_preferences or []:
+            if user_preference.name in self.__factors_dict:
+                statuses[user_preference.name] = user_preference.status
+        return PreferenceVector.from_statuses(statuses)
                             
     
     def __post_init__(self):
@@ -0,0 +1,71 @@
+from pathlib import Path
+from typing import Optional, Sequence, Union
+import numpy as np
+import pandas as pd
+from services.recommendation.factors.categories.categories_comparator import CategoriesComparator
+from services.text_processing.encoders import CategoriesEncoder, HashingCategoriesEncoder, hash_categories
+from utils.embedding_cache import EmbeddingCache
+from utils.logger import setup_colored_logger
+
+logger = setup_colored_logger(__name__)
+
+
+class EmbeddingCategoriesComparator(CategoriesComparator):
+    """
+    Cosine similarity of category strings encoded by a CategoriesEncoder.
+
+    Every distinct category string is encoded once: vectors are cached by content
+    hash, on disk when `cache_dir` is set, so they survive restarts. A source is
+    compared with all its candidates in a single matrix-vector product.
+
+    Attributes:
+        encoder: Encoder of the category strings, hashing by default
+        cache: Vectors of the category strings encoded so far
+    """
+    def __init__(self, encoder: Optional[CategoriesEncoder] = None, cache_dir: Optional[Union[str, Path]] = None) -> None:
+        self.encoder = encoder or HashingCategoriesEncoder()
+        self.cache = EmbeddingCache(self.encoder.name, cache_dir)
+
+    def compare(self, product_categories: str, user_categories: str) -> float:
+        return float(self.compare_many(user_categories, [product_categories])[0])
+
+    def compare_many(self, source_categories: str, candidate_categories: Sequence[str]) -> np.ndarray:
+        # candidates of a product share few distinct category strings, encode and look up each of them once
+        codes, uniques = pd.factorize(pd.Series(candidate_categories, dtype=object), use_na_sentinel=False)
+        return self.__similarities_to(source_categories, uniques)[codes]
+
+    def compare_codes(self, source_categories: str, unique_categories: Sequence[str], codes: np.ndarray) -> np.ndarray:
+        similarities = np.append(self.__similarities_to(source_categories, unique_categories), np.float32(-np.inf))
+        # code -1 takes the last, -inf, similarity
+        return similarities[codes]
+
+    def __similarities_to(self, source_categories: str, unique_categories: Sequence[str]) -> np.ndarray:
+        vectors = self.encode(np.concatenate([[source_categories], np.asarray(unique_categories, dtype=object)]))
+        return (vectors[1:] @ vectors[0]).astype(np.float32, copy=False)
+
+    def encode(self, texts: Sequence[str]) -> np.ndarray:
+        """
+        Get the vectors of category strings, encoding only the ones that are not cached.
+
+        Returns:
+            np.ndarray: float32 array of shape (len(texts), encoder dimension)
+        """
+        hashes = hash_categories(texts)
+        cached, found = self.cache.get_many(hashes)
+        if found.all():
+            return cached
+
+        missing = np.flatnonzero(~found)
+        logger.debug("Encoding %d category strings with %s", len(missing), self.encoder.name)
+        encoded = self.encoder.encode([texts[i] for i in missing])
+        self.cache.put_many(hashes[missing], encoded)
+
+        vectors = np.empty((len(hashes), encoded.shape[1]), dtype=np.float32)
+        if found.any():
+            vectors[found] = cached
+        vectors[missing] = encoded
+        return vectors
+
+    def flush(self) -> None:
+        """Write the newly encoded vectors to the disk cache."""
+        self.cache.flush()
@@ -0,0 +1,168 @@
+from abc import ABC, abstractmethod
+from typing import List, Optional, Sequence, Tuple
+import hashlib
+import re
+import zlib
+import numpy as np
+from utils.logger import setup_colored_logger
+
+logger = setup_colored_logger(__name__)
+
+DEFAULT_SENTENCE_TRANSFORMER_MODEL = "all-MiniLM-L6-v2"
+
+
+def hash_categories(texts: Sequence[str]) -> np.ndarray:
+    """Stable 64-bit content hash of every category string, missing values hash like empty strings."""
+    return np.array([
+        int.from_bytes(hashlib.blake2b(text.encode("utf-8") if isinstance(text, str) else b"", digest_size=8).digest(), "little")
+        for text in texts
+    ], dtype=np.uint64)
+
+
+class CategoriesEncoder(ABC):
+    """
+    Encodes category strings of products into L2-normalized vectors.
+
+    The dot product of two vectors is the cosine similarity of their category strings.
+    """
+    @property
+    @abstractmethod
+    def name(self) -> str:
+        """Identifier of the encoder and its settings, vectors of encoders with the same name are interchangeable."""
+
+    @property
+    @abstractmethod
+    def dimension(self) -> int:
+        pass
+
+    @abstractmethod
+    def encode(self, texts: Sequence[str]) -> np.ndarray:
+        """
+        Encode category strings.
+
+        Args:
+            texts: Category strings, missing values are encoded as zero vectors
+
+        Returns:
+            np.ndarray: float32 array of shape (len(texts), dimension), rows of unit length or zero
+        """
+
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        np.divide(vectors, norms, out=vectors, where=norms > 0)
+        return vectors
+
+
+class HashingCategoriesEncoder(CategoriesEncoder):
+    """
+    Bag of categories and category words hashed into a fixed number of features.
+
+    Needs no model and no fitting, so it runs offline on any CPU and encodes a
+    category string the same way in every process.
+
+    Attributes:
+        n_features: Dimension of the vectors
+        word_weight: Weight of single words relative to whole categories
+    """
+    def __init__(self, n_features: int = 512, word_weight: float = 0.5) -> None:
+        self.n_features = n_features
+        self.word_weight = word_weight
+
+    @property
+    def name(self) -> str:
+        return f"hashing-{self.n_features}-{self.word_weight}"
+
+    @property
+    def dimension(self) -> int:
+        return self.n_features
+
+    def encode(self, texts: Sequence[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.n_features), dtype=np.float32)
+        for row, text in enumerate(texts):
+            if not isinstance(text, str):
+                continue
+            for token, weight in self.__tokens(text):
+                token_hash = zlib.crc32(token.encode("utf-8"))
+                # the sign bit spreads collisions around zero instead of piling them up
+                sign = 1.0 if token_hash & 0x80000000 else -1.0
+                vectors[row, token_hash % self.n_features] += sign * weight
+        return self._normalize(vectors)
+
+    def __tokens(self, text: str) -> List[Tuple[str, float]]:
+        tokens = []
+        for category in text.lower().split(","):
+            category = category.strip()
+            if not category:
+                continue
+            tokens.append((f"c:{category}", 1.0))
+            tokens.extend((f"w:{word}", self.word_weight) for word in re.findall(r"\w+", category))
+        return tokens
+
+
+class SentenceTransformerEncoder(CategoriesEncoder):
+    """
+    Sentence embedding of category strings.
+
+    The model is only loaded on the first call to `encode`, so creating the
+    encoder is cheap and sentence-transformers is only needed when it is used.
+
+    Attributes:
+        model_name: Name or path of the sentence-transformers model
+        batch_size: Number of texts encoded at once by the model
+        device: Torch device, CPU by default
+    """
+    def __init__(self, model_name: str = DEFAULT_SENTENCE_TRANSFORMER_MODEL, batch_size: int = 64, device: str = "cpu") -> None:
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.device = device
+        self._model = None
+        self._dimension: Optional[int] = None
+
+    @property
+    def name(self) -> str:
+        return f"sentence-transformer-{self.model_name}"
+
+    @property
+    def dimension(self) -> int:
+        if self._dimension is None:
+            self._dimension = self.__model().get_sentence_embedding_dimension()
+        return self._dimension
+
+    def encode(self, texts: Sequence[str]) -> np.ndarray:
+        texts = [text if isinstance(text, str) else "" for text in texts]
+        vectors = self.__model().encode(
+            texts,
+            batch_size=self.batch_size,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+            show_progress_bar=False,
+        ).astype(np.float32, copy=False)
+        # empty strings still get an embedding, keep them from matching each other
+        vectors[[not text for text in texts]] = 0.0
+        return vectors
+
+    def __model(self):
+        if self._model is None:
+            try:
+                from sentence_transformers import SentenceTransformer
+            except ImportError as e:
+                raise ImportError("SentenceTransformerEncoder requires the sentence-transformers package") from e
+            logger.info(f"Loading sentence-transformers model {self.model_name} on {self.device}")
+            self._model = SentenceTransformer(self.model_name, device=self.device)
+        return self._model
+
+
+def create_encoder(name: str) -> CategoriesEncoder:
+    """
+    Create an encoder from its command line name.
+
+    Args:
+        name: "hashing", "hashing:<n_features>", "sentence-transformer" or "sentence-transformer:<model name>"
+    """
+    kind, _, option = name.partition(":")
+    if kind == "hashing":
+        return HashingCategoriesEncoder(n_features=int(option)) if option else HashingCategoriesEncoder()
+    if kind == "sentence-transformer":
+        return SentenceTransformerEncoder(model_name=option or DEFAULT_SENTENCE_TRANSFORMER_MODEL)
+    raise ValueError(f"Unknown categories encoder {name}")
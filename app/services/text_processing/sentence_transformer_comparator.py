@@ -1,14 +1,13 @@
-# from sentence_transformers import SentenceTransformer, util
-# from services.recommendation.factors.categories.categories_comparator import CategoriesComparator
-
-# class SentenceTransformerComparator(CategoriesComparator):
-#     def __init__(self, model: SentenceTransformer = SentenceTransformer('all-MiniLM-L6-v2')) -> None:
-#         self.model = model
-
-#     def compare(self, product_categories: str, user_categories: str) -> float:
-#         product_categories_embedding = self.model.encode(product_categories, convert_to_tensor=True)
-#         user_categories_embedding = self.model.encode(user_categories, convert_to_tensor=True)
-
-#         similarity = util.pytorch_cos_sim(product_categories_embedding, user_categories_embedding)
-
-#         return similarity.item()
\ No newline at end of file
+from pathlib import Path
+from typing import Optional, Union
+from services.text_processing.embedding_comparator import EmbeddingCategoriesComparator
+from services.text_processing.encoders import DEFAULT_SENTENCE_TRANSFORMER_MODEL, SentenceTransformerEncoder
+
+class SentenceTransformerComparator(EmbeddingCategoriesComparator):
+    """
+    Compares categories by the cosine similarity of their sentence embeddings.
+
+    The model is only loaded when the first uncached category string is encoded.
+    """
+    def __init__(self, model_name: str = DEFAULT_SENTENCE_TRANSFORMER_MODEL, device: str = "cpu", cache_dir: Optional[Union[str, Path]] = None) -> None:
+        super().__init__(SentenceTransformerEncoder(model_name=model_name, device=device), cache_dir)
@@ -0,0 +1,427 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple, Union
+import json
+import os
+import numpy as np
+import pandas as pd
+from models.domain.off_product import CODE_WIDTH_COLUMN, PRODUCT_CODE_LENGTH, product_codes
+from services.text_processing.encoders import CategoriesEncoder, hash_categories
+from utils.columnar_dataset import ColumnarDataset
+from utils.neighbor_index import similarities_delta_path
+from utils.logger import setup_colored_logger
+
+logger = setup_colored_logger(__name__)
+
+EMBEDDINGS_FILE_NAME = "embeddings.npy"
+EMBEDDING_CODES_FILE_NAME = "embedding_codes.npy"
+EMBEDDINGS_INFO_FILE_NAME = "embeddings.json"
+EMBEDDING_HASHES_FILE_NAME = "embedding_hashes.npy"
+
+# embeddings of the worker process, memory-mapped once by the pool initializer
+_embeddings: Optional[np.ndarray] = None
+
+
+def load_categories(dataset_path: Union[str, Path], categories_column: str = "categories_en") -> pd.DataFrame:
+    """
+    Read normalized product codes and category strings of the serving dataset.
+
+    Args:
+        dataset_path: Pickled dataset or columnar dataset directory
+        categories_column: Column holding the category strings
+
+    Returns:
+        pd.DataFrame: `code` and `categories` columns, one row per distinct product code in dataset order
+    """
+    dataset_path = Path(dataset_path)
+    if dataset_path.is_dir():
+        # a dataset written with the serving schema stores codes as integers and their width
+        dataset = ColumnarDataset(dataset_path).to_frame(["code", CODE_WIDTH_COLUMN, categories_column])
+    else:
+        dataset = pd.read_pickle(dataset_path)[["code", categories_column]]
+
+    products = pd.DataFrame({
+        "code": pd.Series(product_codes(dataset)).str.zfill(PRODUCT_CODE_LENGTH).to_numpy(dtype=object),
+        "categories": dataset[categories_column].to_numpy(dtype=object),
+    })
+    return products.drop_duplicates(subset="code", keep="first").reset_index(drop=True)
+
+
+def encode_in_chunks(encoder: CategoriesEncoder, texts: np.ndarray, output_path: Union[str, Path], chunk_size: int = 10000) -> np.ndarray:
+    """
+    Encode category strings chunk by chunk straight into a .npy file.
+
+    Only one chunk of vectors is held in memory at a time.
+
+    Returns:
+        np.ndarray: The vectors, memory-mapped read-only from `output_path`
+    """
+    vectors = np.lib.format.open_memmap(output_path, mode="w+", dtype=np.float32, shape=(len(texts), encoder.dimension))
+    for start in range(0, len(texts), chunk_size):
+        end = min(start + chunk_size, len(texts))
+        vectors[start:end] = encoder.encode(list(texts[start:end]))
+        logger.info(f"Encoded categories of {end}/{len(texts)} products")
+    vectors.flush()
+    del vectors
+    return np.load(output_path, mmap_mode="r")
+
+
+def save_embeddings(directory: Union[str, Path], encoder: CategoriesEncoder, codes: np.ndarray, hashes: np.ndarray) -> None:
+    """Save the product codes, category hashes and encoder of the embeddings written to `directory` by `encode_in_chunks`."""
+    directory = Path(directory)
+    np.save(directory / EMBEDDING_CODES_FILE_NAME, np.asarray(codes, dtype=str))
+    np.save(directory / EMBEDDING_HASHES_FILE_NAME, hashes)
+    with open(directory / EMBEDDINGS_INFO_FILE_NAME, "w") as f:
+        json.dump({"encoder": encoder.name, "dimension": encoder.dimension, "products": len(codes)}, f, indent=2)
+
+
+def load_embeddings(directory: Union[str, Path]) -> Tuple[np.ndarray, np.ndarray, np.ndarray, dict]:
+    """
+    Load embeddings saved by a previous build.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray, dict]: Memory-mapped vectors, their product codes,
+            the hashes of their category strings and the embeddings info
+    """
+    directory = Path(directory)
+    with open(directory / EMBEDDINGS_INFO_FILE_NAME) as f:
+        info = json.load(f)
+    vectors = np.load(directory / EMBEDDINGS_FILE_NAME, mmap_mode="r")
+    codes = np.load(directory / EMBEDDING_CODES_FILE_NAME).astype(object)
+    hashes = np.load(directory / EMBEDDING_HASHES_FILE_NAME)
+    return vectors, codes, hashes, info
+
+
+def top_k_neighbors(queries: np.ndarray, vectors: np.ndarray, top_k: int, min_similarity: float, query_rows: Optional[np.ndarray] = None, tile_size: int = 16384) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Find the most similar vectors of every query with blocked matrix multiplies.
+
+    The similarities of the queries with `tile_size` vectors at a time are reduced
+    to their top `top_k` before moving on, so memory is bounded by the tile size.
+
+    Args:
+        queries: Unit query vectors, one per row
+        vectors: Unit vectors to search
+        top_k: Maximum number of neighbors of a query
+        min_similarity: Minimum similarity of a neighbor
+        query_rows: Row of every query in `vectors`, the query itself is never its own neighbor
+        tile_size: Number of vectors multiplied with the queries at once
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray]: Query positions, neighbor rows in `vectors` and
+            similarities, sorted by query, descending similarity and neighbor row
+    """
+    n_queries = len(queries)
+    best_rows = np.zeros((n_queries, 0), dtype=np.int64)
+    best_sims = np.zeros((n_queries, 0), dtype=np.float32)
+
+    for tile_start in range(0, len(vectors), tile_size):
+        tile_end = min(tile_start + tile_size, len(vectors))
+        sims = queries @ np.asarray(vectors[tile_start:tile_end]).T
+        sims[sims < min_similarity] = -np.inf
+        if query_rows is not None:
+            in_tile = np.flatnonzero((query_rows >= tile_start) & (query_rows < tile_end))
+            sims[in_tile, query_rows[in_tile] - tile_start] = -np.inf
+
+        sims, rows = _top_k_columns(sims, np.broadcast_to(np.arange(tile_start, tile_end), sims.shape), top_k)
+        best_sims, best_rows = _top_k_columns(
+            np.concatenate([best_sims, sims], axis=1),
+            np.concatenate([best_rows, rows], axis=1),
+            top_k
+        )
+
+    query_positions = np.repeat(np.arange(n_queries), best_sims.shape[1])
+    neighbor_rows, similarities = best_rows.ravel(), best_sims.ravel()
+    found = np.isfinite(similarities)
+    query_positions, neighbor_rows, similarities = query_positions[found], neighbor_rows[found], similarities[found]
+
+    order = np.lexsort((neighbor_rows, -similarities, query_positions))
+    return query_positions[order], neighbor_rows[order], similarities[order]
+
+
+def _top_k_columns(sims: np.ndarray, rows: np.ndarray, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Keep the `top_k` largest similarities of every query, ties going to the lowest row, padded with -inf."""
+    if sims.shape[1] <= top_k:
+        return sims, rows
+    
+    # only the similarities reaching the k-th largest one compete, ties included
+    kth = -np.partition(-sims, top_k - 1, axis=1)[:, top_k - 1:top_k]
+    queries, columns = np.nonzero((sims >= kth) & np.isfinite(sims))
+    candidate_sims, candidate_rows = sims[queries, columns], rows[queries, columns]
+    
+    order = np.lexsort((candidate_rows, -candidate_sims, queries))
+    queries, candidate_sims, candidate_rows = queries[order], candidate_sims[order], candidate_rows[order]
+    ranks = np.arange(len(queries)) - np.searchsorted(queries, queries)
+    kept = ranks < top_k
+    
+    best_sims = np.full((len(sims), top_k), -np.inf, dtype=sims.dtype)
+    best_rows = np.zeros((len(sims), top_k), dtype=np.int64)
+    best_sims[queries[kept], ranks[kept]] = candidate_sims[kept]
+    best_rows[queries[kept], ranks[kept]] = candidate_rows[kept]
+    return best_sims, best_rows
+
+
+def _offset_block(start: int, positions: np.ndarray, neighbor_rows: np.ndarray, similarities: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    return positions + start, neighbor_rows, similarities
+
+
+def _init_worker(embeddings_path: str) -> None:
+    global _embeddings
+    try:
+        # one BLAS thread per process, the pool already uses every core
+        from threadpoolctl import threadpool_limits
+        threadpool_limits(1)
+    except ImportError:
+        pass
+    _embeddings = np.load(embeddings_path, mmap_mode="r")
+
+
+def _block_neighbors(block: Tuple[int, int, int, float, int]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    start, end, top_k, min_similarity, tile_size = block
+    queries = np.asarray(_embeddings[start:end])
+    return _offset_block(start, *top_k_neighbors(
+        queries, _embeddings, top_k, min_similarity, query_rows=np.arange(start, end), tile_size=tile_size
+    ))
+
+
+class SimilarityBuilder:
+    """
+    Builds the similarities file of the neighbor index from category embeddings.
+
+    Products are encoded in chunks into a memory-mapped embeddings file, then every
+    block of products is compared with all of them in a pool of processes, each
+    mapping the same embeddings file. Blocks are written to the output in order as
+    they complete, with a bounded number of blocks in flight.
+
+    Attributes:
+        encoder: Encoder of category strings
+        top_k: Maximum number of neighbors of a product
+        min_similarity: Minimum similarity of a neighbor
+        chunk_size: Number of products encoded at once
+        block_size: Number of products compared with all products in one task
+        tile_size: Number of products multiplied with a block at once
+        workers: Number of processes, all cores by default
+    """
+    def __init__(
+        self,
+        encoder: CategoriesEncoder,
+        top_k: int = 100,
+        min_similarity: float = 0.9,
+        chunk_size: int = 10000,
+        block_size: int = 1024,
+        tile_size: int = 16384,
+        workers: Optional[int] = None
+    ) -> None:
+        if top_k < 1:
+            raise ValueError("top_k must be at least 1")
+        self.encoder = encoder
+        self.top_k = top_k
+        self.min_similarity = min_similarity
+        self.chunk_size = chunk_size
+        self.block_size = block_size
+        self.tile_size = tile_size
+        self.workers = workers or os.cpu_count() or 1
+
+    def build(self, dataset_path: Union[str, Path], output_path: Union[str, Path], embeddings_dir: Optional[Union[str, Path]] = None) -> int:
+        """
+        Build the similarities file of a dataset.
+
+        Args:
+            dataset_path: Pickled dataset or columnar dataset directory
+            output_path: Similarities CSV file, replaced once complete
+            embeddings_dir: Directory keeping the embeddings for incremental updates, next to the output by default
+
+        Returns:
+            int: Number of written neighbor pairs
+        """
+        output_path = Path(output_path)
+        embeddings_dir = Path(embeddings_dir) if embeddings_dir is not None else output_path.parent / f"{output_path.stem}.embeddings"
+        embeddings_dir.mkdir(parents=True, exist_ok=True)
+
+        products = load_categories(dataset_path)
+        logger.info(f"Encoding categories of {len(products)} products with {self.encoder.name}")
+        embeddings_path = embeddings_dir / EMBEDDINGS_FILE_NAME
+        encode_in_chunks(self.encoder, products["categories"].to_numpy(), embeddings_path, self.chunk_size)
+        save_embeddings(embeddings_dir, self.encoder, products["code"].to_numpy(), hash_categories(products["categories"].to_numpy()))
+
+        codes = products["code"].to_numpy(dtype=object)
+        written = write_similarities(output_path, codes, self.__neighbor_blocks(embeddings_path, len(products)))
+
+        # the delta of the previous similarities file is part of this build
+        similarities_delta_path(output_path).unlink(missing_ok=True)
+        return written
+
+    def update(self, dataset_path: Union[str, Path], similarities_path: Union[str, Path], embeddings_dir: Optional[Union[str, Path]] = None) -> int:
+        """
+        Update the neighbors of new and changed products into the delta of a similarities file.
+
+        Only new products and products whose categories changed are encoded. Their
+        neighbors are searched among the embeddings of the last build or update, and
+        so are the neighbors of the products whose lists pointed at a changed product.
+        Lists of products the new ones get close to are extended at serving time,
+        since the neighbor index is symmetric.
+
+        Args:
+            dataset_path: Pickled dataset or columnar dataset directory
+            similarities_path: Similarities CSV file of the last full build, left untouched
+            embeddings_dir: Embeddings of the last build, next to the similarities file by default
+
+        Returns:
+            int: Number of replaced neighbor lists
+        """
+        similarities_path = Path(similarities_path)
+        embeddings_dir = Path(embeddings_dir) if embeddings_dir is not None else similarities_path.parent / f"{similarities_path.stem}.embeddings"
+        vectors, codes, hashes, info = load_embeddings(embeddings_dir)
+        if info["encoder"] != self.encoder.name:
+            raise ValueError(f"Embeddings were built with {info['encoder']}, not {self.encoder.name}")
+
+        products = load_categories(dataset_path)
+        product_hashes = hash_categories(products["categories"].to_numpy())
+        rows = pd.Series(np.arange(len(codes)), index=codes).reindex(products["code"]).to_numpy()
+        is_new = np.isnan(rows)
+        is_changed = ~is_new
+        is_changed[is_changed] = hashes[rows[is_changed].astype(np.int64)] != product_hashes[is_changed]
+        updated = products[is_new | is_changed]
+        if updated.empty:
+            logger.info("No new or changed products, the similarities are up to date")
+            return 0
+        logger.info(f"Updating neighbors of {np.count_nonzero(is_new)} new and {np.count_nonzero(is_changed)} changed products")
+
+        vectors, codes = self.__update_embeddings(embeddings_dir, vectors, codes, hashes, updated, product_hashes[is_new | is_changed])
+        code_rows = pd.Series(np.arange(len(codes)), index=codes)
+        delta_path = similarities_delta_path(similarities_path)
+
+        changed_codes = set(products["code"][is_changed])
+        referencing = self.__referencing_products(changed_codes, [similarities_path, delta_path]) if changed_codes else set()
+        sources = np.unique(code_rows.reindex(list(set(updated["code"]) | referencing)).dropna().to_numpy(dtype=np.int64))
+        logger.info(f"Searching neighbors of {len(sources)} products, {len(sources) - len(updated)} of them pointing at changed products")
+
+        blocks = (
+            _offset_block(start, *top_k_neighbors(
+                np.asarray(vectors[sources[start:start + self.block_size]]),
+                vectors,
+                self.top_k,
+                self.min_similarity,
+                query_rows=sources[start:start + self.block_size],
+                tile_size=self.tile_size,
+            ))
+            for start in range(0, len(sources), self.block_size)
+        )
+        source_positions, neighbor_rows, similarities = (np.concatenate(parts) for parts in zip(*blocks))
+        write_delta(delta_path, codes[sources], codes[sources[source_positions]], codes[neighbor_rows], similarities)
+        return len(sources)
+
+    def __update_embeddings(self, embeddings_dir: Path, vectors: np.ndarray, codes: np.ndarray, hashes: np.ndarray, updated: pd.DataFrame, updated_hashes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Encode updated products, overwrite the vectors of changed ones and append new ones"""
+        updated_vectors = np.concatenate([
+            self.encoder.encode(list(updated["categories"].iloc[start:start + self.chunk_size]))
+            for start in range(0, len(updated), self.chunk_size)
+        ])
+        rows = pd.Series(np.arange(len(codes)), index=codes).reindex(updated["code"]).to_numpy()
+        is_new = np.isnan(rows)
+        changed_rows = rows[~is_new].astype(np.int64)
+
+        all_codes = np.concatenate([codes, updated["code"].to_numpy(dtype=object)[is_new]])
+        all_hashes = np.concatenate([hashes, updated_hashes[is_new]])
+        all_hashes[changed_rows] = updated_hashes[~is_new]
+
+        embeddings_path = embeddings_dir / EMBEDDINGS_FILE_NAME
+        temp_path = embeddings_dir / f"{EMBEDDINGS_FILE_NAME}.tmp.npy"
+        all_vectors = np.lib.format.open_memmap(temp_path, mode="w+", dtype=np.float32, shape=(len(all_codes), vectors.shape[1]))
+        for start in range(0, len(vectors), self.chunk_size):
+            end = min(start + self.chunk_size, len(vectors))
+            all_vectors[start:end] = vectors[start:end]
+        all_vectors[changed_rows] = updated_vectors[~is_new]
+        all_vectors[len(vectors):] = updated_vectors[is_new]
+        all_vectors.flush()
+        del all_vectors, vectors
+        temp_path.replace(embeddings_path)
+        save_embeddings(embeddings_dir, self.encoder, all_codes, all_hashes)
+
+        return np.load(embeddings_path, mmap_mode="r"), all_codes
+
+    @staticmethod
+    def __referencing_products(codes: set, similarities_paths: List[Path], chunk_size: int = 1_000_000) -> set:
+        """Products whose neighbor list contains one of `codes`, read chunk by chunk"""
+        referencing = set()
+        for path in similarities_paths:
+            if not path.exists():
+                continue
+            for chunk in pd.read_csv(path, dtype={"product1": str, "product2": str}, usecols=["product1", "product2"], chunksize=chunk_size):
+                product2 = chunk["product2"].str.zfill(PRODUCT_CODE_LENGTH)
+                referencing.update(chunk["product1"][product2.isin(codes)].str.zfill(PRODUCT_CODE_LENGTH))
+        return referencing
+
+    def __neighbor_blocks(self, embeddings_path: Path, n_products: int) -> Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        blocks = [
+            (start, min(start + self.block_size, n_products), self.top_k, self.min_similarity, self.tile_size)
+            for start in range(0, n_products, self.block_size)
+        ]
+        logger.info(f"Computing top {self.top_k} neighbors of {n_products} products in {len(blocks)} blocks on {self.workers} processes")
+
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker, initargs=(str(embeddings_path),)) as executor:
+            pending = deque()
+            next_block = 0
+            while next_block < len(blocks) or pending:
+                # keep a few blocks in flight, finished ones wait in memory until written
+                while next_block < len(blocks) and len(pending) < 2 * self.workers:
+                    pending.append(executor.submit(_block_neighbors, blocks[next_block]))
+                    next_block += 1
+                yield pending.popleft().result()
+                done = next_block - len(pending)
+                if done % 100 == 0 or done == len(blocks):
+                    logger.info(f"Computed neighbors of {done}/{len(blocks)} blocks")
+
+
+def write_similarities(output_path: Union[str, Path], codes: np.ndarray, blocks: Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray]]) -> int:
+    """
+    Stream neighbor pairs to a similarities CSV file, replacing it once complete.
+
+    Args:
+        output_path: Similarities CSV file
+        codes: Normalized product code of every row the pairs refer to
+        blocks: (source rows, target rows, similarities) of consecutive blocks
+
+    Returns:
+        int: Number of written pairs
+    """
+    output_path = Path(output_path)
+    temp_path = output_path.with_name(f"{output_path.name}.tmp")
+    written = 0
+    with open(temp_path, "w", newline="") as f:
+        f.write("product1,product2,similarity\n")
+        for sources, targets, similarities in blocks:
+            pd.DataFrame({
+                "product1": codes[sources],
+                "product2": codes[targets],
+                "similarity": similarities,
+            }).to_csv(f, header=False, index=False, float_format="%.4f")
+            written += len(sources)
+    temp_path.replace(output_path)
+    logger.info(f"Wrote {written} neighbor pairs to {output_path}")
+    return written
+
+
+def write_delta(delta_path: Union[str, Path], sources: np.ndarray, product1: np.ndarray, product2: np.ndarray, similarities: np.ndarray) -> None:
+    """
+    Replace the neighbor lists of `sources` in a similarities delta, keeping the other lists it holds.
+
+    Every source gets a row without `product2`, so that a source left without neighbors
+    still replaces its list of the similarities file.
+    """
+    delta_path = Path(delta_path)
+    dtype = {"product1": str, "product2": str, "similarity": np.float32}
+    delta = pd.read_csv(delta_path, dtype=dtype) if delta_path.exists() else pd.DataFrame(columns=list(dtype)).astype(dtype)
+    delta = delta[~delta["product1"].str.zfill(PRODUCT_CODE_LENGTH).isin(set(sources))]
+
+    delta = pd.DataFrame({
+        "product1": np.concatenate([delta["product1"].to_numpy(dtype=object), sources, product1]),
+        "product2": np.concatenate([delta["product2"].to_numpy(dtype=object), np.full(len(sources), None), product2]),
+        "similarity": np.concatenate([delta["similarity"].to_numpy(dtype=np.float32), np.full(len(sources), np.nan, dtype=np.float32), similarities]),
+    })
+
+    temp_path = delta_path.with_name(f"{delta_path.name}.tmp")
+    delta.to_csv(temp_path, index=False, float_format="%.4f")
+    temp_path.replace(delta_path)
+    logger.info(f"Wrote {len(sources)} neighbor lists to {delta_path}, {delta['product1'].nunique()} lists in total")
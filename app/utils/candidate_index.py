@@ -0,0 +1,95 @@
+from typing import Any, Dict, Optional, Tuple
+import numpy as np
+from .neighbor_index import NeighborIndex
+from .logger import setup_colored_logger
+
+logger = setup_colored_logger(__name__)
+
+
+class CandidateIndex:
+    """
+    Candidate products of every product, best base score first.
+
+    Holds the neighbors the engine considers for a product, the ones at least
+    `min_similarity` similar among its `top_k` most similar, sorted by their score
+    without preferences and then by a tie rank. Candidates that cannot be scored
+    are left out. The engine walks a list from the start and stops as soon as the
+    rest of it cannot make it to the recommendations.
+
+    Rows are stored compressed like the neighbor index: the candidates of row `i`
+    are `rows[indptr[i]:indptr[i + 1]]`.
+
+    Attributes:
+        min_similarity: Minimum similarity of the neighbors the index was built with
+        top_k: Maximum number of neighbors of a product the index was built with
+    """
+    def __init__(self, indptr: np.ndarray, rows: np.ndarray, scores: np.ndarray, min_similarity: Optional[float], top_k: Optional[int]) -> None:
+        self._indptr = indptr
+        self._rows = rows
+        self._scores = scores
+        self.min_similarity = min_similarity
+        self.top_k = top_k
+
+    @classmethod
+    def from_neighbors(cls, neighbor_index: NeighborIndex, base_scores: np.ndarray, tie_ranks: np.ndarray, min_similarity: Optional[float] = None, top_k: Optional[int] = None) -> "CandidateIndex":
+        """
+        Build the index from the neighbors of every product.
+
+        Args:
+            neighbor_index: Similarity graph over the dataset rows
+            base_scores: Score of every dataset row without preferences, the lower the better, NaN if it cannot be scored
+            tie_ranks: Rank of every dataset row among candidates with the same score, the lower the better
+            min_similarity: Minimum similarity of a candidate
+            top_k: Maximum number of most similar neighbors of a product to consider
+
+        Returns:
+            CandidateIndex: Index with candidates of every product sorted by base score and tie rank
+        """
+        sources, targets = neighbor_index.edges(min_similarity, top_k)
+        scores = base_scores[targets]
+        scored = ~np.isnan(scores)
+        sources, targets, scores = sources[scored], targets[scored], scores[scored]
+
+        order = np.lexsort((tie_ranks[targets], scores, sources))
+        indptr = np.zeros(len(neighbor_index) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=len(neighbor_index)), out=indptr[1:])
+
+        logger.info(f"Built candidate index with {len(order)} candidates")
+        return cls(indptr, targets[order], scores[order], min_similarity, top_k)
+
+    def candidates(self, row: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Get candidates of a product.
+
+        Args:
+            row: Row ID of the product
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Candidate row IDs and their base scores, best first
+        """
+        start, end = self._indptr[row], self._indptr[row + 1]
+        return self._rows[start:end], self._scores[start:end]
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        """Arrays of the index, which `from_arrays` builds it back from with the `settings`."""
+        return {"indptr": self._indptr, "rows": self._rows, "scores": self._scores}
+
+    @property
+    def settings(self) -> Dict[str, Any]:
+        return {"min_similarity": self.min_similarity, "top_k": self.top_k}
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray], settings: Dict[str, Any]) -> "CandidateIndex":
+        return cls(arrays["indptr"], arrays["rows"], arrays["scores"], settings["min_similarity"], settings["top_k"])
+
+    def matches(self, min_similarity: Optional[float], top_k: Optional[int]) -> bool:
+        """Whether the index holds the candidates of these neighbor settings."""
+        return self.min_similarity == min_similarity and self.top_k == top_k
+
+    @property
+    def nbytes(self) -> int:
+        """Memory used by the index arrays."""
+        return self._indptr.nbytes + self._rows.nbytes + self._scores.nbytes
+
+    def __len__(self) -> int:
+        return len(self._indptr) - 1
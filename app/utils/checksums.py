@@ -0,0 +1,121 @@
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterable, Optional, Union
+import hashlib
+from .logger import setup_colored_logger
+
+logger = setup_colored_logger(__name__)
+
+# manifest of the data directory, in the format of `sha256sum`
+CHECKSUMS_FILE_NAME = "checksums.sha256"
+
+CHUNK_SIZE = 1 << 20
+
+
+class ChecksumMismatchError(ValueError):
+    """Raised when a file does not have the checksum its manifest lists."""
+
+
+class HashingReader:
+    """
+    Binary file wrapper hashing every byte read through it.
+
+    Lets a file be checked in the same pass that parses it, e.g. `pickle.load(reader)`,
+    instead of reading it once to check it and once more to load it.
+    """
+    def __init__(self, file: BinaryIO) -> None:
+        self._file = file
+        self._hash = hashlib.sha256()
+
+    def read(self, size: int = -1) -> bytes:
+        data = self._file.read(size)
+        self._hash.update(data)
+        return data
+
+    def readline(self, size: int = -1) -> bytes:
+        data = self._file.readline(size)
+        self._hash.update(data)
+        return data
+
+    def readinto(self, buffer) -> int:
+        n = self._file.readinto(buffer)
+        self._hash.update(memoryview(buffer)[:n])
+        return n
+
+    def hexdigest(self) -> str:
+        """Checksum of the whole file, reading what the parser left unread"""
+        while self.read(CHUNK_SIZE):
+            pass
+        return self._hash.hexdigest()
+
+
+def file_sha256(path: Union[str, Path]) -> str:
+    """SHA-256 checksum of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ChecksumManifest:
+    """
+    Checksums of the files of a directory, read from a `sha256sum` style manifest.
+
+    Files are listed by their path relative to the manifest directory. Files the
+    manifest does not list are not checked, an absent manifest lists nothing.
+    """
+    def __init__(self, path: Union[str, Path]) -> None:
+        self.path = Path(path)
+        self.checksums = self.__read(self.path)
+
+    @staticmethod
+    def __read(path: Path) -> Dict[str, str]:
+        checksums: Dict[str, str] = {}
+        if not path.exists():
+            return checksums
+        for line in path.read_text(encoding="utf-8").splitlines():
+            if not line.strip() or line.startswith("#"):
+                continue
+            checksum, name = line.split(maxsplit=1)
+            # sha256sum marks files hashed in binary mode with a leading *
+            checksums[name.lstrip("*")] = checksum.lower()
+        return checksums
+
+    def __name(self, path: Union[str, Path]) -> str:
+        return Path(path).resolve().relative_to(self.path.parent.resolve()).as_posix()
+
+    def expected(self, path: Union[str, Path]) -> Optional[str]:
+        """Listed checksum of a file, None if it is not listed"""
+        try:
+            return self.checksums.get(self.__name(path))
+        except ValueError:
+            return None
+
+    def check(self, path: Union[str, Path], checksum: Optional[str] = None) -> None:
+        """
+        Check a file against its listed checksum.
+
+        Args:
+            path: File to check
+            checksum: Checksum computed while the file was read, the file is read again if not set
+
+        Raises:
+            ChecksumMismatchError: If the file does not have its listed checksum
+        """
+        expected = self.expected(path)
+        if expected is None:
+            logger.debug(f"No checksum of {path} in {self.path}")
+            return
+        actual = checksum if checksum is not None else file_sha256(path)
+        if actual != expected:
+            raise ChecksumMismatchError(f"Checksum mismatch for {path}: expected {expected}, got {actual}")
+        logger.info(f"Checksum of {path} verified")
+
+    def update(self, paths: Iterable[Union[str, Path]]) -> None:
+        """Compute the checksums of files and write the manifest with them, keeping the other entries"""
+        for path in paths:
+            self.checksums[self.__name(path)] = file_sha256(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = self.path.with_name(f".{self.path.name}.tmp")
+        temp_path.write_text("".join(f"{checksum}  {name}\n" for name, checksum in sorted(self.checksums.items())), encoding="utf-8")
+        temp_path.replace(self.path)
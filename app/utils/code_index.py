@@ -0,0 +1,72 @@
+import sys
+from typing import Dict, Optional
+import numpy as np
+import pandas as pd
+from models.domain.off_product import PRODUCT_CODE_LENGTH, normalize_product_code, product_codes
+from .logger import setup_colored_logger
+
+logger = setup_colored_logger(__name__)
+
+
+class ProductCodeIndex:
+    """
+    Hash index from a normalized product code to the positional row ID of the dataset.
+
+    When a code occurs more than once in the dataset, its first row is indexed.
+    """
+    def __init__(self, codes: np.ndarray) -> None:
+        """
+        Args:
+            codes: Normalized product codes in dataset row order
+        """
+        self._codes = codes
+        # iterate backwards so that the first row of a duplicated code wins
+        self._rows: Dict[str, int] = dict(zip(codes[::-1], range(len(codes) - 1, -1, -1)))
+
+    @classmethod
+    def from_dataset(cls, dataset: pd.DataFrame) -> "ProductCodeIndex":
+        codes = pd.Series(product_codes(dataset)).str.zfill(PRODUCT_CODE_LENGTH).to_numpy(dtype=object)
+        code_index = cls(codes)
+        if len(code_index) < len(codes):
+            logger.warning(f"Dataset contains {len(codes) - len(code_index)} duplicated product codes")
+        return code_index
+
+    def row_of(self, product_code: str) -> Optional[int]:
+        """
+        Get the positional row ID of a product.
+
+        Args:
+            product_code: Product code, normalized or not
+
+        Returns:
+            Optional[int]: Row ID or None if the product is not in the dataset
+        """
+        return self._rows.get(normalize_product_code(product_code))
+
+    def rows_of(self, product_codes: pd.Series) -> np.ndarray:
+        """
+        Get positional row IDs of many products at once, -1 for products not in the dataset.
+        """
+        normalized = product_codes.astype(str).str.zfill(PRODUCT_CODE_LENGTH)
+        return normalized.map(self._rows).fillna(-1).to_numpy(dtype=np.int64)
+
+    def code_at(self, row: int) -> str:
+        """Get the normalized product code stored at a row ID."""
+        return self._codes[row]
+
+    @property
+    def codes(self) -> np.ndarray:
+        """Normalized product codes in dataset row order."""
+        return self._codes
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate memory used by the index, codes included."""
+        code_bytes = sum(sys.getsizeof(code) for code in self._codes)
+        return self._codes.nbytes + code_bytes + sys.getsizeof(self._rows) + len(self._rows) * sys.getsizeof(0)
+
+    def __contains__(self, product_code: str) -> bool:
+        return self.row_of(product_code) is not None
+
+    def __len__(self) -> int:
+        return len(self._rows)
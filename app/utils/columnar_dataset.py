@@ -0,0 +1,222 @@
+import json
+import pickle
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Union
+import numpy as np
+import pandas as pd
+from .logger import setup_colored_logger
+
+logger = setup_colored_logger(__name__)
+
+FORMAT_VERSION = 1
+MANIFEST_FILE_NAME = "manifest.json"
+
+
+class StringColumn:
+    """
+    Read-only column of strings stored as one UTF-8 heap with row offsets.
+
+    Both files are memory-mapped, a row is only decoded when it is accessed.
+    """
+    def __init__(self, offsets: np.ndarray, heap: np.ndarray, nulls: np.ndarray) -> None:
+        self._offsets = offsets
+        self._heap = heap
+        self._nulls = nulls
+
+    def __len__(self) -> int:
+        return len(self._nulls)
+
+    def __getitem__(self, row: int) -> Any:
+        """Decode a single row, NaN for a missing value."""
+        if self._nulls[row]:
+            return np.nan
+        return self._heap[self._offsets[row]:self._offsets[row + 1]].tobytes().decode("utf-8")
+
+    def to_numpy(self) -> np.ndarray:
+        """Decode the whole column into an object array, NaN for missing values."""
+        text = self._heap.tobytes()
+        offsets = self._offsets.tolist()
+        values = np.array([text[start:end].decode("utf-8") for start, end in zip(offsets[:-1], offsets[1:])], dtype=object)
+        values[self._nulls] = np.nan
+        return values
+
+
+class ColumnarDataset:
+    """
+    Dataset stored column by column in a directory, loaded lazily and memory-mapped.
+
+    Layout of the directory:
+        - manifest.json: number of rows and the name, kind and files of every column
+        - numeric and boolean columns: one .npy file each, memory-mapped read-only so that
+          every process reading the dataset shares the same page cache
+        - string columns: .offsets.npy row offsets into a .heap UTF-8 heap, plus a .nulls.npy mask
+        - categorical columns: .codes.npy codes plus their categories stored as a string column
+        - any other column: pickled on its own
+    """
+    def __init__(self, path: Union[str, Path]) -> None:
+        self.path = Path(path)
+        with open(self.path / MANIFEST_FILE_NAME) as f:
+            self.manifest = json.load(f)
+        if self.manifest["format_version"] != FORMAT_VERSION:
+            raise ValueError(f"Unsupported columnar dataset format version {self.manifest['format_version']}")
+        self._columns: Dict[str, Dict[str, Any]] = {column["name"]: column for column in self.manifest["columns"]}
+        self._loaded: Dict[str, Any] = {}
+
+    @property
+    def columns(self) -> List[str]:
+        return list(self._columns)
+
+    def __len__(self) -> int:
+        return self.manifest["num_rows"]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._columns
+
+    def column(self, name: str) -> Any:
+        """
+        Load a single column, once.
+
+        Returns:
+            np.memmap for numeric columns, StringColumn for string columns,
+            pd.Categorical for categorical columns and np.ndarray otherwise
+        """
+        if name not in self._loaded:
+            self._loaded[name] = self.__load_column(self._columns[name])
+        return self._loaded[name]
+
+    def to_frame(self, columns: Optional[List[str]] = None) -> pd.DataFrame:
+        """
+        Build a DataFrame from the dataset, numeric columns keep pointing at the memory-mapped files.
+
+        Args:
+            columns: Columns to load, all by default
+        """
+        columns = self.columns if columns is None else [name for name in columns if name in self._columns]
+        data = {}
+        for name in columns:
+            column = self.column(name)
+            data[name] = column.to_numpy() if isinstance(column, StringColumn) else column
+        return pd.DataFrame(data, copy=False)
+
+    def verify(self) -> None:
+        """
+        Check that every column file exists and has one value per row.
+
+        Raises:
+            ValueError: If the dataset is incomplete
+        """
+        for column in self.manifest["columns"]:
+            for file_name in column["files"].values():
+                if not (self.path / file_name).exists():
+                    raise ValueError(f"Missing file {file_name} of column {column['name']}")
+            if column["kind"] == "numeric":
+                length = len(np.load(self.path / column["files"]["values"], mmap_mode="r"))
+            elif column["kind"] == "categorical":
+                length = len(np.load(self.path / column["files"]["codes"], mmap_mode="r"))
+            elif column["kind"] == "string":
+                length = len(np.load(self.path / column["files"]["nulls"], mmap_mode="r"))
+            else:
+                continue
+            if length != len(self):
+                raise ValueError(f"Column {column['name']} has {length} rows, expected {len(self)}")
+
+    def __load_column(self, column: Dict[str, Any]) -> Any:
+        files = {key: self.path / file_name for key, file_name in column["files"].items()}
+        kind = column["kind"]
+        if kind == "numeric":
+            return np.load(files["values"], mmap_mode="r")
+        if kind == "string":
+            return self.__load_strings(files["offsets"], files["heap"], files["nulls"])
+        if kind == "categorical":
+            categories = self.__load_strings(files["category_offsets"], files["category_heap"], files["category_nulls"]).to_numpy()
+            return pd.Categorical.from_codes(np.load(files["codes"], mmap_mode="r"), categories=categories)
+        with open(files["values"], "rb") as f:
+            return pickle.load(f)
+
+    @staticmethod
+    def __load_strings(offsets_path: Path, heap_path: Path, nulls_path: Path) -> StringColumn:
+        heap = np.memmap(heap_path, dtype=np.uint8, mode="r") if heap_path.stat().st_size else np.zeros(0, dtype=np.uint8)
+        return StringColumn(
+            offsets=np.load(offsets_path, mmap_mode="r"),
+            heap=heap,
+            nulls=np.load(nulls_path, mmap_mode="r"),
+        )
+
+    @classmethod
+    def write(cls, dataset: pd.DataFrame, path: Union[str, Path]) -> "ColumnarDataset":
+        """
+        Write a DataFrame as a columnar dataset, replacing the manifest last so readers never see a partial dataset.
+
+        Args:
+            dataset: DataFrame to write, its index is not kept
+            path: Directory of the columnar dataset
+        """
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+
+        columns = []
+        for i, name in enumerate(dataset.columns):
+            prefix = f"col_{i:04d}"
+            values = dataset[name]
+            if isinstance(values.dtype, pd.CategoricalDtype) and cls.__is_string_array(values.cat.categories.to_numpy(dtype=object)):
+                np.save(path / f"{prefix}.codes.npy", values.cat.codes.to_numpy())
+                files = {"codes": f"{prefix}.codes.npy"}
+                files.update({
+                    f"category_{key}": file_name
+                    for key, file_name in cls.__write_strings(values.cat.categories.to_numpy(dtype=object), path, f"{prefix}.categories").items()
+                })
+                kind = "categorical"
+            elif isinstance(values.dtype, np.dtype) and values.dtype.kind in "biuf":
+                np.save(path / f"{prefix}.npy", values.to_numpy())
+                files = {"values": f"{prefix}.npy"}
+                kind = "numeric"
+            elif cls.__is_string_array(values.to_numpy(dtype=object)):
+                files = cls.__write_strings(values.to_numpy(dtype=object), path, prefix)
+                kind = "string"
+            else:
+                with open(path / f"{prefix}.pkl", "wb") as f:
+                    pickle.dump(values.to_numpy(), f, protocol=pickle.HIGHEST_PROTOCOL)
+                files = {"values": f"{prefix}.pkl"}
+                kind = "pickle"
+            columns.append({"name": str(name), "kind": kind, "dtype": str(values.dtype), "files": files})
+
+        manifest = {"format_version": FORMAT_VERSION, "num_rows": len(dataset), "columns": columns}
+        temp_manifest_path = path / f"{MANIFEST_FILE_NAME}.tmp"
+        with open(temp_manifest_path, "w") as f:
+            json.dump(manifest, f, indent=2)
+        temp_manifest_path.replace(path / MANIFEST_FILE_NAME)
+
+        logger.info(f"Wrote {len(dataset)} rows and {len(columns)} columns to {path}")
+        return cls(path)
+
+    @staticmethod
+    def __is_string_array(values: np.ndarray) -> bool:
+        return all(isinstance(value, str) for value in values[~pd.isna(values)])
+
+    @staticmethod
+    def __write_strings(values: np.ndarray, path: Path, prefix: str) -> Dict[str, str]:
+        nulls = pd.isna(values)
+        encoded = [b"" if null else value.encode("utf-8") for value, null in zip(values, nulls)]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(value) for value in encoded], out=offsets[1:])
+
+        np.save(path / f"{prefix}.offsets.npy", offsets)
+        np.save(path / f"{prefix}.nulls.npy", nulls)
+        with open(path / f"{prefix}.heap", "wb") as f:
+            f.write(b"".join(encoded))
+        return {"offsets": f"{prefix}.offsets.npy", "heap": f"{prefix}.heap", "nulls": f"{prefix}.nulls.npy"}
+
+
+def convert_pickle_to_columnar(pickle_path: Union[str, Path], output_path: Union[str, Path], enrich=None) -> ColumnarDataset:
+    """
+    Convert a pickled dataset to the columnar format.
+
+    Args:
+        pickle_path: Path to the pickled DataFrame
+        output_path: Directory of the columnar dataset
+        enrich: Optional callable adding derived columns before writing, so that they are not recomputed at load
+    """
+    dataset = pd.read_pickle(pickle_path)
+    if enrich is not None:
+        dataset = enrich(dataset)
+    return ColumnarDataset.write(dataset.reset_index(drop=True), output_path)
@@ -1,9 +1,23 @@
-from typing import Any, Optional
+from enum import Enum
+from typing import Any, Callable, Dict, List, Optional
+import asyncio
+import json
 import os
 import pickle
 import shutil
+import threading
+import time
 from functools import lru_cache
+from pathlib import Path
 from .large_dataset_cache import LargeDatasetCache
+from .columnar_dataset import ColumnarDataset, MANIFEST_FILE_NAME
+from .code_index import ProductCodeIndex
+from .neighbor_index import NeighborIndex, similarities_delta_path
+from .candidate_index import CandidateIndex
+from .materialized_recommendations import MaterializedRecommendations
+from .dataset_snapshot import DatasetSnapshot
+from .shared_artifacts import SharedArtifactStore, file_signature, load_arrays, save_arrays
+from .checksums import CHECKSUMS_FILE_NAME, ChecksumManifest, HashingReader
 from .logger import setup_colored_logger
 from config import DATA_DIR
 
@@ -13,24 +27,87 @@ logger = setup_colored_logger(__name__)
 def get_cache_instance() -> LargeDatasetCache:
     return LargeDatasetCache(max_memory_percent=75.0)
 
+
+class DatasetState(Enum):
+    """Readiness of the dataset manager to serve requests"""
+    NOT_LOADED = "not_loaded"
+    LOADING = "loading"
+    READY = "ready"
+    FAILED = "failed"
+
+
+class DatasetNotReadyError(Exception):
+    """Raised when a request comes in before the first dataset snapshot is live."""
+
+
 class DatasetManager:
-    def __init__(self, dataset_file_name: str):
+    def __init__(self, dataset_file_name: str, similarities_file_name: str = "similarities.csv", enrich: Optional[Callable[[Any], Any]] = None, recommendations_file_name: str = "recommendations.npz", build_candidates: Optional[Callable[[Any, ProductCodeIndex, NeighborIndex], CandidateIndex]] = None, shared_dir: Optional[Path] = None, columns: Optional[List[str]] = None):
+        """
+        The dataset is loaded from its columnar version (the same file name with a .columns
+        suffix, see ColumnarDataset) when there is one, and from the pickle otherwise.
+        
+        Args:
+            dataset_file_name: Name of the pickled dataset file in the data directory
+            similarities_file_name: Name of the product similarities file in the data directory
+            enrich: Callable adding derived columns to the dataset, run once after it is loaded
+            recommendations_file_name: Name of the materialized recommendations file in the data directory,
+                loaded when it was computed on the same dataset and similarities
+            build_candidates: Callable building the candidate index of the dataset and its neighbor index,
+                run once per snapshot, no candidate index by default
+            shared_dir: Directory on a tmpfs where the dataset and its indexes are built once and
+                memory-mapped by every worker process, each process loads its own copy by default.
+                Only fixed-width arrays are shared, text columns and the code index dict stay per process
+            columns: Columns loaded from a columnar dataset, the other ones are never decoded, all by default
+        """
         self.dataset_path = DATA_DIR / dataset_file_name
         logger.info(f"Dataset path: {self.dataset_path}")
+        self.columnar_path = self.dataset_path.with_suffix(".columns")
+        self.similarities_path = DATA_DIR / similarities_file_name
+        logger.info(f"Similarities path: {self.similarities_path}")
+        self.similarities_delta_path = similarities_delta_path(self.similarities_path)
+        self.recommendations_path = DATA_DIR / recommendations_file_name
+        self.checksums_path = DATA_DIR / CHECKSUMS_FILE_NAME
         self.temp_path = DATA_DIR / "openfoodfacts_sample.pkl"
 
 
+        self.enrich = enrich
+        self.columns = columns
+        self.build_candidates = build_candidates
+        self.shared_store = SharedArtifactStore(shared_dir) if shared_dir is not None else None
+
         self.cache = get_cache_instance()
         
+        self._snapshot: Optional[DatasetSnapshot] = None
+        self._snapshot_lock = threading.Lock()
+        self._snapshot_cache_keys: Dict[int, List[str]] = {}
+        self._snapshot_shared_paths: Dict[int, List[Path]] = {}
+        # held while a snapshot is being built, a reload releases it from its own thread
+        self._reload_lock = threading.Lock()
+        # set when a reload is asked for while a build runs, a new reload runs once it is done
+        self._reload_pending = False
+        self._pending_lock = threading.Lock()
+        self._last_reload_error: Optional[str] = None
+        # precomputed for the health endpoints, which must not wait on a load
+        self._state = DatasetState.NOT_LOADED
+        self._state_error: Optional[str] = None
+        self._state_changed_at = time.time()
+        
     def initialize_dataset(self):
-        """Initialize dataset at container startup"""
+        """
+        Initialize dataset at container startup.
+        
+        The dataset is read once: its integrity is checked against the checksum manifest
+        while it is loaded. Requests coming in meanwhile are not held up behind the load,
+        `get_snapshot` returns no snapshot until it is done.
+        """
+        self.__set_state(DatasetState.LOADING)
         try:
             self.temp_path.parent.mkdir(parents=True, exist_ok=True)
             
             self.dataset_path.parent.mkdir(parents=True, exist_ok=True)
             
             
-            if not self.dataset_path.exists():
+            if not self.dataset_path.exists() and not self._has_columnar_dataset():
                 logger.warning("Dataset not found in volume, copying from image...")
                 self._copy_dataset_to_volume()
             
@@ -41,13 +118,63 @@ class DatasetManager:
             logger.info("After veryfing dataset")
             
             # Preload to cache
-            self.get_dataset()
+            with self._reload_lock:
+                if self._snapshot is None:
+                    self._swap_snapshot(self._build_snapshot(version=1))
+            # already live when the snapshot was built before, lazily or by a reload
+            self.__set_state(DatasetState.READY)
+            self.__run_pending_reload()
             
             logger.info("Dataset initialized and cached successfully")
             
         except Exception as e:
             logger.error(f"Failed to initialize dataset: {e}")
+            self.__set_state(DatasetState.FAILED, str(e))
+            # a reload asked for meanwhile may find the sources fixed
+            self.__run_pending_reload()
             raise
+    
+    def start_initialization(self, on_ready: Optional[Callable[[], None]] = None) -> threading.Thread:
+        """
+        Initialize the dataset in a background thread, so that the server listens meanwhile.
+        
+        Args:
+            on_ready: Callable run in the thread once the dataset is live
+            
+        Returns:
+            threading.Thread: Thread initializing the dataset, a failure is logged and kept in the readiness state
+        """
+        def initialize():
+            try:
+                self.initialize_dataset()
+            except Exception:
+                return
+            if on_ready is not None:
+                on_ready()
+        
+        # set before the thread runs, so that no request builds the snapshot lazily in the meantime
+        self.__set_state(DatasetState.LOADING)
+        thread = threading.Thread(target=initialize, name="dataset-initialization", daemon=True)
+        thread.start()
+        return thread
+    
+    def __set_state(self, state: DatasetState, error: Optional[str] = None):
+        self._state, self._state_error, self._state_changed_at = state, error, time.time()
+    
+    @property
+    def is_ready(self) -> bool:
+        return self._state == DatasetState.READY
+    
+    def readiness(self) -> dict:
+        """Readiness state of the dataset, precomputed, reading it never touches the files"""
+        snapshot = self._snapshot
+        return {
+            "status": self._state.value,
+            "ready": self.is_ready,
+            "since": self._state_changed_at,
+            "snapshot_version": snapshot.version if snapshot is not None else None,
+            "error": self._state_error,
+        }
             
     def _copy_dataset_to_volume(self):
         """Copy dataset from image to volume"""
@@ -57,18 +184,78 @@ class DatasetManager:
         logger.warning(f"temp path: {self.temp_path.exists()}")
         shutil.copy2(src=self.temp_path, dst=self.dataset_path)
         
+    def _has_columnar_dataset(self) -> bool:
+        return (self.columnar_path / MANIFEST_FILE_NAME).exists()
+    
+    def _dataset_source(self) -> Path:
+        """Path the dataset is loaded from, its columnar version if available"""
+        return self.columnar_path if self._has_columnar_dataset() else self.dataset_path
+        
     def _verify_dataset(self):
-        """Verify dataset integrity"""
+        """
+        Check the dataset before a load, without reading it.
+        
+        A pickled dataset is checked against the checksum manifest while it is loaded,
+        see `_load_dataset`.
+        """
         try:
-            with open(self.dataset_path, 'rb') as f:
-                pickle.load(f)
+            if self._has_columnar_dataset():
+                ColumnarDataset(self.columnar_path).verify()
+            elif not self.dataset_path.exists():
+                raise FileNotFoundError(f"Dataset file not found: {self.dataset_path}")
         except Exception as e:
             logger.error(f"Dataset verification failed: {e}")
             raise
             
+    def _load_dataset(self, filepath: str) -> Any:
+        """Load the dataset from file and enrich it"""
+        if Path(filepath).is_dir():
+            dataset = ColumnarDataset(filepath).to_frame(self.columns)
+        else:
+            with open(filepath, 'rb') as f:
+                reader = HashingReader(f)
+                dataset = pickle.load(reader)
+                ChecksumManifest(self.checksums_path).check(filepath, reader.hexdigest())
+        if self.enrich is not None:
+            dataset = self.enrich(dataset)
+        return dataset
+            
+    def get_snapshot(self, default: Any = None) -> Optional[DatasetSnapshot]:
+        """
+        Get the current dataset snapshot, building the first one if needed.
+        
+        Callers serving a request should get the snapshot once and read every artifact
+        from it, so that a concurrent reload cannot hand them artifacts of two versions.
+        
+        The first snapshot is only built here when the dataset was not initialized: while
+        `initialize_dataset` runs, or after it failed, the default is returned right away.
+        
+        Args:
+            default: Default value to return in case of error
+            
+        Returns:
+            DatasetSnapshot or default value
+        """
+        snapshot = self._snapshot
+        if snapshot is not None:
+            return snapshot
+        if self._state != DatasetState.NOT_LOADED:
+            return default
+        
+        try:
+            with self._reload_lock:
+                if self._snapshot is None:
+                    self._swap_snapshot(self._build_snapshot(version=1))
+            self.__run_pending_reload()
+            return self._snapshot
+            
+        except Exception as e:
+            logger.exception(f"Error building dataset snapshot: {e}")
+            return default
+            
     def get_dataset(self, default: Any = None) -> Optional[Any]:
         """
-        Get dataset from cache or load it if needed
+        Get the dataset of the current snapshot
         
         Args:
             default: Default value to return in case of error
@@ -76,51 +263,306 @@ class DatasetManager:
         Returns:
             Dataset or default value
         """
+        snapshot = self.get_snapshot()
+        return default if snapshot is None else snapshot.dataset
+            
+    def get_code_index(self, default: Any = None) -> Optional[ProductCodeIndex]:
+        """
+        Get the product code index of the current snapshot
+        
+        Args:
+            default: Default value to return in case of error
+            
+        Returns:
+            ProductCodeIndex or default value
+        """
+        snapshot = self.get_snapshot()
+        return default if snapshot is None else snapshot.code_index
+    
+    def get_neighbor_index(self, default: Any = None) -> Optional[NeighborIndex]:
+        """
+        Get the product similarity neighbor index of the current snapshot
+        
+        Args:
+            default: Default value to return in case of error
+            
+        Returns:
+            NeighborIndex or default value
+        """
+        snapshot = self.get_snapshot()
+        return default if snapshot is None else snapshot.neighbor_index
+    
+    def reload(self, background: bool = True) -> bool:
+        """
+        Rebuild the dataset and its indexes from the files and swap them in.
+        
+        Requests keep being served from the current snapshot while the new one is built,
+        and requests already running finish on it. If the build fails the current
+        snapshot stays in place.
+        
+        A reload asked for while another one runs is not dropped: one more reload runs
+        once the current one is done, so that it sees the files as changed meanwhile.
+        
+        Args:
+            background: Build the new snapshot in a background thread
+            
+        Returns:
+            bool: False if a reload was already in progress, another one is then queued after it
+        """
+        with self._pending_lock:
+            if not self._reload_lock.acquire(blocking=False):
+                self._reload_pending = True
+                logger.info("Dataset reload already in progress, reloading again once it is done")
+                return False
+        
+        if background:
+            threading.Thread(target=self.__reload_and_release, name="dataset-reload", daemon=True).start()
+        else:
+            self.__reload_and_release()
+        return True
+    
+    def reload_status(self) -> dict:
+        """Get the version of the current snapshot and the state of reloads"""
+        snapshot = self._snapshot
+        return {
+            "snapshot": snapshot.info() if snapshot is not None else None,
+            "reloading": self._reload_lock.locked(),
+            "reload_pending": self._reload_pending,
+            "last_reload_error": self._last_reload_error,
+        }
+    
+    async def watch_sources(self, stop_event: Optional[asyncio.Event] = None):
+        """
+        Reload the dataset whenever the dataset or similarities file changes.
+        
+        Args:
+            stop_event: Event stopping the watcher when set
+        """
+        from watchfiles import awatch
+        
+        watched = {
+            self.dataset_path.resolve(),
+            (self.columnar_path / MANIFEST_FILE_NAME).resolve(),
+            self.similarities_path.resolve(),
+            self.similarities_delta_path.resolve(),
+            self.recommendations_path.resolve(),
+            self.checksums_path.resolve(),
+        }
+        logger.info(f"Watching {self.dataset_path.parent} for dataset changes")
+        
+        async for changes in awatch(self.dataset_path.parent, stop_event=stop_event, recursive=True):
+            changed = {Path(path).resolve() for _, path in changes} & watched
+            if changed:
+                logger.info(f"Dataset sources changed: {', '.join(sorted(map(str, changed)))}")
+                self.reload()
+    
+    def __run_pending_reload(self):
+        with self._pending_lock:
+            pending, self._reload_pending = self._reload_pending, False
+        if pending:
+            self.reload()
+    
+    def __reload_and_release(self):
+        while True:
+            self.__reload_once()
+            with self._pending_lock:
+                if not self._reload_pending:
+                    self._reload_lock.release()
+                    return
+                self._reload_pending = False
+            logger.info("Dataset sources changed during the reload, reloading again")
+    
+    def __reload_once(self):
         try:
-            if not self.dataset_path.exists():
-                logger.error("Dataset file not found")
-                return default
-                
-            dataset = self.cache.get(str(self.dataset_path))
+            current = self._snapshot
+            version = (current.version if current is not None else 0) + 1
+            logger.info(f"Reloading dataset as snapshot version {version}")
             
-            if dataset is None:
-                logger.warning("Failed to get dataset from cache")
-                return default
-                
-            return dataset
+            self._verify_dataset()
+            self._swap_snapshot(self._build_snapshot(version))
+            self._last_reload_error = None
+            
+            logger.info(f"Dataset snapshot version {version} is live")
             
         except Exception as e:
-            logger.exception(f"Error getting dataset: {e}")
-            return default
+            logger.exception(f"Dataset reload failed, keeping the current snapshot: {e}")
+            self._last_reload_error = str(e)
+    
+    def _build_snapshot(self, version: int) -> DatasetSnapshot:
+        """Load the dataset and build its indexes, caching them under keys of the version"""
+        dataset_source = self._dataset_source()
+        if not dataset_source.exists():
+            raise FileNotFoundError(f"Dataset file not found: {dataset_source}")
+        if not self.similarities_path.exists():
+            raise FileNotFoundError(f"Similarities file not found: {self.similarities_path}")
+        
+        mtime_path = self.columnar_path / MANIFEST_FILE_NAME if dataset_source == self.columnar_path else dataset_source
+        source_mtimes = {
+            str(dataset_source): mtime_path.stat().st_mtime,
+            str(self.similarities_path): self.similarities_path.stat().st_mtime,
+        }
+        if self.similarities_delta_path.exists():
+            source_mtimes[str(self.similarities_delta_path)] = self.similarities_delta_path.stat().st_mtime
+        if self.recommendations_path.exists():
+            source_mtimes[str(self.recommendations_path)] = self.recommendations_path.stat().st_mtime
+        
+        cache_keys = [
+            f"{dataset_source}@v{version}",
+            f"{self.dataset_path}#code_index@v{version}",
+            f"{self.similarities_path}@v{version}",
+            f"{self.similarities_path}#candidates@v{version}",
+        ]
+        self._snapshot_cache_keys[version] = cache_keys
+        dataset_key, code_index_key, neighbor_index_key, candidate_index_key = cache_keys
+        shared_keys = self.__shared_keys(dataset_source, mtime_path) if self.shared_store is not None else None
+        self._snapshot_shared_paths[version] = []
+        
+        try:
+            # pinned while the snapshot is live, the snapshot holds them anyway
+            dataset = self.cache.get(dataset_key, loader=lambda _: self.__load_dataset_of_version(version, dataset_source, shared_keys), pin=True)
+            if dataset is None:
+                raise RuntimeError(f"Failed to load dataset from {dataset_source}")
+            
+            # the dict of the code index is rebuilt by every process, it cannot be memory-mapped
+            code_index = self.cache.get(code_index_key, loader=lambda _: ProductCodeIndex.from_dataset(dataset), pin=True)
+            if code_index is None:
+                raise RuntimeError("Failed to build code index")
+            
+            neighbor_index = self.cache.get(
+                neighbor_index_key,
+                loader=lambda _: self.__load_neighbor_index_of_version(version, code_index, shared_keys),
+                pin=True
+            )
+            if neighbor_index is None:
+                raise RuntimeError(f"Failed to build neighbor index from {self.similarities_path}")
+            
+            candidate_index = None
+            if self.build_candidates is not None:
+                candidate_index = self.cache.get(
+                    candidate_index_key,
+                    loader=lambda _: self.__load_candidate_index_of_version(version, dataset, code_index, neighbor_index, shared_keys),
+                    pin=True
+                )
+                if candidate_index is None:
+                    raise RuntimeError("Failed to build candidate index")
+            
+        except Exception:
+            self.__drop_cached_version(version)
+            raise
+        
+        # optional, requests are computed live without it
+        recommendations = MaterializedRecommendations.load_for(self.recommendations_path, dataset, code_index, neighbor_index)
+        
+        return DatasetSnapshot(
+            version=version,
+            dataset=dataset,
+            code_index=code_index,
+            neighbor_index=neighbor_index,
+            loaded_at=time.time(),
+            source_mtimes=source_mtimes,
+            recommendations=recommendations,
+            candidate_index=candidate_index,
+        )
+    
+    def __shared_keys(self, dataset_source: Path, mtime_path: Path) -> Dict[str, str]:
+        """Keys of the shared artifacts, derived from the source files and from the keys of the artifacts they depend on"""
+        dataset_key = SharedArtifactStore.key(str(dataset_source), file_signature(mtime_path), getattr(self.enrich, "__qualname__", None), self.columns)
+        neighbors_key = SharedArtifactStore.key(dataset_key, file_signature(self.similarities_path), file_signature(self.similarities_delta_path))
+        candidates_key = SharedArtifactStore.key(neighbors_key, getattr(self.build_candidates, "__qualname__", None))
+        return {"dataset": dataset_key, "neighbors": neighbors_key, "candidates": candidates_key}
+    
+    def __get_shared(self, version: int, name: str, key: str, write: Callable[[Path], None]) -> Path:
+        path = self.shared_store.get_or_build(name, key, write)
+        self._snapshot_shared_paths.setdefault(version, []).append(path)
+        return path
+    
+    def __load_dataset_of_version(self, version: int, dataset_source: Path, shared_keys: Optional[Dict[str, str]]) -> Any:
+        if shared_keys is None:
+            return self._load_dataset(str(dataset_source))
+        path = self.__get_shared(version, "dataset", shared_keys["dataset"], lambda path: ColumnarDataset.write(self._load_dataset(str(dataset_source)), path))
+        # numeric columns and categorical codes map the shared files, the derived columns were written with them,
+        # text columns are decoded into objects of this process
+        return ColumnarDataset(path).to_frame(self.columns)
+    
+    def __load_neighbor_index_of_version(self, version: int, code_index: ProductCodeIndex, shared_keys: Optional[Dict[str, str]]) -> NeighborIndex:
+        def build() -> NeighborIndex:
+            checksums = ChecksumManifest(self.checksums_path)
+            checksums.check(self.similarities_path)
+            if self.similarities_delta_path.exists():
+                checksums.check(self.similarities_delta_path)
+            return NeighborIndex.from_csv(self.similarities_path, code_index, self.similarities_delta_path)
+        
+        if shared_keys is None:
+            return build()
+        path = self.__get_shared(version, "neighbors", shared_keys["neighbors"], lambda path: save_arrays(path, build().to_arrays()))
+        return NeighborIndex.from_arrays(load_arrays(path))
+    
+    def __load_candidate_index_of_version(self, version: int, dataset: Any, code_index: ProductCodeIndex, neighbor_index: NeighborIndex, shared_keys: Optional[Dict[str, str]]) -> CandidateIndex:
+        if shared_keys is None:
+            return self.build_candidates(dataset, code_index, neighbor_index)
+        
+        def write(path: Path) -> None:
+            candidate_index = self.build_candidates(dataset, code_index, neighbor_index)
+            save_arrays(path, candidate_index.to_arrays())
+            (path / "settings.json").write_text(json.dumps(candidate_index.settings))
+        
+        path = self.__get_shared(version, "candidates", shared_keys["candidates"], write)
+        return CandidateIndex.from_arrays(load_arrays(path), json.loads((path / "settings.json").read_text()))
+    
+    def _swap_snapshot(self, snapshot: DatasetSnapshot):
+        """Make a snapshot current and release the cache entries of the previous one"""
+        with self._snapshot_lock:
+            previous, self._snapshot = self._snapshot, snapshot
+        self.__set_state(DatasetState.READY)
+        
+        if previous is not None:
+            # requests still running on the previous snapshot keep their references
+            self.__drop_cached_version(previous.version)
+        if self.shared_store is not None:
+            # mapped pages of removed artifacts stay valid until the processes holding them drop them
+            self.shared_store.prune(keep=self._snapshot_shared_paths.get(snapshot.version, []))
+    
+    def __drop_cached_version(self, version: int):
+        self._snapshot_shared_paths.pop(version, None)
+        for key in self._snapshot_cache_keys.pop(version, []):
+            self.cache.remove(key)
             
     def get_cache_stats(self) -> dict:
         """Get cache statistics"""
         return self.cache.get_stats()
     
     def clear_cache(self):
-        """Clear the cache"""
+        """Clear the cache and drop the current snapshot"""
+        with self._snapshot_lock:
+            self._snapshot = None
+        self.__set_state(DatasetState.NOT_LOADED)
+        self._snapshot_cache_keys.clear()
+        self._snapshot_shared_paths.clear()
         self.cache.clear()
         
         
     def health_check(self) -> dict:
         """
-        Check health status of dataset and cache
+        Check health status of dataset and cache, from precomputed state only, it never waits on a load
         Returns:
             dict: Health status information
         """
         try:
-            dataset_exists = self.dataset_path.exists()
-            cache_stats = self.cache.get_stats()
-            dataset = self.get_dataset()
+            readiness = self.readiness()
+            cache_stats = self.cache.counters()
             
             return {
-                "status": "healthy" if all([dataset_exists, dataset is not None]) else "unhealthy",
+                "status": "healthy" if readiness["ready"] else "unhealthy",
                 "details": {
-                    "dataset_available": dataset_exists,
-                    "dataset_loaded": dataset is not None,
+                    "dataset_state": readiness["status"],
+                    "dataset_loaded": self._snapshot is not None,
                     "cache_usage": f"{cache_stats['memory_percent']:.2f}%",
                     "cached_files": cache_stats['cached_files'],
-                    "dataset_path": str(self.dataset_path)
+                    "cache_hit_rate": f"{cache_stats['hit_rate']:.2%}",
+                    "cache_evictions": cache_stats['evictions'],
+                    "dataset_path": str(self.dataset_path),
+                    "snapshot_version": readiness["snapshot_version"],
+                    "error": readiness["error"],
                 }
             }
         except Exception as e:
@@ -0,0 +1,45 @@
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+import pandas as pd
+from .code_index import ProductCodeIndex
+from .neighbor_index import NeighborIndex
+from .candidate_index import CandidateIndex
+from .materialized_recommendations import MaterializedRecommendations
+
+
+@dataclass(frozen=True)
+class DatasetSnapshot:
+    """
+    Consistent set of the dataset and the indexes derived from it.
+
+    A request reads every artifact from the same snapshot, so a reload swapping
+    in a new snapshot never mixes row IDs of two dataset versions.
+
+    Attributes:
+        version: Increasing number of the snapshot, starting at 1
+        dataset: Enriched dataset
+        code_index: Product code index of the dataset
+        neighbor_index: Similarity graph over the dataset rows
+        loaded_at: Unix time the snapshot was built at
+        source_mtimes: Modification time of every source file the snapshot was built from
+        recommendations: Recommendations materialized offline for the dataset and similarities, if any
+        candidate_index: Candidates of every product sorted by score, if built
+    """
+    version: int
+    dataset: pd.DataFrame
+    code_index: ProductCodeIndex
+    neighbor_index: NeighborIndex
+    loaded_at: float
+    source_mtimes: Dict[str, float] = field(default_factory=dict)
+    recommendations: Optional[MaterializedRecommendations] = None
+    candidate_index: Optional[CandidateIndex] = None
+
+    def info(self) -> dict:
+        """Summary of the snapshot, without the data."""
+        return {
+            "version": self.version,
+            "products": len(self.dataset),
+            "loaded_at": self.loaded_at,
+            "source_mtimes": self.source_mtimes,
+            "materialized_recommendations": self.recommendations is not None,
+        }
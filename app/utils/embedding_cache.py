@@ -0,0 +1,127 @@
+from pathlib import Path
+from typing import Dict, Optional, Tuple, Union
+import re
+import threading
+import numpy as np
+from .logger import setup_colored_logger
+
+logger = setup_colored_logger(__name__)
+
+
+class EmbeddingCache:
+    """
+    Vectors of encoded texts keyed by the content hash of the text, persisted on disk.
+
+    Vectors of every encoder are kept apart, in `<directory>/<encoder name>.hashes.npy`
+    and `<directory>/<encoder name>.vectors.npy`. New vectors are kept in memory and
+    written to disk every `flush_every` new entries, or on `flush`.
+
+    Attributes:
+        encoder_name: Name of the encoder the vectors come from
+        directory: Directory of the cache files, None for a memory-only cache
+        flush_every: Number of new vectors written to disk at once
+    """
+    def __init__(self, encoder_name: str, directory: Optional[Union[str, Path]] = None, flush_every: int = 1000) -> None:
+        self.encoder_name = encoder_name
+        self.directory = Path(directory) if directory is not None else None
+        self.flush_every = flush_every
+        self._rows: Dict[int, int] = {}
+        self._vectors: Optional[np.ndarray] = None
+        self._size = 0
+        self._persisted = 0
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def get_many(self, hashes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Look up the vectors of many content hashes.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Vectors of the cached hashes and a mask of the hashes that are cached
+        """
+        with self._lock:
+            self.__load()
+            rows = np.array([self._rows.get(int(h), -1) for h in hashes], dtype=np.int64)
+            found = rows >= 0
+            if self._vectors is None:
+                return np.zeros((0, 0), dtype=np.float32), found
+            return self._vectors[rows[found]], found
+
+    def put_many(self, hashes: np.ndarray, vectors: np.ndarray) -> None:
+        """Cache vectors of content hashes, writing them to disk once enough new ones are cached."""
+        with self._lock:
+            self.__load()
+            for h, vector in zip(hashes, vectors):
+                h = int(h)
+                if h in self._rows:
+                    continue
+                self.__append(h, vector)
+            if self.directory is not None and self._size - self._persisted >= self.flush_every:
+                self.__save()
+
+    def flush(self) -> None:
+        """Write new vectors to disk."""
+        with self._lock:
+            if self.directory is not None and self._size > self._persisted:
+                self.__save()
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    @property
+    def nbytes(self) -> int:
+        return self._vectors[:self._size].nbytes if self._vectors is not None else 0
+
+    def __append(self, h: int, vector: np.ndarray) -> None:
+        if self._vectors is None:
+            self._vectors = np.zeros((1024, len(vector)), dtype=np.float32)
+        elif self._size == len(self._vectors):
+            # grow geometrically, so appending one vector at a time stays cheap
+            self._vectors = np.concatenate([self._vectors, np.zeros_like(self._vectors)])
+        self._vectors[self._size] = vector
+        self._rows[h] = self._size
+        self._size += 1
+
+    def __paths(self) -> Tuple[Path, Path]:
+        name = re.sub(r"[^\w.-]", "_", self.encoder_name)
+        return self.directory / f"{name}.hashes.npy", self.directory / f"{name}.vectors.npy"
+
+    def __load(self) -> None:
+        if self._loaded:
+            return
+        self._loaded = True
+        if self.directory is None:
+            return
+
+        hashes_path, vectors_path = self.__paths()
+        if not (hashes_path.exists() and vectors_path.exists()):
+            return
+        try:
+            hashes = np.load(hashes_path)
+            vectors = np.load(vectors_path)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable embedding cache {vectors_path}: {str(e)}")
+            return
+        if len(hashes) != len(vectors):
+            logger.warning(f"Ignoring embedding cache {vectors_path} with {len(hashes)} hashes for {len(vectors)} vectors")
+            return
+
+        self._vectors = vectors.astype(np.float32, copy=False)
+        self._rows = {int(h): row for row, h in enumerate(hashes)}
+        self._size = self._persisted = len(hashes)
+        logger.info(f"Loaded {len(hashes)} cached {self.encoder_name} vectors from {vectors_path}")
+
+    def __save(self) -> None:
+        hashes_path, vectors_path = self.__paths()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        hashes = np.zeros(self._size, dtype=np.uint64)
+        for h, row in self._rows.items():
+            hashes[row] = h
+
+        # write next to the cache and swap, so a crash never leaves half a file behind
+        for path, array in ((vectors_path, self._vectors[:self._size]), (hashes_path, hashes)):
+            temp_path = path.with_name(f"{path.stem}.tmp.npy")
+            np.save(temp_path, array)
+            temp_path.replace(path)
+        self._persisted = self._size
+        logger.info(f"Saved {self._size} cached {self.encoder_name} vectors to {vectors_path}")
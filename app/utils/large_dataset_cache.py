@@ -1,23 +1,66 @@
 import pickle
+from collections import OrderedDict
 from pathlib import Path
 import sys
+import threading
+import time
+import numpy as np
+import pandas as pd
 import psutil
-from typing import Optional, Any
+from typing import Callable, Dict, Optional, Any, Set
 import logging
+from .metrics import DATASET_CACHE_LOOKUPS
+
+
+class _InFlightLoad:
+    """Load of a cache entry in progress, which other threads asking for the entry wait for"""
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.data: Any = None
+        self.failed = False
+
 
 class LargeDatasetCache:
-    def __init__(self, max_memory_percent: float = 75.0):
+    def __init__(self, max_memory_percent: float = 75.0, default_ttl: Optional[float] = None):
         """
+        Entries are evicted least recently used first when the memory budget is exceeded,
+        and dropped on access once their time to live has passed. Pinned entries are never
+        evicted nor expired.
+        
         Args:
             max_memory_percent: Maximum memory usage for the cache in percent of total system memory.
+            default_ttl: Time to live of entries in seconds, None for no expiry.
         """
-        self._cache = {}
-        self._memory_usage = {}
+        self._cache: "OrderedDict[str, Any]" = OrderedDict()
+        self._memory_usage: Dict[str, int] = {}
+        self._expires_at: Dict[str, float] = {}
+        self._pinned: Set[str] = set()
+        self._loading: Dict[str, _InFlightLoad] = {}
         self._max_memory = psutil.virtual_memory().total * (max_memory_percent / 100)
+        self._default_ttl = default_ttl
+        self._lock = threading.RLock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
         self.logger = logging.getLogger(__name__)
     
     def _get_object_size(self, obj: Any) -> int:
-        """Assess the size of an object in bytes"""
+        """Assess the size of an object in bytes, including the data it references"""
+        if isinstance(obj, (pd.DataFrame, pd.Series, pd.Index)):
+            return int(np.sum(obj.memory_usage(deep=True)))
+        if isinstance(obj, np.ndarray):
+            if obj.dtype == object:
+                return obj.nbytes + sum(sys.getsizeof(value) for value in obj.ravel())
+            return obj.nbytes
+        if hasattr(obj, "nbytes"):
+            return int(obj.nbytes)
+        if isinstance(obj, dict):
+            return sys.getsizeof(obj) + sum(
+                self._get_object_size(key) + self._get_object_size(value) for key, value in obj.items()
+            )
+        if isinstance(obj, (list, tuple, set, frozenset)):
+            return sys.getsizeof(obj) + sum(self._get_object_size(value) for value in obj)
         return sys.getsizeof(obj)
     
     def _check_memory(self, size: int) -> bool:
@@ -26,62 +69,106 @@ class LargeDatasetCache:
         return (current_usage + size) <= self._max_memory
     
     def _free_memory(self, needed_size: int):
-        """Free memory by removing large objects from the cache"""
+        """Free memory by evicting the least recently used unpinned objects from the cache"""
         current_usage = sum(self._memory_usage.values())
-        if current_usage + needed_size > self._max_memory:
-            # sort files by size
-            sorted_files = sorted(
-                self._memory_usage.items(),
-                key=lambda x: x[1],
-                reverse=True
-            )
+        if current_usage + needed_size <= self._max_memory:
+            return
+        
+        # the cache is kept in access order, least recently used first
+        for filepath in [key for key in self._cache if key not in self._pinned]:
+            current_usage -= self._memory_usage.get(filepath, 0)
+            self._evict(filepath)
+            self._evictions += 1
+            self.logger.info(f"Evicted {filepath} from cache")
             
-            for filepath, size in sorted_files:
-                self._cache.pop(filepath, None)
-                self._memory_usage.pop(filepath, None)
-                current_usage -= size
-                
-                if current_usage + needed_size <= self._max_memory:
-                    break
+            if current_usage + needed_size <= self._max_memory:
+                break
+    
+    def _evict(self, filepath: str):
+        self._cache.pop(filepath, None)
+        self._memory_usage.pop(filepath, None)
+        self._expires_at.pop(filepath, None)
+        self._pinned.discard(filepath)
+    
+    def _is_expired(self, filepath: str) -> bool:
+        expires_at = self._expires_at.get(filepath)
+        return expires_at is not None and filepath not in self._pinned and time.monotonic() >= expires_at
+    
+    def _load_pickle(self, filepath: str) -> Any:
+        with open(filepath, 'rb') as f:
+            return pickle.load(f)
     
-    def get(self, filepath: str, default: Any = None) -> Optional[Any]:
+    def get(
+        self,
+        filepath: str,
+        default: Any = None,
+        loader: Optional[Callable[[str], Any]] = None,
+        ttl: Optional[float] = None,
+        pin: bool = False
+    ) -> Optional[Any]:
         """
         Load a dataset from cache or file.
+        
+        The loader runs without holding the cache lock, so lookups of other entries and
+        statistics are not held up by a long load. Threads asking for an entry being
+        loaded wait for that load instead of starting their own.
+        
+        Args:
+            filepath: Cache key, the path of the file to unpickle unless a loader is given
+            default: Default value to return in case of error
+            loader: Callable building the cached object from the key, unpickles the file by default
+            ttl: Time to live of the entry in seconds, the cache default if not given
+            pin: Never evict nor expire the entry, e.g. for the primary dataset
         """
         try:
-            path = Path(filepath)
-            if not path.exists():
+            if loader is None and not Path(filepath).exists():
                 return default
             
-            # if file is already in cache, return it
-            if filepath in self._cache:
-                return self._cache[filepath]
-            
-            # load file and check size
-            with open(filepath, 'rb') as f:
-                data = pickle.load(f)
-            
-            size = self._get_object_size(data)
-            
-            # if dataset is too large, don't cache it
-            if size > self._max_memory:
-                self.logger.warning(
-                    f"Dataset {filepath} is too large ({size} bytes) to cache. "
-                    f"Max memory limit is {self._max_memory} bytes"
-                )
-                return data
-            
-            # Zwolnij pamięć jeśli potrzeba
-            self._free_memory(size)
-            
-            # Dodaj do cache
-            self._cache[filepath] = data
-            self._memory_usage[filepath] = size
+            while True:
+                with self._lock:
+                    if filepath in self._cache and self._is_expired(filepath):
+                        self._evict(filepath)
+                        self._expirations += 1
+                        self.logger.info(f"Cache entry {filepath} expired")
+                    
+                    # if file is already in cache, return it
+                    if filepath in self._cache:
+                        self._hits += 1
+                        DATASET_CACHE_LOOKUPS.labels(result="hit").inc()
+                        self._cache.move_to_end(filepath)
+                        if pin:
+                            self._pinned.add(filepath)
+                        return self._cache[filepath]
+                    
+                    in_flight = self._loading.get(filepath)
+                    if in_flight is None:
+                        in_flight = self._loading[filepath] = _InFlightLoad()
+                        self._misses += 1
+                        DATASET_CACHE_LOOKUPS.labels(result="miss").inc()
+                        break
+                
+                # another thread loads it, without holding the lock
+                in_flight.done.wait()
+                if in_flight.failed:
+                    return default
+                if filepath not in self._cache:
+                    # too large to cache, or already evicted
+                    return in_flight.data
             
-            self.logger.info(
-                f"Cached {filepath}, size: {size} bytes, "
-                f"total cache usage: {sum(self._memory_usage.values())} bytes"
-            )
+            try:
+                # load file and check size, outside the lock so that lookups and stats are not held up
+                data = (loader or self._load_pickle)(filepath)
+                size = self._get_object_size(data)
+                in_flight.data = data
+            except BaseException:
+                in_flight.failed = True
+                raise
+            finally:
+                with self._lock:
+                    if not in_flight.failed:
+                        self.__store(filepath, data, size, ttl, pin)
+                    self._loading.pop(filepath, None)
+                in_flight.done.set()
             
             return data
             
@@ -89,23 +176,85 @@ class LargeDatasetCache:
             self.logger.error(f"Error loading dataset {filepath}: {e}")
             return default
     
+    def __store(self, filepath: str, data: Any, size: int, ttl: Optional[float], pin: bool):
+        # if dataset is too large, don't cache it
+        if size > self._max_memory:
+            self.logger.warning(
+                f"Dataset {filepath} is too large ({size} bytes) to cache. "
+                f"Max memory limit is {self._max_memory} bytes"
+            )
+            return
+        
+        # Zwolnij pamięć jeśli potrzeba
+        self._free_memory(size)
+        
+        # Dodaj do cache
+        self._cache[filepath] = data
+        self._memory_usage[filepath] = size
+        ttl = self._default_ttl if ttl is None else ttl
+        if ttl is not None:
+            self._expires_at[filepath] = time.monotonic() + ttl
+        if pin:
+            self._pinned.add(filepath)
+        
+        self.logger.info(
+            f"Cached {filepath}, size: {size} bytes, "
+            f"total cache usage: {sum(self._memory_usage.values())} bytes"
+        )
+    
+    def pin(self, filepath: str):
+        """Protect a cached entry from eviction and expiry"""
+        with self._lock:
+            if filepath in self._cache:
+                self._pinned.add(filepath)
+    
+    def unpin(self, filepath: str):
+        """Make a cached entry evictable again"""
+        with self._lock:
+            self._pinned.discard(filepath)
+    
     def clear(self):
         """Clear the cache"""
-        self._cache.clear()
-        self._memory_usage.clear()
+        with self._lock:
+            self._cache.clear()
+            self._memory_usage.clear()
+            self._expires_at.clear()
+            self._pinned.clear()
     
     def remove(self, filepath: str):
         """Remove a file from cache"""
-        self._cache.pop(filepath, None)
-        self._memory_usage.pop(filepath, None)
+        with self._lock:
+            self._evict(filepath)
     
     def get_stats(self) -> dict:
         """Get cache statistics"""
+        with self._lock:
+            total_usage = sum(self._memory_usage.values())
+            lookups = self._hits + self._misses
+            return {
+                'cached_files': len(self._cache),
+                'pinned_files': len(self._pinned),
+                'total_usage': total_usage,
+                'max_memory': self._max_memory,
+                'memory_percent': (total_usage / self._max_memory) * 100,
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': self._hits / lookups if lookups else 0.0,
+                'evictions': self._evictions,
+                'expirations': self._expirations,
+                'entries': {filepath: self._memory_usage[filepath] for filepath in self._cache},
+            }
+
+    def counters(self) -> dict:
+        """Get the hit, miss and eviction counters and the memory usage, without taking the lock"""
+        # copying the values is atomic, a load or eviction in progress never holds this up
+        total_usage = sum(list(self._memory_usage.values()))
+        lookups = self._hits + self._misses
         return {
             'cached_files': len(self._cache),
-            'total_usage': sum(self._memory_usage.values()),
-            'max_memory': self._max_memory,
-            'memory_percent': (sum(self._memory_usage.values()) / self._max_memory) * 100
+            'memory_percent': (total_usage / self._max_memory) * 100,
+            'hit_rate': self._hits / lookups if lookups else 0.0,
+            'evictions': self._evictions,
         }
 
 # Przykład użycia:
@@ -1,16 +1,66 @@
+import atexit
 import logging
+import os
+import queue
+import threading
 from logging import getLogger
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
 import colorlog
+from config import LOG_FORMAT, LOG_LEVEL
 
+COLORED_FORMAT = '%(log_color)s%(asctime)s [%(levelname)s] %(name)s: %(message)s%(reset)s'
+PLAIN_FORMAT = '%(asctime)s | %(levelname)-8s | %(name)s | %(message)s'
+DETAILED_FORMAT = '%(asctime)s | %(levelname)-8s | %(name)s:%(lineno)d | %(funcName)s | %(message)s'
+JSON_FORMAT = '%(asctime)s %(levelname)s %(name)s %(message)s'
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+class _DeferredQueueHandler(QueueHandler):
+    """
+    Queue handler leaving all formatting to the listener thread.
+
+    The default handler formats the whole record in the logging thread, so records
+    can be pickled to another process. The listener runs in this process, so the
+    logging thread only merges the message with its arguments, which may change or
+    be freed once the call returns, and leaves exceptions to the listener.
+    """
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+_queue_handler: Optional[QueueHandler] = None
+_stream_handler: Optional[logging.Handler] = None
+_listener: Optional[QueueListener] = None
+_setup_lock = threading.Lock()
 
-def setup_colored_logger(name):
-    logger = getLogger(name)
-    logger.setLevel(logging.INFO)
 
-    handler = colorlog.StreamHandler()
-    formatter = colorlog.ColoredFormatter(
-        '%(log_color)s%(asctime)s [%(levelname)s] %(name)s: %(message)s%(reset)s',
-        datefmt='%Y-%m-%d %H:%M:%S',
+def _resolve_level(name: str) -> Optional[int]:
+    """Level of a level name, None if logging does not know it"""
+    if hasattr(logging, "getLevelNamesMapping"):
+        return logging.getLevelNamesMapping().get(name)
+    # before Python 3.11, unknown names give a "Level ..." string
+    level = logging.getLevelName(name)
+    return level if isinstance(level, int) else None
+
+
+_level = _resolve_level(LOG_LEVEL)
+_level_warned = False
+
+
+def _create_formatter(log_format: str) -> logging.Formatter:
+    if log_format == "json":
+        from pythonjsonlogger import jsonlogger
+        return jsonlogger.JsonFormatter(JSON_FORMAT, datefmt=DATE_FORMAT, rename_fields={"asctime": "time", "levelname": "level", "name": "logger"})
+    if log_format == "plain":
+        return logging.Formatter(fmt=PLAIN_FORMAT, datefmt=DATE_FORMAT)
+    if log_format == "detailed":
+        return logging.Formatter(fmt=DETAILED_FORMAT, datefmt=DATE_FORMAT)
+    return colorlog.ColoredFormatter(
+        COLORED_FORMAT,
+        datefmt=DATE_FORMAT,
         log_colors={
             'DEBUG':    'cyan',
             'INFO':     'green',
@@ -19,32 +69,66 @@ def setup_colored_logger(name):
             'CRITICAL': 'red,bg_white',
         }
     )
-    handler.setFormatter(formatter)
-    logger.addHandler(handler)
-    return logger
 
-def setup_custom_logger(name):
-    logger = getLogger(name)
-    logger.setLevel(logging.INFO)
 
-    handler = logging.StreamHandler()
-    formatter = logging.Formatter(
-        fmt='%(asctime)s | %(levelname)-8s | %(name)s | %(message)s',
-        datefmt='%Y-%m-%d %H:%M:%S'
-    )
-    handler.setFormatter(formatter)
-    logger.addHandler(handler)
-    return logger
+def _get_queue_handler() -> QueueHandler:
+    """The handler shared by all loggers, started with its listener thread on first use."""
+    global _queue_handler, _stream_handler
+    with _setup_lock:
+        if _queue_handler is None:
+            _stream_handler = colorlog.StreamHandler() if LOG_FORMAT == "color" else logging.StreamHandler()
+            _stream_handler.setFormatter(_create_formatter(LOG_FORMAT))
+            _queue_handler = _DeferredQueueHandler(queue.SimpleQueue())
+            _start_listener()
+            atexit.register(stop_logging)
+        return _queue_handler
+
+
+def _start_listener() -> None:
+    global _listener
+    _listener = QueueListener(_queue_handler.queue, _stream_handler, respect_handler_level=True)
+    _listener.start()
+
+
+def _restart_after_fork() -> None:
+    """The listener thread does not survive a fork, give the child process its own queue and listener."""
+    global _setup_lock
+    _setup_lock = threading.Lock()
+    if _queue_handler is not None and _listener is not None:
+        _queue_handler.queue = queue.SimpleQueue()
+        _start_listener()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_restart_after_fork)
 
-def setup_detailed_logger(name):
+
+def stop_logging() -> None:
+    """Write the queued records and stop the listener thread."""
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+def setup_colored_logger(name):
+    """
+    Get a logger writing through the shared queue handler.
+
+    Records are formatted and written by a listener thread, so logging does not
+    block the caller on the stream. The level comes from LOG_LEVEL, INFO if it is
+    not a level name, and the output format from LOG_FORMAT. Calling it again for
+    the same name adds no handler.
+    """
+    global _level_warned
     logger = getLogger(name)
-    logger.setLevel(logging.INFO)
+    logger.setLevel(logging.INFO if _level is None else _level)
 
-    handler = logging.StreamHandler()
-    formatter = logging.Formatter(
-        fmt='%(asctime)s | %(levelname)-8s | %(name)s:%(lineno)d | %(funcName)s | %(message)s',
-        datefmt='%Y-%m-%d %H:%M:%S'
-    )
-    handler.setFormatter(formatter)
-    logger.addHandler(handler)
-    return logger
\ No newline at end of file
+    handler = _get_queue_handler()
+    if handler not in logger.handlers:
+        logger.addHandler(handler)
+    if _level is None and not _level_warned:
+        _level_warned = True
+        logger.warning(f"Unknown LOG_LEVEL {LOG_LEVEL!r}, logging at INFO")
+    return logger
@@ -0,0 +1,121 @@
+from pathlib import Path
+from typing import Dict, Optional, Tuple, Union
+import hashlib
+import json
+import numpy as np
+import pandas as pd
+from .code_index import ProductCodeIndex
+from .neighbor_index import NeighborIndex
+from .logger import setup_colored_logger
+
+logger = setup_colored_logger(__name__)
+
+
+def snapshot_fingerprint(dataset: pd.DataFrame, code_index: ProductCodeIndex, neighbor_index: NeighborIndex) -> str:
+    """
+    Hash of what the recommendations of neutral requests depend on.
+
+    Covers the product codes, the similarity graph and every numeric column of the
+    dataset, which holds the scores, the rating ordinals and the factor presence
+    columns the ranking reads. Text columns only count through the columns derived
+    from them, e.g. a changed allergen changes a presence column.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update("\n".join(code_index.codes).encode("utf-8"))
+    neighbor_index.update_digest(digest)
+    for name in dataset.columns:
+        values = dataset[name]
+        if isinstance(values.dtype, np.dtype) and values.dtype.kind in "biuf":
+            digest.update(str(name).encode("utf-8"))
+            digest.update(np.ascontiguousarray(values.to_numpy()).view(np.uint8))
+    return digest.hexdigest()
+
+
+class MaterializedRecommendations:
+    """
+    Precomputed recommendations of every product for requests without preferences.
+
+    For every product the table keeps its `top_n` best recommendations, best first,
+    and whether these are all the products it can be recommended. Recommendations
+    for a limit m <= top_n are the first m stored ones. Rows are stored compressed
+    like the neighbor index: the recommendations of row `i` are
+    `rows[indptr[i]:indptr[i + 1]]`.
+
+    Attributes:
+        top_n: Number of recommendations kept per product
+        settings: Engine settings the table was computed with
+        fingerprint: Fingerprint of the snapshot the table was computed on
+    """
+    def __init__(self, indptr: np.ndarray, rows: np.ndarray, complete: np.ndarray, top_n: int, settings: Dict, fingerprint: str) -> None:
+        self._indptr = indptr
+        self._rows = rows
+        self._complete = complete
+        self.top_n = top_n
+        self.settings = settings
+        self.fingerprint = fingerprint
+
+    @classmethod
+    def load(cls, filepath: Union[str, Path]) -> "MaterializedRecommendations":
+        with np.load(filepath, allow_pickle=False) as table:
+            meta = json.loads(str(table["meta"]))
+            return cls(
+                indptr=table["indptr"],
+                rows=table["rows"],
+                complete=table["complete"],
+                top_n=meta["top_n"],
+                settings=meta["settings"],
+                fingerprint=meta["fingerprint"],
+            )
+
+    @classmethod
+    def load_for(cls, filepath: Union[str, Path], dataset: pd.DataFrame, code_index: ProductCodeIndex, neighbor_index: NeighborIndex) -> Optional["MaterializedRecommendations"]:
+        """
+        Load a table if it was computed on the given dataset and similarities, see `snapshot_fingerprint`.
+
+        Returns:
+            The table, or None if it is missing, unreadable or computed on other data
+        """
+        if not Path(filepath).exists():
+            return None
+        try:
+            table = cls.load(filepath)
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Ignoring unreadable materialized recommendations {filepath}: {e}")
+            return None
+        if table.fingerprint != snapshot_fingerprint(dataset, code_index, neighbor_index) or len(table) != len(code_index.codes):
+            logger.warning(f"Ignoring materialized recommendations {filepath}, computed on another dataset or similarities")
+            return None
+        logger.info(f"Loaded materialized top {table.top_n} recommendations of {len(table)} products")
+        return table
+
+    def save(self, filepath: Union[str, Path]) -> None:
+        filepath = Path(filepath)
+        meta = json.dumps({"top_n": self.top_n, "settings": self.settings, "fingerprint": self.fingerprint})
+        # np.savez adds .npz to names without it, write the temporary file under a name ending in it
+        temp_path = filepath.with_name(f"{filepath.stem}.tmp.npz")
+        np.savez(
+            temp_path,
+            indptr=self._indptr,
+            rows=self._rows,
+            complete=self._complete,
+            meta=np.array(meta),
+        )
+        temp_path.replace(filepath)
+
+    def recommendations(self, row: int) -> Tuple[np.ndarray, bool]:
+        """
+        Recommendations of a product for requests without preferences.
+
+        Returns:
+            Tuple[np.ndarray, bool]: Row IDs of the recommendations best first,
+                and whether these are all the products it can be recommended
+        """
+        start, end = self._indptr[row], self._indptr[row + 1]
+        return self._rows[start:end], bool(self._complete[row])
+
+    @property
+    def nbytes(self) -> int:
+        return self._indptr.nbytes + self._rows.nbytes + self._complete.nbytes
+
+    def __len__(self) -> int:
+        return len(self._indptr) - 1
@@ -0,0 +1,63 @@
+"""
+Prometheus metrics of the recommendation pipeline, exposed on /metrics.
+
+Stages of a recommendation, in order:
+    source_lookup: Finding the source product in the dataset
+    materialized_lookup: Answering from the materialized recommendations, when they can
+    neighbors: Getting the most similar products of the source
+    avoid_factors: Excluding products with avoided factors
+    evaluation: Scoring the remaining products
+    rating_filter: Keeping the best products rated better than the source
+    candidate_walk: Walking score-ordered candidates with both exclusions inline, instead of
+        avoid_factors, evaluation and rating_filter when a candidate index is available
+    response_building: Building the recommended products of the response
+"""
+from prometheus_client import Counter, Gauge, Histogram
+
+STAGE_SOURCE_LOOKUP = "source_lookup"
+STAGE_MATERIALIZED_LOOKUP = "materialized_lookup"
+STAGE_NEIGHBORS = "neighbors"
+STAGE_AVOID_FACTORS = "avoid_factors"
+STAGE_EVALUATION = "evaluation"
+STAGE_RATING_FILTER = "rating_filter"
+STAGE_CANDIDATE_WALK = "candidate_walk"
+STAGE_RESPONSE_BUILDING = "response_building"
+
+STAGE_DURATION = Histogram(
+    "recommendation_stage_duration_seconds",
+    "Time spent in each stage of a recommendation",
+    ["stage"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+
+STAGE_CANDIDATES = Gauge(
+    "recommendation_stage_candidates",
+    "Number of candidate products left after each stage of the latest recommendation",
+    ["stage"],
+)
+
+DATASET_CACHE_LOOKUPS = Counter(
+    "dataset_cache_lookups_total",
+    "Lookups of dataset artifacts in the large dataset cache",
+    ["result"],
+)
+
+MATERIALIZED_LOOKUPS = Counter(
+    "recommendation_materialized_lookups_total",
+    "Recommendations answered from the materialized table (hit), re-ranked from it (rerank) or computed live (miss)",
+    ["result"],
+)
+
+EVALUATION_FAILURES = Counter(
+    "recommendation_evaluation_failures_total",
+    "Candidate products that could not be evaluated",
+)
+
+
+def time_stage(stage: str):
+    """Context manager observing the duration of a stage."""
+    return STAGE_DURATION.labels(stage=stage).time()
+
+
+def set_candidates(stage: str, count: int) -> None:
+    STAGE_CANDIDATES.labels(stage=stage).set(count)
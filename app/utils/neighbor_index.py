@@ -0,0 +1,170 @@
+from pathlib import Path
+from typing import Dict, Optional, Tuple, Union
+import numpy as np
+import pandas as pd
+from .code_index import ProductCodeIndex
+from .logger import setup_colored_logger
+
+logger = setup_colored_logger(__name__)
+
+
+def similarities_delta_path(similarities_path: Union[str, Path]) -> Path:
+    """Path of the incremental delta of a similarities file, e.g. similarities_delta.csv."""
+    similarities_path = Path(similarities_path)
+    return similarities_path.with_name(f"{similarities_path.stem}_delta{similarities_path.suffix}")
+
+
+class NeighborIndex:
+    """
+    In-memory product similarity graph.
+
+    Neighbors of every product are stored in a CSR-like layout: for the product at
+    row `i` of the dataset, its neighbors live in `neighbors[indptr[i]:indptr[i + 1]]`
+    (as positional row IDs of the dataset) with matching scores in `similarities`,
+    sorted by descending similarity.
+
+    The similarities file only stores each pair once, so the graph is symmetrized
+    on build: a pair (a, b) makes `b` a neighbor of `a` and `a` a neighbor of `b`.
+
+    An incremental delta replaces whole neighbor lists of the similarities file:
+    every `product1` of the delta drops its rows of the similarities file. A delta
+    row without `product2` only marks its `product1` as replaced, e.g. by an empty list.
+    """
+    def __init__(self, indptr: np.ndarray, neighbors: np.ndarray, similarities: np.ndarray) -> None:
+        self._indptr = indptr
+        self._neighbors = neighbors
+        self._similarities = similarities
+
+    @classmethod
+    def from_csv(cls, filepath: Union[str, Path], code_index: ProductCodeIndex, delta_filepath: Optional[Union[str, Path]] = None) -> "NeighborIndex":
+        """
+        Build the index from a similarities file with `product1`, `product2` and `similarity` columns.
+
+        Args:
+            filepath: Path to the similarities CSV file
+            code_index: Code index of the dataset the neighbor row IDs refer to
+            delta_filepath: Path to an incremental delta of the similarities file, if any
+        """
+        dtype = {"product1": str, "product2": str, "similarity": np.float32}
+        similarities = pd.read_csv(filepath, dtype=dtype)
+        if delta_filepath is not None and Path(delta_filepath).exists():
+            delta = pd.read_csv(delta_filepath, dtype=dtype)
+            logger.info(f"Merging {delta['product1'].nunique()} neighbor lists from {delta_filepath}")
+            similarities = cls.merge_delta(similarities, delta, code_index)
+        return cls.from_frame(similarities, code_index)
+
+    @staticmethod
+    def merge_delta(similarities: pd.DataFrame, delta: pd.DataFrame, code_index: ProductCodeIndex) -> pd.DataFrame:
+        """
+        Replace the neighbor lists of the similarities with the ones of a delta.
+
+        Returns:
+            pd.DataFrame: Rows of `similarities` whose `product1` is not in the delta, followed by the delta rows
+        """
+        replaced = np.unique(code_index.rows_of(delta["product1"]))
+        kept = ~np.isin(code_index.rows_of(similarities["product1"]), replaced[replaced >= 0])
+        return pd.concat([similarities[kept], delta], ignore_index=True)
+
+    @classmethod
+    def from_frame(cls, similarities: pd.DataFrame, code_index: ProductCodeIndex) -> "NeighborIndex":
+        """
+        Build the index from a similarities DataFrame.
+
+        Args:
+            similarities: DataFrame with `product1`, `product2` and `similarity` columns
+            code_index: Code index of the dataset the neighbor row IDs refer to
+
+        Returns:
+            NeighborIndex: Index with neighbors of every product sorted by descending similarity
+        """
+        product1 = code_index.rows_of(similarities["product1"])
+        product2 = code_index.rows_of(similarities["product2"])
+        scores = similarities["similarity"].to_numpy(dtype=np.float32)
+
+        known = (product1 >= 0) & (product2 >= 0) & (product1 != product2)
+        product1, product2, scores = product1[known], product2[known], scores[known]
+
+        edges = pd.DataFrame({
+            "source": np.concatenate([product1, product2]),
+            "target": np.concatenate([product2, product1]),
+            "similarity": np.concatenate([scores, scores]),
+        })
+        edges = (edges
+                    .sort_values(["source", "similarity", "target"], ascending=[True, False, True])
+                    .drop_duplicates(subset=["source", "target"], keep="first"))
+
+        indptr = np.zeros(len(code_index.codes) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(edges["source"].to_numpy(), minlength=len(code_index.codes)), out=indptr[1:])
+
+        logger.info(f"Built neighbor index with {len(edges)} edges")
+
+        return cls(
+            indptr=indptr,
+            neighbors=edges["target"].to_numpy(),
+            similarities=edges["similarity"].to_numpy(dtype=np.float32),
+        )
+
+    def neighbors(self, row: int, min_similarity: Optional[float] = None, top_k: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Get neighbors of a product.
+
+        Args:
+            row: Row ID of the product
+            min_similarity: Only return neighbors with at least this similarity
+            top_k: Only return the `top_k` most similar neighbors
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Neighbor row IDs and their similarities, most similar first
+        """
+        start, end = self._indptr[row], self._indptr[row + 1]
+        if min_similarity is not None:
+            end = start + np.searchsorted(-self._similarities[start:end], -np.float32(min_similarity), side="right")
+        if top_k is not None:
+            end = min(end, start + top_k)
+        return self._neighbors[start:end], self._similarities[start:end]
+
+    def edges(self, min_similarity: Optional[float] = None, top_k: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Get the (product, neighbor) pairs `neighbors` returns for every product.
+
+        Args:
+            min_similarity: Only return neighbors with at least this similarity
+            top_k: Only return the `top_k` most similar neighbors of each product
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Product and neighbor row IDs, grouped by product
+        """
+        counts = np.diff(self._indptr)
+        sources = np.repeat(np.arange(len(counts)), counts)
+        kept = np.ones(len(self._neighbors), dtype=bool)
+        if min_similarity is not None:
+            kept &= self._similarities >= np.float32(min_similarity)
+        if top_k is not None:
+            kept &= np.arange(len(self._neighbors)) - self._indptr[sources] < top_k
+        return sources[kept], self._neighbors[kept]
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        """Arrays of the index, which `from_arrays` builds it back from."""
+        return {"indptr": self._indptr, "neighbors": self._neighbors, "similarities": self._similarities}
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray]) -> "NeighborIndex":
+        return cls(arrays["indptr"], arrays["neighbors"], arrays["similarities"])
+
+    def update_digest(self, digest) -> None:
+        """Feed the index arrays to a hashlib digest."""
+        for array in (self._indptr, self._neighbors, self._similarities):
+            digest.update(np.ascontiguousarray(array).view(np.uint8))
+
+    @property
+    def edge_count(self) -> int:
+        """Number of (product, neighbor) entries, each similar pair counts twice."""
+        return len(self._neighbors)
+
+    @property
+    def nbytes(self) -> int:
+        """Memory used by the index arrays."""
+        return self._indptr.nbytes + self._neighbors.nbytes + self._similarities.nbytes
+
+    def __len__(self) -> int:
+        return len(self._indptr) - 1
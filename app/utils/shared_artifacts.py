@@ -0,0 +1,125 @@
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, Optional, Union
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import numpy as np
+from .logger import setup_colored_logger
+
+logger = setup_colored_logger(__name__)
+
+
+def file_signature(path: Union[str, Path]) -> Optional[list]:
+    """Path, modification time and size of a file, None if it does not exist"""
+    try:
+        stat = Path(path).stat()
+    except FileNotFoundError:
+        return None
+    return [str(path), stat.st_mtime_ns, stat.st_size]
+
+
+def save_arrays(path: Union[str, Path], arrays: Dict[str, np.ndarray]) -> None:
+    """Write every array to a .npy file named after its key"""
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    for name, array in arrays.items():
+        np.save(path / f"{name}.npy", np.ascontiguousarray(array))
+
+
+def load_arrays(path: Union[str, Path]) -> Dict[str, np.ndarray]:
+    """Memory-map the arrays written by `save_arrays`, read-only"""
+    return {file.name[:-len(".npy")]: np.load(file, mmap_mode="r") for file in Path(path).glob("*.npy")}
+
+
+class SharedArtifactStore:
+    """
+    Artifacts built once and shared by every worker process through memory-mapped files.
+
+    Meant for a directory on a tmpfs such as /dev/shm. The first process needing an
+    artifact builds it into the directory while holding a file lock, processes asking
+    for it meanwhile wait for the lock and then memory-map what was written. Memory-
+    mapped pages are shared by all processes, so adding workers does not add copies
+    of them.
+
+    Only arrays of fixed width can be shared that way: the numeric and boolean columns
+    of the dataset, the codes of its categorical columns and the arrays of the neighbor
+    and candidate indexes. Text columns (product codes, names, image URLs) and the
+    categories of categorical columns are decoded from their shared files into objects
+    of every process, as is the code-to-row dict of ProductCodeIndex.
+
+    An artifact lives in a directory named after its name and a key derived from
+    everything it was built from, a changed source gets a new directory. Directories
+    are only renamed into place once complete.
+    """
+    def __init__(self, root: Union[str, Path]) -> None:
+        self.root = Path(root)
+
+    @staticmethod
+    def key(*parts) -> str:
+        """Key of an artifact built from JSON-serializable parts"""
+        return hashlib.blake2b(json.dumps(parts, sort_keys=True).encode("utf-8"), digest_size=12).hexdigest()
+
+    def get_or_build(self, name: str, key: str, write: Callable[[Path], None]) -> Path:
+        """
+        Get the directory of an artifact, building it if no process did yet.
+
+        Args:
+            name: Name of the artifact
+            key: Key of the sources of the artifact, see `key`
+            write: Callable writing the artifact into the directory it is given
+
+        Returns:
+            Path: Directory of the complete artifact
+        """
+        path = self.root / f"{name}-{key}"
+        if path.exists():
+            return path
+
+        self.root.mkdir(parents=True, exist_ok=True)
+        with self.__lock(path):
+            if path.exists():
+                logger.info(f"Attaching {name} built by another worker")
+                return path
+            temp_path = self.root / f".{path.name}.{os.getpid()}.tmp"
+            shutil.rmtree(temp_path, ignore_errors=True)
+            try:
+                write(temp_path)
+                temp_path.rename(path)
+            except BaseException:
+                shutil.rmtree(temp_path, ignore_errors=True)
+                raise
+        logger.info(f"Built shared {name} in {path}")
+        return path
+
+    def prune(self, keep: Iterable[Path]) -> None:
+        """Remove artifacts other than `keep`, processes having them mapped keep their pages until they unmap them"""
+        if not self.root.exists():
+            return
+        keep = {Path(path).name for path in keep}
+        for path in self.root.iterdir():
+            if path.name.startswith(".") or path.suffix == ".lock" or path.name in keep:
+                continue
+            with self.__lock(path, blocking=False) as locked:
+                if locked:
+                    # the empty lock file stays, a process waiting on it must keep excluding others
+                    shutil.rmtree(path, ignore_errors=True)
+                    logger.info(f"Removed stale shared artifact {path.name}")
+
+    def __lock_path(self, path: Path) -> Path:
+        return self.root / f"{path.name}.lock"
+
+    @contextmanager
+    def __lock(self, path: Path, blocking: bool = True) -> Iterator[bool]:
+        with open(self.__lock_path(path), "a") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
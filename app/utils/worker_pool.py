@@ -0,0 +1,80 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+from .logger import setup_colored_logger
+
+logger = setup_colored_logger(__name__)
+
+
+class WorkerPoolBusyError(Exception):
+    """Raised when a task waited longer than the queue timeout for a free worker."""
+
+
+class WorkerPool:
+    """
+    Bounded pool of threads running CPU-bound work off the event loop.
+
+    At most `max_workers` tasks run at a time, the others wait for a free worker
+    for at most `queue_timeout` seconds. NumPy and pandas release the GIL in
+    their heavy loops, so threads share one copy of the dataset and still use
+    several cores.
+
+    Attributes:
+        max_workers: Number of tasks running at the same time
+        queue_timeout: Seconds a task may wait for a free worker, None to wait forever
+    """
+    def __init__(self, max_workers: int = 4, queue_timeout: Optional[float] = 10.0) -> None:
+        if max_workers < 1:
+            raise ValueError("max_workers must be at least 1")
+        self.max_workers = max_workers
+        self.queue_timeout = queue_timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="recommendation-worker")
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._running = 0
+        self._waiting = 0
+        self._rejected = 0
+
+    async def run(self, func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """
+        Run a function in the pool and wait for its result.
+
+        Raises:
+            WorkerPoolBusyError: If no worker got free within the queue timeout
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_workers)
+
+        self._waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._rejected += 1
+            logger.warning(f"No free worker within {self.queue_timeout} seconds, {self._waiting} tasks waiting")
+            raise WorkerPoolBusyError(f"No free worker within {self.queue_timeout} seconds")
+        finally:
+            self._waiting -= 1
+
+        self._running += 1
+        loop = asyncio.get_running_loop()
+        future = self._executor.submit(functools.partial(func, *args, **kwargs))
+        # free the worker slot when the thread is done, even if the awaiting request was cancelled
+        future.add_done_callback(lambda _: loop.call_soon_threadsafe(self.__release))
+        return await asyncio.wrap_future(future)
+
+    def __release(self) -> None:
+        self._running -= 1
+        self._semaphore.release()
+
+    def get_stats(self) -> dict:
+        """Get pool statistics"""
+        return {
+            "max_workers": self.max_workers,
+            "queue_timeout": self.queue_timeout,
+            "running": self._running,
+            "waiting": self._waiting,
+            "rejected": self._rejected,
+        }
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,71 @@
+import sys
+import time
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import pytest
+
+# modules of the app import each other from the app directory, like the server does
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "app"))
+
+from benchmarks.synthetic import generate_dataset, generate_similarities
+from services.recommendation.engine import RecommendationEngine
+from services.recommendation.enrichment import DatasetEnricher
+from utils.code_index import ProductCodeIndex
+from utils.dataset_snapshot import DatasetSnapshot
+from utils.neighbor_index import NeighborIndex
+
+N_PRODUCTS = 400
+
+
+@pytest.fixture(scope="session")
+def raw_dataset() -> pd.DataFrame:
+    """Synthetic products, a fifth of them without nutriscore score nor grade"""
+    dataset = generate_dataset(N_PRODUCTS, seed=1)
+    missing = np.random.default_rng(1).random(N_PRODUCTS) < 0.2
+    dataset.loc[missing, "nutriscore_score"] = np.nan
+    dataset.loc[missing, "nutriscore_grade"] = None
+    return dataset
+
+
+@pytest.fixture(scope="session")
+def similarities(raw_dataset: pd.DataFrame) -> pd.DataFrame:
+    return generate_similarities(raw_dataset, neighbors=20, seed=1)
+
+
+class SnapshotManager:
+    """Dataset manager serving a fixed snapshot"""
+    def __init__(self, snapshot: DatasetSnapshot) -> None:
+        self.snapshot = snapshot
+
+    def get_snapshot(self, default=None):
+        return self.snapshot
+
+
+@pytest.fixture(scope="session")
+def engine() -> RecommendationEngine:
+    return RecommendationEngine()
+
+
+@pytest.fixture(scope="session")
+def snapshot(raw_dataset: pd.DataFrame, similarities: pd.DataFrame, engine: RecommendationEngine) -> DatasetSnapshot:
+    dataset = DatasetEnricher().enrich(raw_dataset.copy())
+    code_index = ProductCodeIndex.from_dataset(dataset)
+    neighbor_index = NeighborIndex.from_frame(similarities, code_index)
+    return DatasetSnapshot(
+        version=1,
+        dataset=dataset,
+        code_index=code_index,
+        neighbor_index=neighbor_index,
+        loaded_at=time.time(),
+        candidate_index=engine.build_candidate_index(dataset, code_index, neighbor_index),
+    )
+
+
+@pytest.fixture
+def data_dir(tmp_path: Path, monkeypatch: pytest.MonkeyPatch, raw_dataset: pd.DataFrame, similarities: pd.DataFrame) -> Path:
+    """Data directory of the dataset managers created in a test, with the dataset and similarities files"""
+    raw_dataset.to_pickle(tmp_path / "openfoodfacts_sample.pkl")
+    similarities.to_csv(tmp_path / "similarities.csv", index=False)
+    monkeypatch.setattr("utils.dataset_manager.DATA_DIR", tmp_path)
+    return tmp_path
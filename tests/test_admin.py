@@ -0,0 +1,31 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from api.v1.routes import admin
+from dependencies import get_dataset_manager
+
+
+class StatusManager:
+    def reload_status(self) -> dict:
+        return {"snapshot": None, "reloading": False}
+
+
+@pytest.fixture
+def client() -> TestClient:
+    app = FastAPI()
+    app.include_router(admin.router)
+    app.dependency_overrides[get_dataset_manager] = StatusManager
+    return TestClient(app)
+
+
+def test_admin_endpoints_are_disabled_without_a_token(client, monkeypatch):
+    monkeypatch.setattr(admin, "ADMIN_TOKEN", None)
+    assert client.get("/admin/dataset").status_code == 503
+    assert client.get("/admin/dataset", headers={"X-Admin-Token": ""}).status_code == 503
+
+
+def test_admin_endpoints_require_the_token(client, monkeypatch):
+    monkeypatch.setattr(admin, "ADMIN_TOKEN", "secret")
+    assert client.get("/admin/dataset").status_code == 403
+    assert client.get("/admin/dataset", headers={"X-Admin-Token": "wrong"}).status_code == 403
+    assert client.get("/admin/dataset", headers={"X-Admin-Token": "secret"}).status_code == 200
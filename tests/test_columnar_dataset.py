@@ -0,0 +1,41 @@
+import pandas as pd
+from models.domain.off_product import normalize_product_code
+from services.recommendation.enrichment import DatasetEnricher
+from services.text_processing.similarity_builder import load_categories
+from utils.columnar_dataset import ColumnarDataset
+from utils.dataset_manager import DatasetManager
+
+
+def test_round_trip_keeps_values_and_dtypes(tmp_path, snapshot):
+    written = snapshot.dataset.reset_index(drop=True)
+    ColumnarDataset.write(written, tmp_path / "dataset.columns")
+    columnar = ColumnarDataset(tmp_path / "dataset.columns")
+    columnar.verify()
+    # the loaded columns are memory maps, compared on copies
+    pd.testing.assert_frame_equal(columnar.to_frame().copy(), written)
+
+
+def test_round_trip_of_raw_text_columns(tmp_path, raw_dataset):
+    ColumnarDataset.write(raw_dataset, tmp_path / "dataset.columns")
+    loaded = ColumnarDataset(tmp_path / "dataset.columns").to_frame()
+    for name in ("code", "product_name", "labels_tags", "nutriscore_grade"):
+        expected = raw_dataset[name].to_numpy(dtype=object)
+        actual = loaded[name].to_numpy(dtype=object)
+        assert ((actual == expected) | (pd.isna(actual) & pd.isna(expected))).all(), name
+
+
+def test_manager_loads_serving_columns_only(data_dir, raw_dataset):
+    ColumnarDataset.write(raw_dataset, data_dir / "openfoodfacts_sample.columns")
+    enricher = DatasetEnricher()
+    manager = DatasetManager("openfoodfacts_sample.pkl", enrich=enricher.enrich, columns=enricher.serving_columns)
+    dataset = manager.get_dataset()
+    assert "countries_tags" not in dataset.columns
+    assert set(dataset.columns) <= set(enricher.serving_columns)
+    assert list(manager.get_code_index().codes) == [normalize_product_code(code) for code in raw_dataset["code"]]
+
+
+def test_categories_of_a_compacted_dataset_keep_their_codes(tmp_path, raw_dataset):
+    ColumnarDataset.write(DatasetEnricher().enrich(raw_dataset.copy()), tmp_path / "dataset.columns")
+    products = load_categories(tmp_path / "dataset.columns")
+    assert list(products["code"]) == [normalize_product_code(code) for code in raw_dataset["code"]]
+    assert list(products["categories"]) == list(raw_dataset["categories_en"])
@@ -0,0 +1,75 @@
+import threading
+import time
+import pytest
+from utils.checksums import CHECKSUMS_FILE_NAME, ChecksumManifest
+from utils.dataset_manager import DatasetManager
+
+
+def test_health_check_does_not_wait_for_the_load(data_dir):
+    release = threading.Event()
+
+    def slow_enrich(dataset):
+        release.wait(10)
+        return dataset
+
+    manager = DatasetManager("openfoodfacts_sample.pkl", enrich=slow_enrich)
+    loading = manager.start_initialization()
+    try:
+        start = time.perf_counter()
+        health = manager.health_check()
+        assert time.perf_counter() - start < 0.5
+        assert health["status"] == "unhealthy"
+        assert health["details"]["dataset_state"] == "loading"
+        assert manager.get_snapshot() is None
+    finally:
+        release.set()
+        loading.join()
+    assert manager.health_check()["status"] == "healthy"
+    assert manager.readiness()["ready"]
+
+
+def test_reload_asked_for_during_a_reload_runs_after_it(data_dir):
+    entered, release = threading.Event(), threading.Event()
+
+    def enrich(dataset):
+        entered.set()
+        release.wait(10)
+        return dataset
+
+    manager = DatasetManager("openfoodfacts_sample.pkl")
+    manager.initialize_dataset()
+    manager.enrich = enrich
+    assert manager.reload()
+    assert entered.wait(10)
+    assert not manager.reload()
+    assert manager.reload_status()["reload_pending"]
+    release.set()
+
+    deadline = time.monotonic() + 10
+    while manager.reload_status()["reloading"] and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert manager.reload_status()["snapshot"]["version"] == 3
+    assert not manager.reload_status()["reload_pending"]
+
+
+def test_checksums_of_the_data_files_are_verified(data_dir):
+    ChecksumManifest(data_dir / CHECKSUMS_FILE_NAME).update([data_dir / "openfoodfacts_sample.pkl", data_dir / "similarities.csv"])
+    manager = DatasetManager("openfoodfacts_sample.pkl")
+    manager.initialize_dataset()
+    assert manager.readiness()["ready"]
+
+
+@pytest.mark.parametrize("file_name", ["openfoodfacts_sample.pkl", "similarities.csv"])
+def test_file_not_matching_its_checksum_is_rejected(data_dir, file_name, caplog):
+    ChecksumManifest(data_dir / CHECKSUMS_FILE_NAME).update([data_dir / "openfoodfacts_sample.pkl", data_dir / "similarities.csv"])
+    with open(data_dir / file_name, "ab") as f:
+        f.write(b"\n")
+
+    manager = DatasetManager("openfoodfacts_sample.pkl")
+    with pytest.raises(RuntimeError, match="Failed to"):
+        manager.initialize_dataset()
+    assert f"Checksum mismatch for {data_dir / file_name}" in caplog.text
+    readiness = manager.readiness()
+    assert readiness["status"] == "failed"
+    assert not readiness["ready"]
+    assert manager.get_snapshot() is None
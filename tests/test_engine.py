@@ -0,0 +1,115 @@
+from typing import List, Optional
+import pandas as pd
+import numpy as np
+import pytest
+from models.domain.off_product import OpenFoodFactsProduct
+from models.schemas.product_recommendation import UserPreference
+from utils.neighbor_index import NeighborIndex
+from services.recommendation.engine import RecommendationEngine
+from services.recommendation.factors.categories.categories_comparator import CategoriesComparator
+from services.text_processing.embedding_comparator import EmbeddingCategoriesComparator
+from services.recommendation.factors.recommendation_factor import FactorPreferenceStatus
+
+# the synthetic similarities are drawn between 0.9 and 1, about half of them are under it
+SIMILARITY_THRESHOLD = 0.95
+
+PREFERENCE_SETS = [
+    None,
+    [UserPreference(name="milk", status=FactorPreferenceStatus.AVOID)],
+    [UserPreference(name="organic", status=FactorPreferenceStatus.RECOMMEND)],
+    [UserPreference(name="nuts", status=FactorPreferenceStatus.AVOID), UserPreference(name="vegetarian", status=FactorPreferenceStatus.RECOMMEND)],
+    [UserPreference(name="organic", status=FactorPreferenceStatus.RECOMMEND), UserPreference(name="eggs", status=FactorPreferenceStatus.AVOID)],
+]
+
+
+@pytest.fixture(scope="module")
+def threshold_engine() -> RecommendationEngine:
+    return RecommendationEngine(categories_similarity_threshold=SIMILARITY_THRESHOLD)
+
+
+@pytest.fixture(scope="module")
+def candidate_index(threshold_engine, snapshot):
+    return threshold_engine.build_candidate_index(snapshot.dataset, snapshot.code_index, snapshot.neighbor_index)
+
+
+def brute_force_recommendations(engine, snapshot, row: int, user_preferences: Optional[List[UserPreference]], n: int) -> List[str]:
+    """Neighbors of a better grade, without avoided factors, by score with bonus then by code"""
+    dataset = snapshot.dataset
+    factors = {factor.name: factor for factor in engine.recommendation_strategy.recommendation_factors}
+    grades = dataset[engine.recommendation_strategy.nutritional_rating_system.rating_ordinal_column].to_numpy()
+    rows, _ = snapshot.neighbor_index.neighbors(row, min_similarity=engine.categories_similarity_threshold)
+    neighbors = dataset.iloc[rows]
+    allowed = grades[rows] > grades[row]
+    scores = dataset["nutriscore_score"].to_numpy(dtype=float)[rows]
+    for preference in user_preferences or []:
+        present = factors[preference.name].presence_mask(neighbors)
+        if preference.status == FactorPreferenceStatus.AVOID:
+            allowed &= ~present
+        else:
+            scores = scores - engine.evaluator.bonus * present
+    allowed &= ~np.isnan(scores)
+    codes = snapshot.code_index.codes[rows[allowed]]
+    return [code for _, code in sorted(zip(scores[allowed], codes))[:n]]
+
+
+@pytest.mark.parametrize("user_preferences", PREFERENCE_SETS)
+@pytest.mark.parametrize("use_candidate_index", [True, False])
+def test_ranking_matches_brute_force(threshold_engine, candidate_index, snapshot, user_preferences, use_candidate_index):
+    engine = threshold_engine
+    candidate_index = candidate_index if use_candidate_index else None
+    preferences = engine.recommendation_strategy.preferences_from(user_preferences)
+    recommended_products = 0
+    for row in range(0, len(snapshot.code_index), 4):
+        code = snapshot.code_index.code_at(row)
+        product = OpenFoodFactsProduct(code, snapshot.dataset.iloc[row])
+        for n in (1, 5, 12):
+            expected = brute_force_recommendations(engine, snapshot, row, user_preferences, n)
+            recommended = engine.find_recommendations(snapshot.dataset, product, snapshot.code_index, snapshot.neighbor_index, n, preferences, candidate_index)
+            assert recommended == expected, (code, n)
+            recommended_products += bool(recommended)
+    assert recommended_products > 0
+
+
+class JaccardComparator(CategoriesComparator):
+    """Jaccard similarity of comma-separated categories, counting its comparisons"""
+    def __init__(self) -> None:
+        self.comparisons = 0
+
+    def compare(self, product_categories: str, user_categories: str) -> float:
+        self.comparisons += 1
+        if not isinstance(product_categories, str):
+            return -np.inf
+        product, user = set(product_categories.split(",")), set(user_categories.split(","))
+        return len(product & user) / len(product | user)
+
+
+def test_category_fallback_compares_each_distinct_category_once(snapshot, similarities):
+    dataset = snapshot.dataset.copy()
+    assert isinstance(dataset["categories_en"].dtype, pd.CategoricalDtype)
+    dataset.loc[::7, "categories_en"] = np.nan
+    as_text = dataset.assign(categories_en=dataset["categories_en"].astype(object))
+    # no product has neighbors, all of them fall back on their categories
+    no_neighbors = NeighborIndex.from_frame(similarities.iloc[:0], snapshot.code_index)
+    comparator = JaccardComparator()
+    engine = RecommendationEngine(categories_similarity_threshold=0.5, categories_comparator=comparator)
+
+    recommended_products = 0
+    for row in range(0, len(dataset), 8):
+        product = OpenFoodFactsProduct(snapshot.code_index.code_at(row), dataset.iloc[row])
+        comparator.comparisons = 0
+        recommended = engine.find_recommendations(dataset, product, snapshot.code_index, no_neighbors, 5)
+        assert comparator.comparisons <= len(dataset["categories_en"].cat.categories)
+        assert recommended == engine.find_recommendations(as_text, product, snapshot.code_index, no_neighbors, 5), row
+        recommended_products += bool(recommended)
+    assert recommended_products > 0
+
+
+def test_embedding_comparator_compares_codes_like_strings(raw_dataset):
+    categories = raw_dataset["categories_en"].astype("category")
+    categories[::7] = np.nan
+    comparator = EmbeddingCategoriesComparator()
+    source = categories.iat[1]
+    from_codes = comparator.compare_codes(source, categories.cat.categories.to_numpy(dtype=object), categories.cat.codes.to_numpy())
+    missing = categories.isna().to_numpy()
+    assert np.isneginf(from_codes[missing]).all()
+    np.testing.assert_allclose(from_codes[~missing], comparator.compare_many(source, categories[~missing].to_numpy(dtype=object)), rtol=1e-6)
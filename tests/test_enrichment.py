@@ -0,0 +1,33 @@
+import numpy as np
+import pandas as pd
+from services.recommendation.enrichment import DatasetEnricher
+from services.recommendation.factors.nutritional_rating_systems.nutriscore import Nutriscore
+from services.recommendation.factors.nutritional_rating_systems.nutritional_rating_system import NutritionalRatingSystem
+from services.recommendation.strategy import RecommendationStrategy
+
+
+class ScaledNutriscore(Nutriscore):
+    """Nutri-Score rating products through the default ordinals of its declared scale"""
+    rating_ordinals = NutritionalRatingSystem.rating_ordinals
+
+
+class UnscaledNutriscore(ScaledNutriscore):
+    rating_scale = None
+
+
+def enricher_of(rating_system: NutritionalRatingSystem) -> DatasetEnricher:
+    default = RecommendationStrategy.create_default()
+    return DatasetEnricher(RecommendationStrategy(default.recommendation_factors, rating_system))
+
+
+def test_default_rating_ordinals_follow_the_rating_scale(raw_dataset: pd.DataFrame):
+    enriched = enricher_of(ScaledNutriscore()).enrich(raw_dataset.copy())
+    np.testing.assert_array_equal(enriched[Nutriscore.rating_ordinal_column], Nutriscore()._rate_ordinals(raw_dataset))
+
+
+def test_rating_system_without_a_scale_is_not_precomputed(raw_dataset: pd.DataFrame):
+    enricher = enricher_of(UnscaledNutriscore())
+    assert enricher.recommendation_strategy.nutritional_rating_system.rating_ordinals(raw_dataset) is None
+    enriched = enricher.enrich(raw_dataset.copy())
+    assert Nutriscore.rating_ordinal_column not in enriched.columns
+    assert not enriched["nutriscore_score"].isna().any()
@@ -0,0 +1,53 @@
+import threading
+from utils.large_dataset_cache import LargeDatasetCache
+
+
+def test_stats_and_other_entries_do_not_wait_for_a_load():
+    cache = LargeDatasetCache()
+    started, release = threading.Event(), threading.Event()
+
+    def slow_loader(_):
+        started.set()
+        release.wait(5)
+        return [1, 2, 3]
+
+    loading = threading.Thread(target=cache.get, args=("slow",), kwargs={"loader": slow_loader})
+    loading.start()
+    try:
+        assert started.wait(5)
+        assert cache.get_stats()["misses"] == 1
+        assert cache.get("other", loader=lambda _: "value") == "value"
+    finally:
+        release.set()
+        loading.join()
+    assert cache.get("slow", loader=lambda _: None) == [1, 2, 3]
+
+
+def test_concurrent_gets_share_one_load():
+    cache = LargeDatasetCache()
+    calls, release = [], threading.Event()
+
+    def loader(key):
+        calls.append(key)
+        release.wait(5)
+        return {"key": key}
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get("entry", loader=loader))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert calls == ["entry"]
+    assert results == [{"key": "entry"}] * 4
+
+
+def test_failed_load_returns_default_and_is_retried():
+    cache = LargeDatasetCache()
+
+    def failing(_):
+        raise OSError("unreadable")
+
+    assert cache.get("entry", default="default", loader=failing) == "default"
+    assert cache.get("entry", loader=lambda _: "loaded") == "loaded"
@@ -0,0 +1,22 @@
+import logging
+import queue
+import sys
+from utils.logger import _DeferredQueueHandler
+
+
+def test_queued_record_keeps_its_arguments_as_they_were_logged():
+    handler = _DeferredQueueHandler(queue.SimpleQueue())
+    arguments = {"status": "loading"}
+    try:
+        raise ValueError("broken")
+    except ValueError:
+        record = logging.LogRecord("test", logging.ERROR, __file__, 1, "state %s", (arguments,), sys.exc_info())
+    handler.handle(record)
+    arguments["status"] = "ready"
+
+    queued = handler.queue.get_nowait()
+    assert queued.msg == "state {'status': 'loading'}"
+    assert queued.args is None
+    # the traceback is left to the listener
+    assert queued.exc_info is not None and queued.exc_text is None
+    assert "ValueError: broken" in logging.Formatter().format(queued)
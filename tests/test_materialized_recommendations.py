@@ -0,0 +1,29 @@
+import numpy as np
+from utils.materialized_recommendations import MaterializedRecommendations, snapshot_fingerprint
+
+
+def write_table(path, snapshot):
+    n_products = len(snapshot.code_index.codes)
+    MaterializedRecommendations(
+        indptr=np.zeros(n_products + 1, dtype=np.int64),
+        rows=np.zeros(0, dtype=np.int32),
+        complete=np.ones(n_products, dtype=bool),
+        top_n=5,
+        settings={},
+        fingerprint=snapshot_fingerprint(snapshot.dataset, snapshot.code_index, snapshot.neighbor_index),
+    ).save(path)
+
+
+def test_table_is_loaded_for_the_data_it_was_computed_on(tmp_path, snapshot):
+    write_table(tmp_path / "recommendations.npz", snapshot)
+    table = MaterializedRecommendations.load_for(tmp_path / "recommendations.npz", snapshot.dataset, snapshot.code_index, snapshot.neighbor_index)
+    assert table is not None
+    assert len(table) == len(snapshot.code_index.codes)
+
+
+def test_table_is_ignored_once_ranking_columns_change(tmp_path, snapshot):
+    write_table(tmp_path / "recommendations.npz", snapshot)
+    for column in ("nutriscore_score", "nutriscore_grade_ordinal", "has_milk"):
+        refreshed = snapshot.dataset.copy()
+        refreshed[column] = refreshed[column].to_numpy()[::-1]
+        assert MaterializedRecommendations.load_for(tmp_path / "recommendations.npz", refreshed, snapshot.code_index, snapshot.neighbor_index) is None
@@ -0,0 +1,13 @@
+from services.recommendation.factors.recommendation_factor import FactorPreferenceStatus, PreferenceVector
+
+
+def test_status_lookup_leaves_equality_and_hash_unchanged():
+    looked_up = PreferenceVector.from_statuses({"milk": FactorPreferenceStatus.AVOID, "organic": FactorPreferenceStatus.RECOMMEND})
+    fresh = PreferenceVector.from_statuses({"organic": FactorPreferenceStatus.RECOMMEND, "milk": FactorPreferenceStatus.AVOID})
+
+    assert looked_up.status_of("milk") == FactorPreferenceStatus.AVOID
+    assert looked_up.status_of("organic") == FactorPreferenceStatus.RECOMMEND
+    assert looked_up.status_of("eggs") == FactorPreferenceStatus.NEUTRAL
+    assert looked_up == fresh
+    assert hash(looked_up) == hash(fresh)
+    assert {fresh: "cached"}[looked_up] == "cached"
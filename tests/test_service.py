@@ -0,0 +1,51 @@
+import asyncio
+import dataclasses
+import pandas as pd
+from conftest import SnapshotManager
+from models.schemas.product_recommendation import ProductRecommendationRequest
+from services.recommendation.service import RecommendationService
+from utils.result_cache import ResultCache
+from utils.worker_pool import WorkerPool
+
+
+def test_recommends_fallback_scored_products(raw_dataset: pd.DataFrame, snapshot, engine):
+    service = RecommendationService(SnapshotManager(snapshot), worker_pool=WorkerPool(max_workers=1), engine=engine)
+    missing_grade = set(raw_dataset["code"][raw_dataset["nutriscore_grade"].isna()])
+
+    async def recommend_all():
+        return [
+            await service.generate_recommendations(ProductRecommendationRequest(product_code=code, limit=5))
+            for code in raw_dataset["code"]
+        ]
+
+    recommended = [product for recommendations in asyncio.run(recommend_all()) for product in recommendations]
+    fallback_scored = [product for product in recommended if product.code in missing_grade]
+    assert fallback_scored, "no product without a grade was recommended"
+    for product in fallback_scored:
+        assert product.nutriscore in {"A", "B", "C", "D", "E"}
+
+
+
+def test_request_on_a_previous_snapshot_keeps_the_cached_results(raw_dataset: pd.DataFrame, snapshot, engine):
+    previous, current = snapshot, dataclasses.replace(snapshot, version=snapshot.version + 1)
+    manager = SnapshotManager(current)
+    result_cache = ResultCache()
+    service = RecommendationService(manager, result_cache=result_cache, worker_pool=WorkerPool(max_workers=1), engine=engine)
+    codes = list(raw_dataset["code"][:10])
+
+    async def recommend(code):
+        return await service.generate_recommendations(ProductRecommendationRequest(product_code=code, limit=5))
+
+    async def scenario():
+        for code in codes:
+            await recommend(code)
+        # a request still running on the snapshot a reload replaced
+        manager.snapshot = previous
+        await recommend(codes[0])
+        manager.snapshot = current
+        hits = result_cache.get_stats()["hits"]
+        for code in codes:
+            await recommend(code)
+        return result_cache.get_stats()["hits"] - hits
+
+    assert asyncio.run(scenario()) == len(codes)